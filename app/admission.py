@@ -0,0 +1,278 @@
+"""Admission control: concurrency limits per route group that follow latency, and load shedding.
+
+Every ``/api`` request except the ops endpoints and the change feed belongs to a
+group: checkout, basket, catalog (every other read), admin (every other write)
+or bulk (imports and exports). A group runs at most its limit of requests at a
+time, the rest waits in a bounded queue. A request finding the queue full, or
+waiting longer than ADMISSION_QUEUE_TIMEOUT, gets a 503 with Retry-After right
+away instead of queueing on the connection pool and slowing down everything.
+
+Limits start at their configured maximum and adapt like TCP congestion control:
+while a group's recent latency is above ADMISSION_LATENCY_TOLERANCE times its
+long-term average, or when a request is answered with 503, the limit is cut by a
+tenth, once per round trip; otherwise it grows back by one per limit's worth of
+requests.
+
+Checkout and basket requests come first. Slots that free up go to their queues
+before the others', and catalog, admin and bulk requests leave ADMISSION_RESERVED
+of the worker's ADMISSION_CAPACITY for them.
+"""
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+
+from . import metrics
+from .database import POOL_MAX_OVERFLOW, POOL_SIZE
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# requests a worker runs at once over all groups, by default one per pooled connection
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", str(POOL_SIZE + POOL_MAX_OVERFLOW)))
+# part of the capacity only checkout and basket requests may use
+ADMISSION_RESERVED = int(os.getenv("ADMISSION_RESERVED", str(max(1, ADMISSION_CAPACITY // 5))))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+CHECKOUT = "checkout"
+BASKET = "basket"
+CATALOG = "catalog"
+ADMIN = "admin"
+BULK = "bulk"
+# in priority order
+GROUPS = (CHECKOUT, BASKET, CATALOG, ADMIN, BULK)
+PRIORITY_GROUPS = (CHECKOUT, BASKET)
+
+_DEFAULT_LIMITS = {CHECKOUT: ADMISSION_CAPACITY // 2, BASKET: ADMISSION_CAPACITY, CATALOG: ADMISSION_CAPACITY,
+                   ADMIN: ADMISSION_CAPACITY // 4, BULK: 2}
+
+
+def _limits(setting: str) -> Dict[str, int]:
+    # "catalog=20,admin=4", groups left out keep their default
+    limits = dict(_DEFAULT_LIMITS)
+    for item in setting.split(","):
+        if item.strip():
+            group, _, limit = item.partition("=")
+            if group.strip() not in limits:
+                raise ValueError(f"unknown admission group {group.strip()!r} in ADMISSION_LIMITS")
+            limits[group.strip()] = int(limit)
+    return {group: max(1, limit) for group, limit in limits.items()}
+
+
+# the most requests of each group running at once
+ADMISSION_LIMITS = _limits(os.getenv("ADMISSION_LIMITS", ""))
+
+_EXEMPT = ("/api/ops/", "/api/changes/")
+_PREFIXES = (("/api/order/", CHECKOUT), ("/api/shopping-basket/", BASKET), ("/api/bulk/", BULK))
+
+
+class OverloadedError(Exception):
+    def __init__(self, group: str, reason: str):
+        super().__init__(f"too many {group} requests, {reason}")
+        self.group = group
+        self.reason = reason
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """The group of a request, None for requests that are not limited."""
+    if not path.startswith("/api/") or path.startswith(_EXEMPT):
+        return None
+    for prefix, group in _PREFIXES:
+        if path.startswith(prefix):
+            return group
+    return CATALOG if method in ("GET", "HEAD") else ADMIN
+
+
+class AdaptiveLimit:
+    """Concurrency limit between ``minimum`` and ``maximum``, additive increase and multiplicative decrease.
+
+    Congestion is the recent average latency (weight ``recent_weight`` per request) rising above
+    ``tolerance`` times the long-term one (``baseline_weight``); averages rather than a minimum,
+    since a group mixes fast lookups with slower searches. Requests that started before the last
+    cut don't cut again, they ran under the old limit.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, tolerance: float = ADMISSION_LATENCY_TOLERANCE,
+                 backoff: float = 0.9, recent_weight: float = 0.1, baseline_weight: float = 0.01):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.recent_weight = recent_weight
+        self.baseline_weight = baseline_weight
+        self.value = float(maximum)
+        self.recent: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self._cut_at = float("-inf")
+
+    @property
+    def current(self) -> int:
+        return max(self.minimum, int(self.value))
+
+    def observe(self, started: float, latency: float, inflight: int, overloaded: bool = False) -> None:
+        """Account for a request that ran ``latency`` seconds from ``started`` next to ``inflight`` others."""
+        if self.baseline is None:
+            self.recent = self.baseline = latency
+        else:
+            self.recent += (latency - self.recent) * self.recent_weight
+            self.baseline += (latency - self.baseline) * self.baseline_weight
+        if overloaded or self.recent > self.tolerance * self.baseline:
+            if started >= self._cut_at:
+                self.value = max(float(self.minimum), self.value * self.backoff)
+                self._cut_at = started + latency
+        elif inflight * 2 >= self.value:
+            # only a limit that is being used grows, an idle group would otherwise drift to the maximum
+            self.value = min(float(self.maximum), self.value + 1 / self.value)
+
+
+class Group:
+    def __init__(self, name: str, limit: AdaptiveLimit, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 priority: bool = False):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.priority = priority
+        self.inflight = 0
+        self.waiters: deque = deque()
+        self.admitted = 0
+        self.shed: Counter = Counter()
+        self.queue_wait = metrics.Histogram(metrics.WAIT_BUCKETS)
+
+    def snapshot(self) -> dict:
+        return dict(
+            limit=self.limit.current,
+            inflight=self.inflight,
+            queued=len(self.waiters),
+            admitted=self.admitted,
+            shed=dict(self.shed),
+            latency_ms=round(1000 * self.limit.recent, 3) if self.limit.recent is not None else None,
+            baseline_ms=round(1000 * self.limit.baseline, 3) if self.limit.baseline is not None else None,
+            queue_wait_buckets=self.queue_wait.cumulative(),
+            queue_wait_sum=self.queue_wait.total,
+            queue_wait_count=self.queue_wait.count,
+        )
+
+
+class AdmissionControl:
+    """Admits requests of groups given in priority order."""
+
+    def __init__(self, groups: List[Group], capacity: int = ADMISSION_CAPACITY, reserved: int = ADMISSION_RESERVED,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, clock: Callable[[], float] = time.perf_counter):
+        self.groups = {group.name: group for group in groups}
+        self.capacity = capacity
+        self.reserved = reserved
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.inflight = 0
+
+    def _has_room(self, group: Group) -> bool:
+        if group.inflight >= group.limit.current:
+            return False
+        return self.capacity - self.inflight > (0 if group.priority else self.reserved)
+
+    def _blocked(self, group: Group) -> bool:
+        # a group before this one waits for capacity, not for its own limit
+        for other in self.groups.values():
+            if other is group:
+                return False
+            if other.waiters and other.inflight < other.limit.current:
+                return True
+        return False
+
+    def _admit(self, group: Group) -> None:
+        group.inflight += 1
+        group.admitted += 1
+        self.inflight += 1
+
+    def _free(self, group: Group) -> None:
+        group.inflight -= 1
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        for group in self.groups.values():
+            while group.waiters and self._has_room(group):
+                future = group.waiters.popleft()
+                if not future.done():
+                    self._admit(group)
+                    future.set_result(None)
+            if group.waiters and group.inflight < group.limit.current:
+                # lower priorities wait until this group got the capacity it is waiting for
+                return
+
+    async def acquire(self, name: str) -> None:
+        """Wait for a slot of group ``name``; raises OverloadedError when the request is shed."""
+        group = self.groups[name]
+        if not group.waiters and not self._blocked(group) and self._has_room(group):
+            self._admit(group)
+            return
+        if len(group.waiters) >= group.queue_size:
+            group.shed["queue_full"] += 1
+            raise OverloadedError(name, "the queue is full")
+        future = asyncio.get_running_loop().create_future()
+        group.waiters.append(future)
+        queued = self.clock()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done():
+                self._free(group)
+            else:
+                group.waiters.remove(future)
+                future.cancel()
+            raise
+        if not future.done():
+            group.waiters.remove(future)
+            future.cancel()
+            group.shed["timeout"] += 1
+            raise OverloadedError(name, f"waited {self.queue_timeout:g}s for a slot")
+        group.queue_wait.observe(self.clock() - queued)
+
+    def release(self, name: str, started: float, latency: float, overloaded: bool = False) -> None:
+        group = self.groups[name]
+        group.limit.observe(started, latency, group.inflight, overloaded)
+        self._free(group)
+
+    def status(self) -> Dict[str, dict]:
+        return {name: group.snapshot() for name, group in self.groups.items()}
+
+
+control = AdmissionControl([
+    Group(name, AdaptiveLimit(ADMISSION_LIMITS[name]), priority=name in PRIORITY_GROUPS) for name in GROUPS])
+
+
+class AdmissionMiddleware:
+    """Runs limited requests through ``control``, answering 503 for the ones it sheds."""
+
+    def __init__(self, app, admission: AdmissionControl = None):
+        self.app = app
+        self.admission = admission or control
+
+    async def __call__(self, scope, receive, send):
+        group = classify(scope["method"], scope["path"]) if scope["type"] == "http" and ADMISSION_CONTROL else None
+        if group is None:
+            return await self.app(scope, receive, send)
+        try:
+            await self.admission.acquire(group)
+        except OverloadedError as e:
+            response = JSONResponse(status_code=503, content={"detail": str(e)},
+                                    headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+            return await response(scope, receive, send)
+        started = self.admission.clock()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # a 503 here is the pool timing out, the database is already past its limit
+            self.admission.release(group, started, self.admission.clock() - started, overloaded=status == 503)
@@ -0,0 +1,659 @@
+"""Key-value tier in front of the basket tables for anonymous carts.
+
+With BASKET_STORE_URL set, new baskets live in memory (``memory://``, one worker
+only) or in Redis (``redis://...``) and their mutations never touch Postgres. A
+background task writes changed baskets to ``shopping_basket`` and its items in
+batches (write-behind), and baskets nobody touches for BASKET_TTL seconds simply
+expire from the store.
+
+Checkout hands a basket over to Postgres: it is locked in the store, so mutations
+that come in meanwhile get a 409 instead of being lost, written to the basket
+tables and taken out of the store. Stored baskets hold no stock reservations,
+availability is only checked when items are added; the hand-over reserves stock
+for every line, like crud does when items are added, and fails with
+OutOfStockError when it cannot. Baskets that are not in the store, made before it
+was enabled, handed over or expired from it after being persisted, keep going
+through crud as before. ``purge_forever`` deletes persisted baskets that have been stale for
+BASKET_RETENTION seconds, whichever way they were written.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, read_models, reservations, schemas
+from .reservations import OutOfStockError
+from .tax import DEFAULT_COUNTRY, line_tax, tax_rate_for
+from .translations import DEFAULT_LANGUAGES
+
+logger = logging.getLogger(__name__)
+
+# memory:// for a single worker, redis://... to share baskets between workers; empty keeps them in Postgres only
+BASKET_STORE_URL = os.getenv("BASKET_STORE_URL", "")
+# seconds an untouched basket stays in the store
+BASKET_TTL = int(os.getenv("BASKET_TTL", str(2 * 24 * 3600)))
+BASKET_FLUSH_INTERVAL = float(os.getenv("BASKET_FLUSH_INTERVAL", "30"))
+BASKET_FLUSH_BATCH_SIZE = int(os.getenv("BASKET_FLUSH_BATCH_SIZE", "500"))
+# persisted baskets not updated for this many seconds are deleted
+BASKET_RETENTION = float(os.getenv("BASKET_RETENTION", str(30 * 24 * 3600)))
+BASKET_PURGE_INTERVAL = float(os.getenv("BASKET_PURGE_INTERVAL", "3600"))
+BASKET_PURGE_BATCH_SIZE = int(os.getenv("BASKET_PURGE_BATCH_SIZE", "500"))
+
+# seconds a basket stays locked for checkout when the worker handing it over goes away
+BASKET_CHECKOUT_LOCK = float(os.getenv("BASKET_CHECKOUT_LOCK", "30"))
+
+# concurrent mutations of one basket retry on a version conflict this many times
+MAX_ATTEMPTS = 5
+
+
+class BasketConflictError(Exception):
+    def __init__(self, basket_id: uuid.UUID, message: str = "is being changed concurrently, try again"):
+        super().__init__(f"basket {basket_id} {message}")
+        self.basket_id = basket_id
+
+
+@dataclass
+class StoredLine:
+    id: uuid.UUID
+    product_id: uuid.UUID
+    price: int
+    amount: int
+    tax_rate: int
+
+
+@dataclass
+class StoredBasket:
+    id: uuid.UUID
+    country: str
+    lines: Dict[uuid.UUID, StoredLine] = field(default_factory=dict)
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+    # wall clock time until which a checkout holds the basket
+    locked_until: Optional[float] = None
+
+    def locked(self) -> bool:
+        return self.locked_until is not None and self.locked_until > time.time()
+
+    def add(self, product_id: uuid.UUID, amount: int, price: int, tax_rate: int) -> None:
+        """Like a basket upsert: an existing line keeps the price and rate it was added with."""
+        line = self.lines.get(product_id)
+        if line is None:
+            self.lines[product_id] = StoredLine(uuid.uuid4(), product_id, price, amount, tax_rate)
+        else:
+            line.amount += amount
+
+    def set_amount(self, product_id: uuid.UUID, amount: int) -> None:
+        if amount <= 0:
+            self.lines.pop(product_id, None)
+        elif product_id in self.lines:
+            self.lines[product_id].amount = amount
+
+    def line_by_id(self, item_id: uuid.UUID) -> Optional[StoredLine]:
+        return next((line for line in self.lines.values() if line.id == item_id), None)
+
+    def totals(self) -> read_models.ShoppingBasketTotalsView:
+        inclusive = sum(line.price * line.amount for line in self.lines.values())
+        tax = sum(line_tax(line.price, line.amount, line.tax_rate) for line in self.lines.values())
+        return read_models.ShoppingBasketTotalsView(
+            id=self.id, country=self.country, item_count=len(self.lines),
+            quantity=sum(line.amount for line in self.lines.values()),
+            total_price_inclusive=inclusive, total_price_exclusive=inclusive - tax, tax=tax)
+
+    def dumps(self) -> bytes:
+        return json.dumps({
+            "id": str(self.id), "country": self.country,
+            "created_at": self.created_at.isoformat(), "updated_at": self.updated_at.isoformat(),
+            "locked_until": self.locked_until,
+            "lines": [[str(line.id), str(line.product_id), line.price, line.amount, line.tax_rate]
+                      for line in self.lines.values()],
+        }).encode()
+
+    @classmethod
+    def loads(cls, data: bytes) -> "StoredBasket":
+        raw = json.loads(data)
+        lines = [StoredLine(uuid.UUID(line_id), uuid.UUID(product_id), price, amount, tax_rate)
+                 for line_id, product_id, price, amount, tax_rate in raw["lines"]]
+        return cls(uuid.UUID(raw["id"]), raw["country"], {line.product_id: line for line in lines},
+                   datetime.fromisoformat(raw["created_at"]), datetime.fromisoformat(raw["updated_at"]),
+                   raw.get("locked_until"))
+
+
+class BasketBackend(ABC):
+    """Versioned basket blobs with a TTL, an index from item id to basket and the set of unflushed baskets.
+
+    ``put`` is a compare-and-set: it stores version ``expected + 1`` only while the
+    stored version is still ``expected`` (0 for a basket that does not exist yet).
+    """
+
+    @abstractmethod
+    async def get(self, basket_id: uuid.UUID) -> Optional[Tuple[int, bytes]]:
+        ...
+
+    @abstractmethod
+    async def put(self, basket_id: uuid.UUID, data: bytes, expected: int, item_ids: Iterable[uuid.UUID]) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete(self, basket_id: uuid.UUID, expected: Optional[int] = None) -> bool:
+        """Delete a basket, only while its version is still ``expected`` when that is given."""
+
+    @abstractmethod
+    async def find_item(self, item_id: uuid.UUID) -> Optional[uuid.UUID]:
+        ...
+
+    @abstractmethod
+    async def take_dirty(self, limit: int) -> List[uuid.UUID]:
+        ...
+
+    @abstractmethod
+    async def mark_dirty(self, basket_ids: Iterable[uuid.UUID]) -> None:
+        ...
+
+    async def expire(self) -> int:
+        """Drop expired baskets where the storage does not do it by itself."""
+        return 0
+
+
+class MemoryBasketBackend(BasketBackend):
+    def __init__(self, ttl: int = BASKET_TTL, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        # basket id -> (version, expires at, data, item ids)
+        self._baskets: Dict[uuid.UUID, Tuple[int, float, bytes, Tuple[uuid.UUID, ...]]] = {}
+        self._items: Dict[uuid.UUID, uuid.UUID] = {}
+        self._dirty: Dict[uuid.UUID, None] = {}
+
+    def __len__(self) -> int:
+        return len(self._baskets)
+
+    def _live(self, basket_id: uuid.UUID):
+        entry = self._baskets.get(basket_id)
+        if entry is not None and entry[1] <= self._clock():
+            self._drop(basket_id)
+            return None
+        return entry
+
+    def _drop(self, basket_id: uuid.UUID) -> None:
+        entry = self._baskets.pop(basket_id, None)
+        if entry is not None:
+            for item_id in entry[3]:
+                self._items.pop(item_id, None)
+        self._dirty.pop(basket_id, None)
+
+    async def get(self, basket_id: uuid.UUID) -> Optional[Tuple[int, bytes]]:
+        entry = self._live(basket_id)
+        return (entry[0], entry[2]) if entry is not None else None
+
+    async def put(self, basket_id: uuid.UUID, data: bytes, expected: int, item_ids: Iterable[uuid.UUID]) -> bool:
+        entry = self._live(basket_id)
+        if (entry[0] if entry is not None else 0) != expected:
+            return False
+        item_ids = tuple(item_ids)
+        for item_id in entry[3] if entry is not None else ():
+            self._items.pop(item_id, None)
+        self._baskets[basket_id] = (expected + 1, self._clock() + self.ttl, data, item_ids)
+        for item_id in item_ids:
+            self._items[item_id] = basket_id
+        self._dirty[basket_id] = None
+        return True
+
+    async def delete(self, basket_id: uuid.UUID, expected: Optional[int] = None) -> bool:
+        entry = self._live(basket_id)
+        if expected is not None and (entry[0] if entry is not None else 0) != expected:
+            return False
+        self._drop(basket_id)
+        return True
+
+    async def find_item(self, item_id: uuid.UUID) -> Optional[uuid.UUID]:
+        basket_id = self._items.get(item_id)
+        return basket_id if basket_id is not None and self._live(basket_id) is not None else None
+
+    async def take_dirty(self, limit: int) -> List[uuid.UUID]:
+        taken = list(self._dirty)[:limit]
+        for basket_id in taken:
+            del self._dirty[basket_id]
+        return taken
+
+    async def mark_dirty(self, basket_ids: Iterable[uuid.UUID]) -> None:
+        for basket_id in basket_ids:
+            if basket_id in self._baskets:
+                self._dirty[basket_id] = None
+
+    async def expire(self) -> int:
+        now = self._clock()
+        expired = [basket_id for basket_id, entry in self._baskets.items() if entry[1] <= now]
+        for basket_id in expired:
+            self._drop(basket_id)
+        return len(expired)
+
+
+class RedisBasketBackend(BasketBackend):
+    """Baskets as hashes of version and data; Redis expires them together with their item index keys."""
+
+    def __init__(self, url: str, ttl: int = BASKET_TTL, prefix: str = "basket:"):
+        import redis.asyncio as redis  # optional dependency, only needed when BASKET_STORE_URL is redis://
+
+        self._redis = redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.ttl = ttl
+        self.prefix = prefix
+        self.dirty_key = prefix + "dirty"
+
+    def _key(self, basket_id: uuid.UUID) -> str:
+        return f"{self.prefix}{basket_id}"
+
+    def _item_key(self, item_id: uuid.UUID) -> str:
+        return f"{self.prefix}item:{item_id}"
+
+    async def get(self, basket_id: uuid.UUID) -> Optional[Tuple[int, bytes]]:
+        version, data = await self._redis.hmget(self._key(basket_id), "version", "data")
+        return (int(version), data) if data is not None else None
+
+    async def put(self, basket_id: uuid.UUID, data: bytes, expected: int, item_ids: Iterable[uuid.UUID]) -> bool:
+        key = self._key(basket_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if int(await pipe.hget(key, "version") or 0) != expected:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={"version": expected + 1, "data": data})
+                pipe.expire(key, self.ttl)
+                for item_id in item_ids:
+                    pipe.set(self._item_key(item_id), str(basket_id), ex=self.ttl)
+                pipe.sadd(self.dirty_key, str(basket_id))
+                await pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+    async def delete(self, basket_id: uuid.UUID, expected: Optional[int] = None) -> bool:
+        # item index keys point at a basket that is gone, they expire on their own
+        key = self._key(basket_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if expected is not None and int(await pipe.hget(key, "version") or 0) != expected:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.srem(self.dirty_key, str(basket_id))
+                await pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+    async def find_item(self, item_id: uuid.UUID) -> Optional[uuid.UUID]:
+        basket_id = await self._redis.get(self._item_key(item_id))
+        return uuid.UUID(basket_id.decode()) if basket_id is not None else None
+
+    async def take_dirty(self, limit: int) -> List[uuid.UUID]:
+        taken = await self._redis.spop(self.dirty_key, limit)
+        return [uuid.UUID(basket_id.decode()) for basket_id in taken or ()]
+
+    async def mark_dirty(self, basket_ids: Iterable[uuid.UUID]) -> None:
+        basket_ids = [str(basket_id) for basket_id in basket_ids]
+        if basket_ids:
+            await self._redis.sadd(self.dirty_key, *basket_ids)
+
+
+async def _prices(db: AsyncSession, country: str, product_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, tuple]:
+    """(price, tax rate, stock) of the products that exist, read in one statement."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    product = models.Product
+    result = await db.execute(
+        select(product.id, product.price, tax_rate_for(country, product.category_id), product.stock)
+        .where(product.id.in_(product_ids)))
+    return {row[0]: tuple(row[1:]) for row in result.all()}
+
+
+class BasketStore:
+    def __init__(self, backend: BasketBackend):
+        self.backend = backend
+
+    async def get(self, basket_id: uuid.UUID) -> Optional[StoredBasket]:
+        found = await self.backend.get(basket_id)
+        return StoredBasket.loads(found[1]) if found is not None else None
+
+    async def _save(self, basket: StoredBasket, expected: int) -> bool:
+        basket.updated_at = datetime.now()
+        return await self.backend.put(basket.id, basket.dumps(), expected,
+                                      [line.id for line in basket.lines.values()])
+
+    @staticmethod
+    def _add(basket: StoredBasket, amounts: Dict[uuid.UUID, int], prices: Dict[uuid.UUID, tuple]) -> None:
+        for product_id in sorted(amounts):
+            if product_id not in prices:
+                continue
+            price, tax_rate, stock = prices[product_id]
+            line = basket.lines.get(product_id)
+            if (line.amount if line else 0) + amounts[product_id] > stock:
+                raise OutOfStockError(product_id, amounts[product_id])
+            basket.add(product_id, amounts[product_id], price, tax_rate)
+
+    async def _prices(self, db: AsyncSession, basket_id: uuid.UUID,
+                      product_ids: Iterable[uuid.UUID]) -> Optional[Dict[uuid.UUID, tuple]]:
+        # read before the mutation, so a retried compare-and-set never goes back to Postgres
+        basket = await self.get(basket_id)
+        return await _prices(db, basket.country, product_ids) if basket is not None else None
+
+    async def create(self, db: AsyncSession, data: schemas.ShoppingBasketCreate) -> StoredBasket:
+        basket = StoredBasket(uuid.uuid4(), data.country or DEFAULT_COUNTRY)
+        if data.items:
+            amounts = crud.requested_amounts(data.items)
+            self._add(basket, amounts, await _prices(db, basket.country, amounts))
+        await self._save(basket, 0)
+        return basket
+
+    async def _mutate(self, basket_id: uuid.UUID,
+                      mutation: Callable[[StoredBasket], None]) -> Optional[Tuple[StoredBasket, int]]:
+        for _ in range(MAX_ATTEMPTS):
+            found = await self.backend.get(basket_id)
+            if found is None:
+                return None
+            version, data = found
+            basket = StoredBasket.loads(data)
+            if basket.locked():
+                raise BasketConflictError(basket_id, "is being checked out")
+            mutation(basket)
+            if await self._save(basket, version):
+                return basket, version + 1
+        raise BasketConflictError(basket_id)
+
+    async def mutate(self, basket_id: uuid.UUID,
+                     mutation: Callable[[StoredBasket], None]) -> Optional[StoredBasket]:
+        """Apply ``mutation`` to the current basket and store it, again on a concurrent change. None when unknown."""
+        mutated = await self._mutate(basket_id, mutation)
+        return mutated[0] if mutated is not None else None
+
+    async def add_items(self, db: AsyncSession, basket_id: uuid.UUID,
+                        amounts: Dict[uuid.UUID, int]) -> Optional[StoredBasket]:
+        prices = await self._prices(db, basket_id, amounts)
+        if prices is None:
+            return None
+        return await self.mutate(basket_id, lambda basket: self._add(basket, amounts, prices))
+
+    async def set_amount(self, db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                         amount: int) -> Optional[StoredBasket]:
+        prices = await self._prices(db, basket_id, [product_id] if amount > 0 else [])
+        if prices is None:
+            return None
+
+        def mutation(basket):
+            line = basket.lines.get(product_id)
+            old = line.amount if line is not None else 0
+            if amount <= old:
+                basket.set_amount(product_id, amount)
+            else:
+                self._add(basket, {product_id: amount - old}, prices)
+
+        return await self.mutate(basket_id, mutation)
+
+    async def change_amount(self, db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                            delta: int) -> Optional[StoredBasket]:
+        prices = await self._prices(db, basket_id, [product_id] if delta > 0 else [])
+        if prices is None:
+            return None
+
+        def mutation(basket):
+            if delta > 0:
+                self._add(basket, {product_id: delta}, prices)
+            elif delta < 0 and product_id in basket.lines:
+                basket.set_amount(product_id, basket.lines[product_id].amount + delta)
+
+        return await self.mutate(basket_id, mutation)
+
+    async def remove_item(self, item_id: uuid.UUID) -> bool:
+        """Remove a line by its item id; False when no stored basket has it."""
+        basket_id = await self.backend.find_item(item_id)
+        if basket_id is None:
+            return False
+
+        def mutation(basket):
+            line = basket.line_by_id(item_id)
+            if line is not None:
+                basket.set_amount(line.product_id, 0)
+
+        return await self.mutate(basket_id, mutation) is not None
+
+    async def hand_over(self, db: AsyncSession, basket_id: uuid.UUID) -> bool:
+        """Move a basket to Postgres with stock reserved for its lines, as checkout needs it there.
+
+        False when it is not in the store. Raises OutOfStockError, leaving the basket in the
+        store, and BasketConflictError while another checkout holds it.
+        """
+        lock = time.time() + BASKET_CHECKOUT_LOCK
+
+        def mutation(basket):
+            basket.locked_until = lock
+
+        mutated = await self._mutate(basket_id, mutation)
+        if mutated is None:
+            return False
+        basket, locked = mutated
+        try:
+            await persist_baskets(db, [basket])
+            await reservations.reserve(db, basket_id, {line.product_id: line.amount for line in basket.lines.values()})
+            # the version only moved if the lock ran out and the basket was changed after all
+            if not await self.backend.delete(basket_id, expected=locked):
+                raise BasketConflictError(basket_id)
+        except BaseException:
+            await db.rollback()
+            basket.locked_until = None
+            await self._save(basket, locked)
+            raise
+        try:
+            await db.commit()
+        except BaseException:
+            # out of the store but not in Postgres: put it back
+            basket.locked_until = None
+            await self._save(basket, 0)
+            raise
+        return True
+
+    async def flush(self, db: AsyncSession, batch_size: int = BASKET_FLUSH_BATCH_SIZE) -> int:
+        """Write one batch of changed baskets to Postgres. Returns how many were taken off the dirty set."""
+        basket_ids = await self.backend.take_dirty(batch_size)
+        if not basket_ids:
+            return 0
+        try:
+            baskets = [basket for basket in [await self.get(basket_id) for basket_id in basket_ids] if basket]
+            await persist_baskets(db, baskets)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            await self.backend.mark_dirty(basket_ids)
+            raise
+        return len(basket_ids)
+
+
+async def persist_baskets(db: AsyncSession, baskets: Sequence[StoredBasket]) -> None:
+    """Upsert baskets with their totals and replace their items: four statements for the whole batch.
+
+    Lines of products deleted since they were added are dropped, from ``baskets`` as well;
+    the products of the others are locked against deletion until the transaction ends.
+    """
+    if not baskets:
+        return
+    basket = models.ShoppingBasket
+    item = models.ShoppingBasketItem
+    product_ids = {product_id for stored in baskets for product_id in stored.lines}
+    existing = set((await db.scalars(
+        select(models.Product.id).where(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id).with_for_update(key_share=True))).all()) if product_ids else set()
+    for stored in baskets:
+        for product_id in [product_id for product_id in stored.lines if product_id not in existing]:
+            del stored.lines[product_id]
+    rows = []
+    for stored in baskets:
+        totals = stored.totals()
+        rows.append(dict(id=stored.id, country=stored.country, item_count=totals.item_count,
+                         quantity=totals.quantity, total_price_inclusive=totals.total_price_inclusive,
+                         total_price_exclusive=totals.total_price_exclusive, tax=totals.tax,
+                         created_at=stored.created_at, updated_at=stored.updated_at))
+    stmt = pg_insert(basket).values(rows)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[basket.id],
+        set_={name: stmt.excluded[name] for name in rows[0] if name not in ("id", "created_at")},
+    ))
+    await db.execute(delete(item).where(item.shopping_basket_id.in_([stored.id for stored in baskets])))
+    lines = [dict(id=line.id, shopping_basket_id=stored.id, product_id=line.product_id, price=line.price,
+                  amount=line.amount, tax_rate=line.tax_rate)
+             for stored in baskets for line in stored.lines.values()]
+    if lines:
+        await db.execute(insert(item), lines)
+
+
+async def purge_stale(db: AsyncSession, retention: float = BASKET_RETENTION,
+                      batch_size: int = BASKET_PURGE_BATCH_SIZE) -> int:
+    """Delete one batch of persisted baskets untouched for ``retention`` seconds.
+
+    Baskets still holding stock reservations are left for the reservation sweep to release first.
+    """
+    basket = models.ShoppingBasket
+    reservation = models.StockReservation
+    stale = (await db.scalars(
+        select(basket.id)
+        .where(basket.updated_at < datetime.now() - timedelta(seconds=retention),
+               ~exists().where(reservation.shopping_basket_id == basket.id))
+        .order_by(basket.updated_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True))).all()
+    if stale:
+        await db.execute(delete(models.ShoppingBasketItem).where(models.ShoppingBasketItem.shopping_basket_id.in_(stale)))
+        await db.execute(delete(basket).where(basket.id.in_(stale)))
+    await db.commit()
+    return len(stale)
+
+
+def _backend(url: str) -> Optional[BasketBackend]:
+    if not url:
+        return None
+    if url.startswith("memory:"):
+        return MemoryBasketBackend()
+    return RedisBasketBackend(url)
+
+
+store: Optional[BasketStore] = BasketStore(_backend(BASKET_STORE_URL)) if BASKET_STORE_URL else None
+
+
+# The functions below are what the basket routes call: stored baskets are served from
+# the store, every other basket by crud exactly as before.
+
+async def _view(db: AsyncSession, basket: StoredBasket,
+                languages: Sequence[str] = DEFAULT_LANGUAGES) -> read_models.ShoppingBasketView:
+    products = await crud.get_product_views(db, list(basket.lines), languages)
+    view = read_models.ShoppingBasketView(**vars(basket.totals()))
+    for line in basket.lines.values():
+        view.items.append(read_models.ShoppingBasketItemView(
+            id=line.id, product_id=line.product_id, price=line.price, amount=line.amount, tax_rate=line.tax_rate,
+            product=products.get(line.product_id)))
+    return view
+
+
+async def create_shopping_basket(db: AsyncSession, data: schemas.ShoppingBasketCreate):
+    if store is None:
+        return await crud.create_shopping_basket(db, data)
+    return await store.create(db, data)
+
+
+async def get_shopping_basket(db: AsyncSession, basket_id: uuid.UUID,
+                              languages: Sequence[str] = DEFAULT_LANGUAGES) -> Optional[read_models.ShoppingBasketView]:
+    basket = await store.get(basket_id) if store is not None else None
+    if basket is None:
+        return await crud.get_shopping_basket(db, basket_id, languages)
+    return await _view(db, basket, languages)
+
+
+async def get_shopping_basket_totals(db: AsyncSession,
+                                     basket_id: uuid.UUID) -> Optional[read_models.ShoppingBasketTotalsView]:
+    basket = await store.get(basket_id) if store is not None else None
+    if basket is None:
+        return await crud.get_shopping_basket_totals(db, basket_id)
+    return basket.totals()
+
+
+async def _stored_or_crud(stored: Callable[[], Awaitable[Optional[StoredBasket]]],
+                          fallback: Callable[[], Awaitable]):
+    basket = await stored() if store is not None else None
+    return basket.totals() if basket is not None else await fallback()
+
+
+async def add_items_to_shopping_basket(db: AsyncSession, basket_id: uuid.UUID,
+                                       items: List[schemas.ShoppingBasketItemCreate]):
+    return await _stored_or_crud(
+        lambda: store.add_items(db, basket_id, crud.requested_amounts(items)),
+        lambda: crud.add_items_to_shopping_basket(db, basket_id, items))
+
+
+async def add_item_to_shopping_basket(db: AsyncSession, basket_id: uuid.UUID, item: schemas.ShoppingBasketItemCreate,
+                                      languages: Sequence[str] = DEFAULT_LANGUAGES):
+    basket = await store.add_items(db, basket_id, crud.requested_amounts([item])) if store is not None else None
+    if basket is None:
+        return await crud.add_item_to_shopping_basket(db, basket_id, item, languages)
+    return await _view(db, basket, languages)
+
+
+async def set_shopping_basket_item_amount(db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID, amount: int):
+    return await _stored_or_crud(
+        lambda: store.set_amount(db, basket_id, product_id, amount),
+        lambda: crud.set_shopping_basket_item_amount(db, basket_id, product_id, amount))
+
+
+async def change_shopping_basket_item_amount(db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                                             delta: int):
+    return await _stored_or_crud(
+        lambda: store.change_amount(db, basket_id, product_id, delta),
+        lambda: crud.change_shopping_basket_item_amount(db, basket_id, product_id, delta))
+
+
+async def remove_item_from_shopping_basket(db: AsyncSession, item_id: uuid.UUID) -> None:
+    if store is None or not await store.remove_item(item_id):
+        await crud.remove_item_from_shopping_basket(db, item_id)
+
+
+async def hand_over(db: AsyncSession, basket_id: uuid.UUID) -> bool:
+    return store is not None and await store.hand_over(db, basket_id)
+
+
+async def flush_forever(session_factory, interval: float = BASKET_FLUSH_INTERVAL,
+                        batch_size: int = BASKET_FLUSH_BATCH_SIZE) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await store.backend.expire()
+            async with session_factory() as db:
+                while await store.flush(db, batch_size) >= batch_size:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("flushing stored baskets failed")
+
+
+async def purge_forever(session_factory, interval: float = BASKET_PURGE_INTERVAL,
+                        batch_size: int = BASKET_PURGE_BATCH_SIZE) -> None:
+    while True:
+        try:
+            async with session_factory() as db:
+                while await purge_stale(db, batch_size=batch_size) >= batch_size:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("purging stale baskets failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,369 @@
+import codecs
+import csv
+import io
+import json
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import changes, crud, http_cache, models, product_view, schemas, search
+from .translations import translations, notify_cms_changed
+
+BATCH_SIZE = 1000
+FORMATS = ("csv", "ndjson")
+
+
+@dataclass
+class RowError:
+    line: int
+    error: str
+
+
+@dataclass
+class ImportReport:
+    processed: int = 0
+    written: int = 0
+    errors: List[RowError] = field(default_factory=list)
+
+
+ProgressCallback = Optional[Callable[[ImportReport], None]]
+
+
+async def iter_lines(chunks: AsyncIterable) -> AsyncIterator[str]:
+    """Split a stream of bytes or str chunks into lines without buffering the whole body."""
+    # a multi-byte character may be split across chunks, the decoder holds on to its first bytes
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        pending += chunk
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def iter_records(lines: AsyncIterable[str], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (line number, record) pairs; a record is a dict or the error that prevented parsing it."""
+    records = _ndjson_records(lines) if fmt == "ndjson" else _csv_records(lines)
+    async for line_no, record in records:
+        yield line_no, record
+
+
+async def _ndjson_records(lines: AsyncIterable[str]) -> AsyncIterator[Tuple[int, object]]:
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, e
+            continue
+        if not isinstance(record, dict):
+            yield line_no, ValueError("expected a JSON object")
+            continue
+        yield line_no, record
+
+
+class _PendingLines:
+    """The lines handed to one csv.reader, fed as they arrive from the stream."""
+
+    def __init__(self):
+        self.lines: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def _csv_records(lines: AsyncIterable[str]) -> AsyncIterator[Tuple[int, object]]:
+    # one reader for the whole stream, a quoted field may hold newlines and span several lines
+    pending = _PendingLines()
+    reader = csv.reader(pending)
+    header = None
+    line_no = record_line = 0
+    async for line in lines:
+        line_no += 1
+        if not pending.lines:
+            if not line.strip():
+                continue
+            record_line = line_no
+        pending.lines.append(line + "\n")
+        # an odd number of quotes leaves a quoted field open: ask the reader for the record
+        # only once the line closing it is there, it cannot wait for the stream itself
+        if sum(pending_line.count('"') for pending_line in pending.lines) % 2:
+            continue
+        first_line = record_line
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            pending.lines.clear()
+            yield first_line, ValueError(str(e))
+            continue
+        record_line = line_no - len(pending.lines) + 1
+        if header is None:
+            header = values
+        elif len(values) != len(header):
+            yield first_line, ValueError(f"expected {len(header)} columns, got {len(values)}")
+        else:
+            yield first_line, {k: (v if v != "" else None) for k, v in zip(header, values)}
+    if pending.lines:
+        yield record_line, ValueError("unexpected end of data in a quoted field")
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    if isinstance(e, DBAPIError):
+        return str(e.orig).strip().splitlines()[0]
+    return str(e)
+
+
+# what depends on the rows a batch wrote, called with the rows its statement returned
+AfterWrite = Callable[[AsyncSession, List], Awaitable[None]]
+
+
+async def _write(db: AsyncSession, statement, batch, report: ImportReport, after: AfterWrite,
+                 groups: Sequence[str]) -> None:
+    # dedupe on the conflict key, ON CONFLICT cannot touch the same row twice in one statement
+    rows = {}
+    for line, key, row in batch:
+        rows[key] = (line, row)
+    written = []
+    try:
+        async with db.begin_nested():
+            written += (await db.execute(statement([row for _, row in rows.values()]))).all()
+        report.written += len(rows)
+    except DBAPIError:
+        # find the offending rows one by one so the rest of the batch still lands
+        for line, row in rows.values():
+            try:
+                async with db.begin_nested():
+                    written += (await db.execute(statement([row]))).all()
+                report.written += 1
+            except DBAPIError as e:
+                report.errors.append(RowError(line, _error_message(e)))
+    # search documents, view rows and the change log commit with the batch, and cache versions
+    # move right after it, so an import that stops halfway leaves nothing stale behind
+    if written:
+        await after(db, written)
+    await http_cache.commit(db, *groups)
+
+
+async def _import(db: AsyncSession, lines: AsyncIterable[str], fmt: str, parse, statement, after: AfterWrite,
+                  groups: Sequence[str], batch_size: int, on_progress: ProgressCallback) -> ImportReport:
+    report = ImportReport()
+    batch = []
+    async for line, record in iter_records(lines, fmt):
+        report.processed += 1
+        if isinstance(record, Exception):
+            report.errors.append(RowError(line, _error_message(record)))
+            continue
+        try:
+            key, row = parse(line, record)
+        except (ValidationError, ValueError) as e:
+            report.errors.append(RowError(line, _error_message(e)))
+            continue
+        batch.append((line, key, row))
+        if len(batch) >= batch_size:
+            await _write(db, statement, batch, report, after, groups)
+            batch = []
+            if on_progress:
+                on_progress(report)
+    if batch:
+        await _write(db, statement, batch, report, after, groups)
+    if on_progress:
+        on_progress(report)
+    return report
+
+
+_product_fields = ("name", "description", "brand", "stock", "image_url", "category_id", "price")
+
+
+def _parse_product(line: int, record: dict):
+    data = schemas.ProductCreate(**record)
+    if not data.code:
+        raise ValueError("code is required to import a product")
+    row = dict(code=data.code, name=data.name, description=data.description, brand=data.brand,
+               stock=data.stock or 0, image_url=data.image_url, category_id=data.category_id, price=data.price or 0)
+    return data.code, row
+
+
+def _product_upsert(rows: List[dict]):
+    now = datetime.now()
+    stmt = pg_insert(models.Product).values([dict(id=uuid.uuid4(), created_at=now, updated_at=now, **row) for row in rows])
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Product.code],
+        set_={**{f: stmt.excluded[f] for f in _product_fields}, "updated_at": stmt.excluded.updated_at},
+    ).returning(models.Product.id)
+
+
+def _parse_translation(line: int, record: dict):
+    data = schemas.CmsCreate(**record)
+    return (data.code, data.language), dict(code=data.code, value=data.value, language=data.language)
+
+
+def _translation_upsert(rows: List[dict]):
+    return crud.cms_upsert(rows).returning(models.Cms.id, models.Cms.code)
+
+
+def _category_upsert(rows: List[dict]):
+    now = datetime.now()
+    stmt = pg_insert(models.Category).values(
+        [dict(id=row["id"], name=row["name"], created_at=now, updated_at=now) for row in rows])
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Category.id],
+        set_={"name": stmt.excluded.name, "updated_at": stmt.excluded.updated_at},
+    ).returning(models.Category.id)
+
+
+async def _products_written(db: AsyncSession, written) -> None:
+    product_ids = [product_id for product_id, in written]
+    await search.refresh_product_search(db, product_ids=product_ids)
+    await product_view.refresh_product_view(db, product_ids=product_ids)
+    await changes.record(db, changes.PRODUCT, product_ids)
+
+
+async def import_products(db: AsyncSession, lines: AsyncIterable[str], fmt: str = "ndjson",
+                          batch_size: int = BATCH_SIZE, on_progress: ProgressCallback = None) -> ImportReport:
+    return await _import(db, lines, fmt, _parse_product, _product_upsert, _products_written, ("products",),
+                         batch_size, on_progress)
+
+
+async def _translations_written(db: AsyncSession, written) -> None:
+    codes = sorted({code for _, code in written})
+    await search.refresh_product_search(db, codes=codes)
+    await product_view.refresh_product_view(db, codes=codes)
+    await changes.record(db, changes.CMS, [cms_id for cms_id, _ in written])
+    await notify_cms_changed(db)
+
+
+async def import_translations(db: AsyncSession, lines: AsyncIterable[str], fmt: str = "ndjson",
+                              batch_size: int = BATCH_SIZE, on_progress: ProgressCallback = None) -> ImportReport:
+    try:
+        return await _import(db, lines, fmt, _parse_translation, _translation_upsert, _translations_written,
+                             ("cms",), batch_size, on_progress)
+    finally:
+        # other workers drop theirs on the notification of each batch
+        translations.invalidate()
+
+
+async def _categories_written(db: AsyncSession, written) -> None:
+    category_ids = [category_id for category_id, in written]
+    # renamed categories change the product rows that carry their name
+    await product_view.refresh_product_view(db, category_ids=category_ids)
+    await changes.record(db, changes.CATEGORY, category_ids)
+
+
+async def import_categories(db: AsyncSession, lines: AsyncIterable[str], fmt: str = "ndjson",
+                            batch_size: int = BATCH_SIZE, on_progress: ProgressCallback = None) -> ImportReport:
+    # a parent may appear after its children, so edges are only linked once every category exists
+    edges = []
+
+    def parse(line: int, record: dict):
+        data = schemas.CategoryImport(**record)
+        if data.parent_id is not None:
+            edges.append((line, data.parent_id, data.id))
+        return data.id, dict(id=data.id, name=data.name)
+
+    report = await _import(db, lines, fmt, parse, _category_upsert, _categories_written,
+                           ("categories", "products"), batch_size, on_progress)
+    await _link_categories(db, edges, report)
+    return report
+
+
+def _acyclic_edges(existing, edges, report: ImportReport) -> list:
+    """The imported edges that keep the graph acyclic; of the edges closing a loop the later line is dropped."""
+    children = defaultdict(set)
+    for parent_id, child_id in existing:
+        children[parent_id].add(child_id)
+    accepted = []
+    for line, parent_id, child_id in sorted(edges):
+        # the edge closes a loop when the parent is already below the child
+        seen, pending = set(), [child_id]
+        while pending and parent_id not in seen:
+            node = pending.pop()
+            if node not in seen:
+                seen.add(node)
+                pending.extend(children[node])
+        if parent_id in seen:
+            report.errors.append(RowError(line, f"category {child_id} is an ancestor of {parent_id}"))
+            continue
+        children[parent_id].add(child_id)
+        accepted.append((line, parent_id, child_id))
+    return accepted
+
+
+async def _link_categories(db: AsyncSession, edges, report: ImportReport) -> None:
+    # an imported category with a parent moves there, away from the parents it had
+    table = models.category_children
+    moved = {child_id for _, _, child_id in edges}
+    old_parent_ids = set((await db.scalars(
+        table.delete().where(table.c.child_id.in_(moved)).returning(table.c.parent_id))).all())
+    existing = (await db.execute(select(table.c.parent_id, table.c.child_id))).all()
+    for line, parent_id, child_id in _acyclic_edges(existing, edges, report):
+        try:
+            async with db.begin_nested():
+                await db.execute(pg_insert(table).values(parent_id=parent_id, child_id=child_id)
+                                 .on_conflict_do_nothing())
+        except DBAPIError as e:
+            report.errors.append(RowError(line, _error_message(e)))
+    await crud.refresh_category_closure(db)
+    # parents that only got or lost children changed as well
+    parent_ids = old_parent_ids | {parent_id for _, parent_id, _ in edges}
+    await changes.record(db, changes.CATEGORY, select(models.Category.id).where(models.Category.id.in_(parent_ids)))
+    await http_cache.commit(db, "categories", "products")
+
+
+EXPORTS = {
+    "products": lambda: select(
+        models.Product.code, models.Product.name, models.Product.description, models.Product.brand,
+        models.Product.stock, models.Product.image_url, models.Product.category_id, models.Product.price,
+    ).order_by(models.Product.created_at, models.Product.id),
+    "categories": lambda: select(
+        models.Category.id, models.Category.name, models.category_children.c.parent_id,
+    ).outerjoin(models.category_children, models.category_children.c.child_id == models.Category.id)
+    .order_by(models.Category.created_at, models.Category.id),
+    "translations": lambda: select(
+        models.Cms.code, models.Cms.language, models.Cms.value,
+    ).order_by(models.Cms.code, models.Cms.language),
+}
+
+
+async def export_rows(db: AsyncSession, table: str, fmt: str = "ndjson", chunk_size: int = BATCH_SIZE) -> AsyncIterator[str]:
+    stmt = EXPORTS[table]().execution_options(yield_per=chunk_size)
+    result = await db.stream(stmt)
+    columns = list(result.keys())
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    async for rows in result.partitions():
+        if fmt == "csv":
+            writer.writerows(["" if v is None else v for v in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
@@ -0,0 +1,190 @@
+"""Change feed of the catalog, for consumers that keep a copy in sync incrementally.
+
+Catalog writes add a row to ``change_log`` per changed product, category or cms
+translation in their own transaction: the entity, its id and whether it was
+upserted or deleted. Consumers read the feed from a cursor and fetch the current
+state of what changed, e.g. with the multi-get endpoints.
+
+Rows carry the id of the transaction that wrote them and the feed is ordered by
+(txid, id). Rows of a transaction only show up once every older transaction has
+finished, i.e. when their txid is below the xmin of the reader's snapshot, so a
+transaction that commits late cannot slip in behind a cursor that was already
+handed out. The price is that a long running write holds the feed back until it
+ends.
+
+Cursors carry a time before which the consumer cannot have missed anything: when
+the page that produced them reached the end of the feed, the time it was read,
+otherwise the time of the last change on the page (or of the cursor it came from,
+when that is later). Rows are kept for CHANGES_RETENTION seconds; a cursor older
+than that may have missed purged rows and is refused, the consumer has to copy the
+catalog again from a fresh ``head``. Reading on from a cursor does not make it
+younger unless it catches up.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import BigInteger, String, cast, delete, func, insert, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from . import models, notifications
+from .pagination import decode_change_cursor, encode_change_cursor
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = "changes"
+# rows and cursors older than this many seconds are gone
+CHANGES_RETENTION = float(os.getenv("CHANGES_RETENTION", str(7 * 24 * 3600)))
+CHANGES_PURGE_INTERVAL = float(os.getenv("CHANGES_PURGE_INTERVAL", "3600"))
+CHANGES_PURGE_BATCH_SIZE = int(os.getenv("CHANGES_PURGE_BATCH_SIZE", "10000"))
+# waiting readers look again this often, notifications only tell them a write committed,
+# not that the rows it wrote passed the snapshot horizon
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "2"))
+
+PRODUCT = "product"
+CATEGORY = "category"
+CMS = "cms"
+ENTITIES = (PRODUCT, CATEGORY, CMS)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+Position = Tuple[int, int]
+
+
+class CursorExpiredError(Exception):
+    def __init__(self, issued_at: datetime):
+        super().__init__(f"cursor issued at {issued_at.isoformat()} is older than the change log retention")
+
+
+# replaced on every notification, so each waiter wakes up once for the writes after it started waiting
+_changed = asyncio.Event()
+
+
+def _horizon():
+    # transactions with an id below the snapshot's xmin have all ended, committed or not
+    return cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), String), BigInteger)
+
+
+async def record(db: AsyncSession, entity: str, ids, deleted: bool = False) -> None:
+    """Add changes of ``entity`` to the caller's transaction; ``ids`` is a list or a select of ids."""
+    change = models.Change
+    op = DELETE if deleted else UPSERT
+    if isinstance(ids, Select):
+        stmt = insert(change).from_select(
+            ["entity_id", "entity", "op"], ids.add_columns(literal(entity), literal(op)))
+    else:
+        if not ids:
+            return
+        stmt = insert(change).values([dict(entity=entity, entity_id=entity_id, op=op) for entity_id in ids])
+    await db.execute(stmt)
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(select(func.pg_notify(CHANGES_CHANNEL, entity)))
+
+
+def encode(position: Position, issued_at: Optional[datetime] = None) -> str:
+    return encode_change_cursor(*position, issued_at or datetime.now())
+
+
+def decode(cursor: str, now: Optional[datetime] = None) -> Tuple[Position, datetime]:
+    """Position of a cursor and its time; raises ValueError when it is malformed and
+    CursorExpiredError when too old."""
+    position, issued_at = decode_change_cursor(cursor)
+    if issued_at < (now or datetime.now()) - timedelta(seconds=CHANGES_RETENTION):
+        raise CursorExpiredError(issued_at)
+    return position, issued_at
+
+
+def read_through(issued_at: datetime, last: Optional[models.Change] = None) -> datetime:
+    """Time of the cursor after ``last``, read on from a cursor of ``issued_at``.
+
+    Without ``last`` the reader caught up with the feed, and nothing it has not seen
+    can be purged yet.
+    """
+    if last is None:
+        return datetime.now()
+    return max(issued_at, last.created_at)
+
+
+async def head(db: AsyncSession) -> Position:
+    """Position of the last change a reader can see; the feed continues after it."""
+    change = models.Change
+    row = (await db.execute(
+        select(change.txid, change.id).where(change.txid < _horizon())
+        .order_by(change.txid.desc(), change.id.desc()).limit(1))).first()
+    return tuple(row) if row else (0, 0)
+
+
+async def list_changes(db: AsyncSession, after: Position = (0, 0), limit: int = 500,
+                       entities: Optional[Sequence[str]] = None) -> List[models.Change]:
+    change = models.Change
+    stmt = (
+        select(change)
+        .where(change.txid < _horizon(), tuple_(change.txid, change.id) > tuple_(*after))
+        .order_by(change.txid, change.id)
+        .limit(limit)
+    )
+    if entities:
+        stmt = stmt.where(change.entity.in_(entities))
+    return (await db.scalars(stmt)).all()
+
+
+async def wait_for_changes(db: AsyncSession, after: Position, limit: int = 500,
+                           entities: Optional[Sequence[str]] = None, timeout: float = 0) -> List[models.Change]:
+    """``list_changes``, waiting up to ``timeout`` seconds for a change when there is none yet.
+
+    The session's connection goes back to the pool while waiting.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        changed = _changed
+        changes = await list_changes(db, after, limit, entities)
+        remaining = deadline - loop.time()
+        if changes or remaining <= 0:
+            return changes
+        await db.rollback()
+        try:
+            await asyncio.wait_for(changed.wait(), min(remaining, CHANGES_POLL_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def purge(db: AsyncSession, retention: float = CHANGES_RETENTION,
+                batch_size: int = CHANGES_PURGE_BATCH_SIZE) -> int:
+    change = models.Change
+    expired = (
+        select(change.id)
+        .where(change.created_at < datetime.now() - timedelta(seconds=retention))
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    result = await db.execute(delete(change).where(change.id.in_(expired)))
+    await db.commit()
+    return result.rowcount
+
+
+async def purge_forever(session_factory, interval: float = CHANGES_PURGE_INTERVAL,
+                        batch_size: int = CHANGES_PURGE_BATCH_SIZE) -> None:
+    while True:
+        try:
+            async with session_factory() as db:
+                while await purge(db, batch_size=batch_size) >= batch_size:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("purging the change log failed")
+        await asyncio.sleep(interval)
+
+
+def _on_changes_notification(payload: str) -> None:
+    global _changed
+    changed, _changed = _changed, asyncio.Event()
+    changed.set()
+
+
+notifications.subscribe(CHANGES_CHANNEL, _on_changes_notification)
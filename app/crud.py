@@ -1,17 +1,57 @@
+import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, and_, outerjoin
-from sqlalchemy.orm import selectinload, aliased
-from typing import List
+from sqlalchemy import select, delete, update, insert, tuple_, and_, or_, func, literal, values, column, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Sequence
 import uuid
 
-from . import models, schemas
+from . import changes, http_cache, loaders, models, product_view, schemas, read_models, reservations, search
+from .pagination import decode_product_cursor
+from .tax import DEFAULT_COUNTRY, line_tax, tax_rate_for
+from .translations import DEFAULT_LANGUAGES, translations, notify_cms_changed
+
+
+async def _translate_products(db: AsyncSession, products: list, languages: Sequence[str] = DEFAULT_LANGUAGES) -> None:
+    # every code of the response is resolved at once, from the cache or with a single query
+    codes = [code for p in products for code in (p.name, p.description)]
+    resolved = await translations.resolve(db, codes, languages)
+    for p in products:
+        for attr in ("name", "description"):
+            value = resolved.get(getattr(p, attr))
+            if not value:
+                continue
+            if isinstance(p, models.Base):
+                # keep the cms code as the persisted value, only the loaded instance is translated
+                set_committed_value(p, attr, value)
+            else:
+                setattr(p, attr, value)
+
+
+def cms_upsert(rows: List[dict]):
+    now = datetime.now()
+    values = [dict(id=uuid.uuid4(), created_at=now, updated_at=now, **row) for row in rows]
+    stmt = pg_insert(models.Cms).values(values)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Cms.code, models.Cms.language],
+        set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+    )
 
 
 async def create_cms(db: AsyncSession, data: schemas.CmsCreate) -> models.Cms:
-    translation = models.Cms(code=data.code, value=data.value, language=data.language)
-    db.add(translation)
-    await db.commit()
-    await db.refresh(translation)
+    stmt = cms_upsert([dict(code=data.code, value=data.value, language=data.language)]).returning(models.Cms)
+    result = await db.execute(select(models.Cms).from_statement(stmt).execution_options(populate_existing=True))
+    translation = result.scalars().one()
+    # the code may be a fallback for any search or view language
+    await search.refresh_product_search(db, codes=[data.code])
+    await product_view.refresh_product_view(db, codes=[data.code])
+    await changes.record(db, changes.CMS, [translation.id])
+    await notify_cms_changed(db, data.code, data.language)
+    await http_cache.commit(db, "cms")
+    translations.invalidate(data.code, data.language)
     return translation
 
 
@@ -20,49 +60,235 @@ async def list_cms(db: AsyncSession) -> List[models.Cms]:
     return translations.scalars().all()
 
 
+async def resolve_cms(db: AsyncSession, codes: Sequence[str],
+                      languages: Sequence[str] = DEFAULT_LANGUAGES) -> Dict[str, str]:
+    """Translations of ``codes`` along the language chain; codes without one are left out."""
+    languages = tuple(languages)
+    loader = loaders.loader(db, ("cms", languages), lambda db, batch: translations.resolve(db, batch, languages))
+    return await loader.load_many(codes)
+
+
+MAX_CATEGORY_DEPTH = 64
+
+UNIQUE_VIOLATION = "23505"
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+class CategoryCycleError(ValueError):
+    pass
+
+
+class ProductCodeTakenError(ValueError):
+    def __init__(self, code: str):
+        super().__init__(f"a product with code {code!r} exists")
+
+
+class UnknownCategoryError(ValueError):
+    def __init__(self, category_id: uuid.UUID):
+        super().__init__(f"category {category_id} does not exist")
+
+
+async def refresh_category_closure(db: AsyncSession, ancestor_ids: Optional[List[uuid.UUID]] = None) -> None:
+    """Recompute the closure rows reachable from ``ancestor_ids``, or the whole table when omitted."""
+    closure = models.CategoryClosure.__table__
+    edges = models.category_children
+    seed = select(
+        models.Category.id.label("ancestor_id"),
+        models.Category.id.label("descendant_id"),
+        literal(0).label("depth"),
+    )
+    if ancestor_ids is None:
+        await db.execute(delete(closure))
+    else:
+        if not ancestor_ids:
+            return
+        seed = seed.where(models.Category.id.in_(ancestor_ids))
+        await db.execute(delete(closure).where(closure.c.ancestor_id.in_(ancestor_ids)))
+    walk = seed.cte("walk", recursive=True)
+    walk = walk.union(
+        select(walk.c.ancestor_id, edges.c.child_id, walk.c.depth + 1)
+        .join(edges, edges.c.parent_id == walk.c.descendant_id)
+        .where(walk.c.depth < MAX_CATEGORY_DEPTH)
+    )
+    await db.execute(insert(closure).from_select(
+        ["ancestor_id", "descendant_id", "depth"],
+        select(walk.c.ancestor_id, walk.c.descendant_id, func.min(walk.c.depth))
+        .group_by(walk.c.ancestor_id, walk.c.descendant_id),
+    ))
+
+
+async def ensure_category_closure(db: AsyncSession) -> None:
+    """Backfill the closure table for databases that predate it."""
+    if await db.scalar(select(models.CategoryClosure.ancestor_id).limit(1)) is not None:
+        return
+    if await db.scalar(select(models.Category.id).limit(1)) is None:
+        return
+    await refresh_category_closure(db)
+    await db.commit()
+
+
+async def _category_ancestor_ids(db: AsyncSession, category_id: uuid.UUID) -> List[uuid.UUID]:
+    result = await db.execute(
+        select(models.CategoryClosure.ancestor_id).where(models.CategoryClosure.descendant_id == category_id))
+    return result.scalars().all()
+
+
+async def _check_category_cycle(db: AsyncSession, category_id: uuid.UUID, children_ids: List[uuid.UUID]) -> None:
+    # a child that is already an ancestor (or the category itself) would close a loop
+    cycle = await db.scalar(
+        select(models.CategoryClosure.ancestor_id)
+        .where(models.CategoryClosure.ancestor_id.in_(children_ids))
+        .where(models.CategoryClosure.descendant_id == category_id)
+        .limit(1))
+    if cycle is not None:
+        raise CategoryCycleError(f"category {cycle} is an ancestor of {category_id}")
+
+
+def _category_tree(rows) -> dict:
+    nodes = {}
+    edges = []
+    for category_id, name, created_at, updated_at, parent_id in rows:
+        if category_id not in nodes:
+            nodes[category_id] = read_models.CategoryNode(id=category_id, name=name,
+                                                          created_at=created_at, updated_at=updated_at)
+        if parent_id is not None:
+            edges.append((parent_id, category_id))
+    for parent_id, child_id in edges:
+        if parent_id in nodes:
+            nodes[parent_id].children.append(nodes[child_id])
+    return nodes
+
+
+def _category_rows():
+    return (
+        select(models.Category.id, models.Category.name, models.Category.created_at, models.Category.updated_at,
+               models.category_children.c.parent_id)
+        .outerjoin(models.category_children, models.category_children.c.child_id == models.Category.id)
+        .order_by(models.Category.created_at, models.Category.id)
+    )
+
+
 async def create_category(db: AsyncSession, data: schemas.CategoryCreate) -> models.Category:
     category = models.Category(name=data.name)
     if data.children_ids:
         children = await db.execute(select(models.Category).where(models.Category.id.in_(data.children_ids)))
         category.children = children.scalars().all()
     db.add(category)
-    await db.commit()
+    await db.flush()
+    # a new category has no parents yet, so only its own rows need computing
+    await refresh_category_closure(db, [category.id])
+    await changes.record(db, changes.CATEGORY, [category.id])
+    await http_cache.commit(db, "categories")
     await db.refresh(category)
     return category
 
 
-async def get_category(db: AsyncSession, category_id: uuid.UUID) -> models.Category:
-    category = await db.execute(select(models.Category).where(models.Category.id == category_id).options(
-        selectinload(models.Category.children)))
-    return category.scalars().first()
+async def _load_categories(db: AsyncSession, category_ids: List[uuid.UUID]) -> Dict[uuid.UUID, read_models.CategoryNode]:
+    # the subtrees of all requested categories in one statement; nodes shared by two subtrees are built once
+    closure = models.CategoryClosure
+    stmt = _category_rows().where(models.Category.id.in_(
+        select(closure.descendant_id).where(closure.ancestor_id.in_(category_ids))))
+    nodes = _category_tree((await db.execute(stmt)).all())
+    return {category_id: nodes[category_id] for category_id in category_ids if category_id in nodes}
 
 
-async def list_categories(db: AsyncSession) -> List[models.Category]:
-    category = await db.execute(select(models.Category).options(selectinload(models.Category.children)))
-    return category.scalars().all()
+def _category_loader(db: AsyncSession) -> loaders.BatchLoader:
+    return loaders.loader(db, "categories", _load_categories)
 
 
-async def update_category(db: AsyncSession, category_id: uuid.UUID, data: schemas.CategoryUpdate) -> models.Category:
-    category = await get_category(db, category_id)
+async def get_category(db: AsyncSession, category_id: uuid.UUID) -> read_models.CategoryNode:
+    return await _category_loader(db).load(category_id)
+
+
+async def get_categories(db: AsyncSession, category_ids: Sequence[uuid.UUID]) -> List[read_models.CategoryNode]:
+    """The categories that exist, with their subtrees, in the order of ``category_ids``."""
+    found = await _category_loader(db).load_many(category_ids)
+    return list(found.values())
+
+
+async def list_categories(db: AsyncSession) -> List[read_models.CategoryNode]:
+    nodes = _category_tree((await db.execute(_category_rows())).all())
+    return list(nodes.values())
+
+
+async def get_category_tree(db: AsyncSession) -> List[read_models.CategoryNode]:
+    result = await db.execute(_category_rows())
+    rows = result.all()
+    child_ids = {row.id for row in rows if row.parent_id is not None}
+    nodes = _category_tree(rows)
+    return [node for category_id, node in nodes.items() if category_id not in child_ids]
+
+
+async def get_category_ancestors(db: AsyncSession, category_id: uuid.UUID) -> List[models.Category]:
+    result = await db.execute(
+        select(models.Category)
+        .join(models.CategoryClosure, models.CategoryClosure.ancestor_id == models.Category.id)
+        .where(models.CategoryClosure.descendant_id == category_id)
+        .order_by(models.CategoryClosure.depth.desc())
+    )
+    return result.scalars().all()
+
+
+async def update_category(db: AsyncSession, category_id: uuid.UUID, data: schemas.CategoryUpdate) -> read_models.CategoryNode:
+    result = await db.execute(select(models.Category).where(models.Category.id == category_id).options(
+        selectinload(models.Category.children)))
+    category = result.scalars().first()
     if category is None:
         return None
-    if data.name is not None:
+    groups = ["categories"]
+    if data.name is not None and data.name != category.name:
         category.name = data.name
+        await db.flush()
+        # product rows carry the category name
+        await product_view.refresh_product_view(db, category_ids=[category_id])
+        groups.append("products")
     if data.children_ids is not None:
+        await _check_category_cycle(db, category_id, data.children_ids)
         q = await db.execute(select(models.Category).where(models.Category.id.in_(data.children_ids)))
         category.children = q.scalars().all()
+        db.add(category)
+        await db.flush()
+        await refresh_category_closure(db, await _category_ancestor_ids(db, category_id))
     db.add(category)
-    await db.commit()
-    await db.refresh(category)
-    return category
+    await changes.record(db, changes.CATEGORY, [category_id])
+    await http_cache.commit(db, *groups)
+    return await get_category(db, category_id)
 
 
 async def delete_category(db: AsyncSession, category_id: uuid.UUID) -> None:
-    await db.execute(delete(models.Category).where(models.Category.id == category_id))
-    await db.commit()
+    ancestor_ids = [a for a in await _category_ancestor_ids(db, category_id) if a != category_id]
+    edges = models.category_children
+    # the parents lose a child and the products their category
+    await changes.record(db, changes.CATEGORY, select(edges.c.parent_id).where(edges.c.child_id == category_id))
+    await db.execute(delete(edges).where(or_(edges.c.parent_id == category_id, edges.c.child_id == category_id)))
+    await changes.record(db, changes.PRODUCT, select(models.Product.id).where(models.Product.category_id == category_id))
+    await db.execute(update(models.Product).where(models.Product.category_id == category_id).values(category_id=None))
+    await db.execute(update(models.ProductSearch).where(models.ProductSearch.category_id == category_id)
+                     .values(category_id=None))
+    await db.execute(update(models.ProductView).where(models.ProductView.category_id == category_id)
+                     .values(category_id=None, category_name=None))
+    deleted = await db.execute(delete(models.Category).where(models.Category.id == category_id))
+    if deleted.rowcount:
+        await changes.record(db, changes.CATEGORY, [category_id], deleted=True)
+    await refresh_category_closure(db, ancestor_ids)
+    await http_cache.commit(db, "categories", "products")
     return None
 
 
+async def _flush_product(db: AsyncSession, product: models.Product) -> None:
+    # uq_products_code and the foreign key on category_id, as errors the routes answer with 4xx
+    try:
+        await db.flush()
+    except IntegrityError as e:
+        await db.rollback()
+        sqlstate = getattr(e.orig, "sqlstate", None)
+        if sqlstate == UNIQUE_VIOLATION:
+            raise ProductCodeTakenError(product.code) from e
+        if sqlstate == FOREIGN_KEY_VIOLATION:
+            raise UnknownCategoryError(product.category_id) from e
+        raise
+
+
 async def create_product(db: AsyncSession, data: schemas.ProductCreate) -> models.Product:
     product = models.Product(
         name=data.name,
@@ -75,140 +301,500 @@ async def create_product(db: AsyncSession, data: schemas.ProductCreate) -> model
         price=data.price or 0,
     )
     db.add(product)
-    await db.commit()
+    await _flush_product(db, product)
+    await search.refresh_product_search(db, product_ids=[product.id])
+    await product_view.refresh_product_view(db, product_ids=[product.id])
+    await changes.record(db, changes.PRODUCT, [product.id])
+    await http_cache.commit(db, "products")
     await db.refresh(product)
     return product
 
 
-async def get_product(db: AsyncSession, product_id: uuid.UUID) -> models.Product:
-    product = await db.execute(
-        select(models.Product).where(models.Product.id == product_id).options(selectinload(models.Product.category)))
-    first = product.scalars().first()
-    description = await db.execute(select(models.Cms).where(models.Cms.code == first.description).where(models.Cms.language == "nl_BE"))
-    name = await db.execute(select(models.Cms).where(models.Cms.code == first.name).where(models.Cms.language == "nl_BE"))
-    first.name = name.scalars().first()
-    first.description = description.scalars().first()
-    return first
+_product_columns = (
+    models.Product.id,
+    models.Product.name,
+    models.Product.description,
+    models.Product.brand,
+    models.Product.code,
+    models.Product.stock,
+    models.Product.image_url,
+    models.Product.price,
+    models.Product.created_at,
+    models.Category.id,
+    models.Category.name,
+)
+
+# the same columns from the product_view read model, translated already; stock comes from products
+_product_view_columns = (
+    models.ProductView.id,
+    models.ProductView.name,
+    models.ProductView.description,
+    models.ProductView.brand,
+    models.ProductView.code,
+    models.Product.stock,
+    models.ProductView.image_url,
+    models.ProductView.price,
+    models.ProductView.created_at,
+    models.ProductView.category_id,
+    models.ProductView.category_name,
+)
+
+
+def _product_view(row) -> read_models.ProductView:
+    p_id, name, description, brand, code, stock, image_url, price, created_at, category_id, category_name = row
+    category = read_models.CategoryView(id=category_id, name=category_name) if category_id else None
+    return read_models.ProductView(id=p_id, name=name, description=description, brand=brand, code=code, stock=stock,
+                                   image_url=image_url, price=price, category=category, created_at=created_at)
+
+
+class _ProductSource(NamedTuple):
+    table: type
+    stmt: object
+    translated: bool
+
+
+def _product_source(languages: Sequence[str]) -> _ProductSource:
+    """Product rows for a language chain: the product_view rows when they cover it, else products
+    joined to their category, which still need translating."""
+    language = product_view.view_language(languages)
+    if language is None:
+        stmt = select(*_product_columns).outerjoin(models.Category, models.Category.id == models.Product.category_id)
+        return _ProductSource(models.Product, stmt, False)
+    view = models.ProductView
+    stmt = (select(*_product_view_columns)
+            .join(models.Product, models.Product.id == view.id)
+            .where(view.language == language))
+    return _ProductSource(view, stmt, True)
+
+
+async def _translated(db: AsyncSession, source: _ProductSource, rows, languages: Sequence[str]) -> list:
+    products = [_product_view(row) for row in rows]
+    if not source.translated:
+        await _translate_products(db, products, languages)
+    return products
+
+
+def _product_listing(source: _ProductSource, cursor: Optional[str] = None, category_id: Optional[uuid.UUID] = None,
+                     brand: Optional[str] = None, min_price: Optional[int] = None,
+                     max_price: Optional[int] = None, category_subtree_id: Optional[uuid.UUID] = None):
+    table = source.table
+    stmt = source.stmt.order_by(table.created_at, table.id)
+    if cursor is not None:
+        created_at, product_id = decode_product_cursor(cursor)
+        stmt = stmt.where(tuple_(table.created_at, table.id) > tuple_(created_at, product_id))
+    if category_id is not None:
+        stmt = stmt.where(table.category_id == category_id)
+    if category_subtree_id is not None:
+        stmt = stmt.where(table.category_id.in_(
+            select(models.CategoryClosure.descendant_id)
+            .where(models.CategoryClosure.ancestor_id == category_subtree_id)))
+    if brand is not None:
+        stmt = stmt.where(table.brand == brand)
+    if min_price is not None:
+        stmt = stmt.where(table.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(table.price <= max_price)
+    return stmt
+
+
+async def list_products(db: AsyncSession, limit: Optional[int] = None, languages: Sequence[str] = DEFAULT_LANGUAGES,
+                        **filters) -> List[read_models.ProductView]:
+    source = _product_source(languages)
+    stmt = _product_listing(source, **filters)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    return await _translated(db, source, result.all(), languages)
 
 
-async def list_products(db: AsyncSession) -> List[models.Product]:
-    name_cms = aliased(models.Cms)
-    language = "nl_BE"
-    description_cms = aliased(models.Cms)
+async def _product_views(db: AsyncSession, column: str, keys: Sequence,
+                         languages: Sequence[str]) -> List[read_models.ProductView]:
+    source = _product_source(languages)
+    result = await db.execute(source.stmt.where(getattr(source.table, column).in_(set(keys))))
+    return await _translated(db, source, result.all(), languages)
 
-    stmt = (
-        select(models.Product, name_cms.value,
-               description_cms.value)
-        .outerjoin(name_cms, and_(name_cms.code == models.Product.name, name_cms.language == language))
-        .outerjoin(description_cms,
-                   and_(description_cms.code == models.Product.description, description_cms.language == language))
-        .options(selectinload(models.Product.category))
-    )
 
-    result = await db.execute(stmt)
+async def get_product_views(db: AsyncSession, product_ids: Sequence[uuid.UUID],
+                            languages: Sequence[str] = DEFAULT_LANGUAGES) -> Dict[uuid.UUID, read_models.ProductView]:
+    if not product_ids:
+        return {}
+    products = await _product_views(db, "id", product_ids, languages)
+    return {p.id: p for p in products}
+
+
+async def _product_views_by_code(db: AsyncSession, codes: Sequence[str],
+                                 languages: Sequence[str]) -> Dict[str, read_models.ProductView]:
+    products = await _product_views(db, "code", codes, languages)
+    return {p.code: p for p in products}
+
+
+# Single products and lists of them are looked up through the session's loaders, so
+# concurrent lookups in one request are fetched together; one loader per language chain.
+
+def _product_loader(db: AsyncSession, languages: Sequence[str]) -> loaders.BatchLoader:
+    languages = tuple(languages)
+    return loaders.loader(db, ("products", languages),
+                          lambda db, product_ids: get_product_views(db, product_ids, languages))
+
+
+def _product_code_loader(db: AsyncSession, languages: Sequence[str]) -> loaders.BatchLoader:
+    languages = tuple(languages)
+    return loaders.loader(db, ("products_by_code", languages),
+                          lambda db, codes: _product_views_by_code(db, codes, languages))
+
+
+async def get_product(db: AsyncSession, product_id: uuid.UUID,
+                      languages: Sequence[str] = DEFAULT_LANGUAGES) -> read_models.ProductView:
+    return await _product_loader(db, languages).load(product_id)
+
+
+async def get_products(db: AsyncSession, product_ids: Sequence[uuid.UUID] = (), codes: Sequence[str] = (),
+                       languages: Sequence[str] = DEFAULT_LANGUAGES) -> List[read_models.ProductView]:
+    """The products that exist by id, then by code, in the order asked for and each product once."""
+    by_id, by_code = await asyncio.gather(
+        _product_loader(db, languages).load_many(product_ids),
+        _product_code_loader(db, languages).load_many(codes))
+    products = {p.id: p for p in by_id.values()}
+    for p in by_code.values():
+        products.setdefault(p.id, p)
+    return list(products.values())
 
-    products_with_translations = []
-    for p, translated_name, translated_description in result.all():
-        if translated_name:
-            p.name = translated_name
-        if translated_description:
-            p.description = translated_description
-        products_with_translations.append(p)
 
-    return products_with_translations
+async def stream_products(db: AsyncSession, limit: Optional[int] = None, chunk_size: int = 500,
+                          languages: Sequence[str] = DEFAULT_LANGUAGES, **filters) -> AsyncIterator[read_models.ProductView]:
+    source = _product_source(languages)
+    stmt = _product_listing(source, **filters).execution_options(yield_per=chunk_size)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        for product in await _translated(db, source, rows, languages):
+            yield product
 
 
-async def update_product(db: AsyncSession, product_id: uuid.UUID, data: schemas.ProductUpdate) -> models.Product:
-    product = await get_product(db, product_id)
+async def update_product(db: AsyncSession, product_id: uuid.UUID, data: schemas.ProductUpdate,
+                         languages: Sequence[str] = DEFAULT_LANGUAGES) -> read_models.ProductView:
+    product = await db.get(models.Product, product_id)
     if product is None:
         return None
     for k, v in data.dict(exclude_unset=True).items():
         setattr(product, k, v)
     db.add(product)
-    await db.commit()
-    await db.refresh(product)
-    return product
+    await _flush_product(db, product)
+    await search.refresh_product_search(db, product_ids=[product_id])
+    await product_view.refresh_product_view(db, product_ids=[product_id])
+    await changes.record(db, changes.PRODUCT, [product_id])
+    await http_cache.commit(db, "products")
+    return await get_product(db, product_id, languages)
 
 
 async def delete_product(db: AsyncSession, product_id: uuid.UUID) -> None:
-    await db.execute(delete(models.Product).where(models.Product.id == product_id))
-    await db.commit()
+    await db.execute(delete(models.StockReservation).where(models.StockReservation.product_id == product_id))
+    deleted = await db.execute(delete(models.Product).where(models.Product.id == product_id))
+    if deleted.rowcount:
+        await changes.record(db, changes.PRODUCT, [product_id], deleted=True)
+    await http_cache.commit(db, "products")
 
 
 async def create_shopping_basket(db: AsyncSession, data: schemas.ShoppingBasketCreate) -> models.ShoppingBasket:
-    shopping_basket = models.ShoppingBasket()
-    if data.items:
-        for it in data.items:
-            shopping_basket.items.append(
-                models.ShoppingBasketItem(product_id=it.product_id, price=it.price or 0, amount=it.amount or 1))
+    shopping_basket = models.ShoppingBasket(country=data.country or DEFAULT_COUNTRY)
     db.add(shopping_basket)
+    await db.flush()
+    if data.items:
+        changes = await _increment_shopping_basket_items(
+            db, shopping_basket.id, shopping_basket.country, requested_amounts(data.items))
+        await _apply_shopping_basket_changes(db, shopping_basket.id, changes)
     await db.commit()
-    await db.refresh(shopping_basket)
     return shopping_basket
 
 
-async def get_shopping_basket(db: AsyncSession, basket_id: uuid.UUID) -> models.ShoppingBasket:
-    language = "nl_BE"
-    name_cms = aliased(models.Cms)
+def requested_amounts(items: List[schemas.ShoppingBasketItemCreate]) -> dict:
+    """Amounts per product of the items being added, the same product listed twice adds up."""
+    amounts = {}
+    for item in items:
+        if item.product_id is not None:
+            amounts[item.product_id] = amounts.get(item.product_id, 0) + item.amount
+    return amounts
 
-    stmt = (
-        select(models.ShoppingBasket)
-        .outerjoin(models.ShoppingBasket.items)
-        .outerjoin(models.ShoppingBasketItem.product)
-        .outerjoin(name_cms, and_(name_cms.code == models.Product.name, name_cms.language == language))
+
+async def _lock_shopping_basket(db: AsyncSession, basket_id: uuid.UUID) -> Optional[str]:
+    # touching the basket row serializes concurrent mutations of the same basket
+    return await db.scalar(
+        update(models.ShoppingBasket)
         .where(models.ShoppingBasket.id == basket_id)
-        .options(
-            selectinload(models.ShoppingBasket.items)
-            .selectinload(models.ShoppingBasketItem.product)
-            .selectinload(models.Product.category)
-        )
+        .values(updated_at=datetime.now())
+        .returning(models.ShoppingBasket.country))
+
+
+class _LineChange(NamedTuple):
+    old: int
+    new: int
+    price: int
+    tax_rate: int
+
+
+# Basket mutations report their effect per product as a _LineChange, which drives
+# both the stock reservations and the incremental basket totals.
+
+async def _upsert_shopping_basket_items(db: AsyncSession, basket_id: uuid.UUID, country: str, amounts: dict,
+                                        replace: bool = False) -> list:
+    """Insert or increment (or with ``replace``, overwrite) basket lines in one statement.
+
+    Price and tax rate are read from ``products`` and ``tax_rules`` inside the statement
+    and kept on the line; unknown products are skipped. Returns (product_id, amount, price, tax_rate) rows.
+    """
+    if not amounts:
+        return []
+    item = models.ShoppingBasketItem
+    requested = values(
+        column("product_id", models.Product.id.type),
+        column("amount", Integer),
+        name="requested",
+    ).data(list(amounts.items()))
+    stmt = pg_insert(item).from_select(
+        ["id", "shopping_basket_id", "product_id", "price", "tax_rate", "amount"],
+        select(func.gen_random_uuid(), literal(basket_id, models.ShoppingBasket.id.type), models.Product.id,
+               models.Product.price, tax_rate_for(country, models.Product.category_id), requested.c.amount)
+        .join(models.Product, models.Product.id == requested.c.product_id),
     )
-
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[item.shopping_basket_id, item.product_id],
+        set_={"amount": stmt.excluded.amount if replace else item.amount + stmt.excluded.amount},
+    ).returning(item.product_id, item.amount, item.price, item.tax_rate)
     result = await db.execute(stmt)
-    shopping_basket = result.scalars().unique().first()
-    if not shopping_basket:
+    return result.all()
+
+
+async def _increment_shopping_basket_items(db: AsyncSession, basket_id: uuid.UUID, country: str,
+                                           amounts: dict) -> dict:
+    rows = await _upsert_shopping_basket_items(db, basket_id, country, amounts)
+    return {pid: _LineChange(amount - amounts[pid], amount, price, rate) for pid, amount, price, rate in rows}
+
+
+async def _replace_shopping_basket_item(db: AsyncSession, basket_id: uuid.UUID, country: str,
+                                        product_id: uuid.UUID, amount: int) -> dict:
+    item = models.ShoppingBasketItem
+    key = (item.shopping_basket_id == basket_id, item.product_id == product_id)
+    if amount <= 0:
+        removed = (await db.execute(delete(item).where(*key).returning(item.amount, item.price, item.tax_rate))).first()
+        return {product_id: _LineChange(removed.amount, 0, removed.price, removed.tax_rate)} if removed else {}
+    old = await db.scalar(select(item.amount).where(*key)) or 0
+    rows = await _upsert_shopping_basket_items(db, basket_id, country, {product_id: amount}, replace=True)
+    return {pid: _LineChange(old, new, price, rate) for pid, new, price, rate in rows}
+
+
+async def _decrement_shopping_basket_item(db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                                          amount: int) -> dict:
+    item = models.ShoppingBasketItem
+    key = (item.shopping_basket_id == basket_id, item.product_id == product_id)
+    row = (await db.execute(
+        update(item).where(*key).values(amount=item.amount - amount)
+        .returning(item.amount, item.price, item.tax_rate))).first()
+    if row is None:
+        return {}
+    if row.amount <= 0:
+        await db.execute(delete(item).where(*key))
+    return {product_id: _LineChange(row.amount + amount, max(row.amount, 0), row.price, row.tax_rate)}
+
+
+def _totals_delta(changes) -> dict:
+    delta = dict(item_count=0, quantity=0, total_price_inclusive=0, tax=0)
+    for change in changes:
+        delta["item_count"] += (change.new > 0) - (change.old > 0)
+        delta["quantity"] += change.new - change.old
+        delta["total_price_inclusive"] += change.price * (change.new - change.old)
+        delta["tax"] += (line_tax(change.price, change.new, change.tax_rate)
+                         - line_tax(change.price, change.old, change.tax_rate))
+    delta["total_price_exclusive"] = delta["total_price_inclusive"] - delta["tax"]
+    return delta
+
+
+_totals_columns = (
+    models.ShoppingBasket.id,
+    models.ShoppingBasket.country,
+    models.ShoppingBasket.item_count,
+    models.ShoppingBasket.quantity,
+    models.ShoppingBasket.total_price_inclusive,
+    models.ShoppingBasket.total_price_exclusive,
+    models.ShoppingBasket.tax,
+)
+
+
+def _totals_view(row) -> read_models.ShoppingBasketTotalsView:
+    return read_models.ShoppingBasketTotalsView(*row)
+
+
+async def _apply_shopping_basket_changes(db: AsyncSession, basket_id: uuid.UUID,
+                                         changes: dict) -> read_models.ShoppingBasketTotalsView:
+    await reservations.release(db, basket_id, {pid: c.old - c.new for pid, c in changes.items() if c.new < c.old})
+    await reservations.reserve(db, basket_id, {pid: c.new - c.old for pid, c in changes.items() if c.new > c.old})
+    await reservations.extend(db, basket_id)
+    return await _update_shopping_basket_totals(db, basket_id, changes.values())
+
+
+async def _update_shopping_basket_totals(db: AsyncSession, basket_id: uuid.UUID,
+                                         changes) -> read_models.ShoppingBasketTotalsView:
+    basket = models.ShoppingBasket
+    delta = _totals_delta(changes)
+    row = (await db.execute(
+        update(basket)
+        .where(basket.id == basket_id)
+        .values({getattr(basket, name): getattr(basket, name) + value for name, value in delta.items()})
+        .returning(*_totals_columns))).first()
+    return _totals_view(row)
+
+
+async def reprice_shopping_basket_items(db: AsyncSession, basket_id: uuid.UUID,
+                                        lines) -> read_models.ShoppingBasketTotalsView:
+    """Move basket lines to new prices; ``lines`` are (product_id, amount, old price, new price, tax rate).
+
+    The caller holds the basket lock and commits.
+    """
+    item = models.ShoppingBasketItem
+    repriced = values(
+        column("product_id", models.Product.id.type),
+        column("price", Integer),
+        name="repriced",
+    ).data([(product_id, new) for product_id, _, _, new, _ in lines])
+    await db.execute(
+        update(item)
+        .where(item.shopping_basket_id == basket_id, item.product_id == repriced.c.product_id)
+        .values(price=repriced.c.price))
+    # each line leaves the totals at its old price and comes back at the new one
+    changes = [change for product_id, amount, old, new, tax_rate in lines
+               for change in (_LineChange(amount, 0, old, tax_rate), _LineChange(0, amount, new, tax_rate))]
+    return await _update_shopping_basket_totals(db, basket_id, changes)
+
+
+async def get_shopping_basket_totals(db: AsyncSession, basket_id: uuid.UUID) -> read_models.ShoppingBasketTotalsView:
+    row = (await db.execute(select(*_totals_columns).where(models.ShoppingBasket.id == basket_id))).first()
+    return _totals_view(row) if row else None
+
+
+async def _mutate_shopping_basket(db: AsyncSession, basket_id: uuid.UUID, mutation) -> read_models.ShoppingBasketTotalsView:
+    country = await _lock_shopping_basket(db, basket_id)
+    if country is None:
         return None
+    changes = await mutation(country)
+    totals = await _apply_shopping_basket_changes(db, basket_id, changes)
+    await db.commit()
+    return totals
 
-    for item in shopping_basket.items:
-        product = item.product
-        if product:
-            if getattr(product, 'name', None):
-                translated_name = await db.scalar(
-                    select(models.Cms.value).where(
-                        and_(models.Cms.code == product.name, models.Cms.language == language))
-                )
-                if translated_name:
-                    product.name = translated_name
 
-    return shopping_basket
+async def add_items_to_shopping_basket(db: AsyncSession, basket_id: uuid.UUID,
+                                       items: List[schemas.ShoppingBasketItemCreate]) -> read_models.ShoppingBasketTotalsView:
+    return await _mutate_shopping_basket(
+        db, basket_id,
+        lambda country: _increment_shopping_basket_items(db, basket_id, country, requested_amounts(items)))
+
+
+async def set_shopping_basket_item_amount(db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                                          amount: int) -> read_models.ShoppingBasketTotalsView:
+    return await _mutate_shopping_basket(
+        db, basket_id, lambda country: _replace_shopping_basket_item(db, basket_id, country, product_id, amount))
+
+
+async def change_shopping_basket_item_amount(db: AsyncSession, basket_id: uuid.UUID, product_id: uuid.UUID,
+                                             delta: int) -> read_models.ShoppingBasketTotalsView:
+    async def mutation(country):
+        if delta > 0:
+            return await _increment_shopping_basket_items(db, basket_id, country, {product_id: delta})
+        if delta < 0:
+            return await _decrement_shopping_basket_item(db, basket_id, product_id, -delta)
+        return {}
+
+    return await _mutate_shopping_basket(db, basket_id, mutation)
 
 
-async def add_item_to_shopping_basket(db: AsyncSession, basket_id: uuid.UUID,
-                                      item: schemas.ShoppingBasketItemCreate) -> models.ShoppingBasket:
-    shopping_basket = await get_shopping_basket(db, basket_id)
-    if shopping_basket is None:
+async def get_shopping_basket(db: AsyncSession, basket_id: uuid.UUID,
+                              languages: Sequence[str] = DEFAULT_LANGUAGES) -> read_models.ShoppingBasketView:
+    item = models.ShoppingBasketItem
+    language = product_view.view_language(languages)
+    stmt = (
+        select(
+            *_totals_columns,
+            item.id,
+            item.product_id,
+            item.price,
+            item.amount,
+            item.tax_rate,
+            *(_product_columns if language is None else _product_view_columns),
+        )
+        .select_from(models.ShoppingBasket)
+        .outerjoin(item, item.shopping_basket_id == models.ShoppingBasket.id)
+        .outerjoin(models.Product, models.Product.id == item.product_id)
+        .where(models.ShoppingBasket.id == basket_id)
+    )
+    if language is None:
+        stmt = stmt.outerjoin(models.Category, models.Category.id == models.Product.category_id)
+    else:
+        view = models.ProductView
+        stmt = stmt.outerjoin(view, and_(view.id == item.product_id, view.language == language))
+
+    rows = (await db.execute(stmt)).all()
+    if not rows:
         return None
-    found = False
-    for shopping_basket_item in shopping_basket.items:
-        if shopping_basket_item.product_id == item.product_id:
-            shopping_basket_item.amount += 1
-            found = True
-            break
-
-    if not found:
-        product = await get_product(db, item.product_id)
-        new = models.ShoppingBasketItem(product_id=item.product_id, price=product.price, amount=1)
-        shopping_basket.items.append(new)
-        db.add(shopping_basket)
-        await db.commit()
-        await db.refresh(new)
-
-    if found:
-        db.add(shopping_basket)
-        await db.commit()
+
+    totals = len(_totals_columns)
+    shopping_basket = read_models.ShoppingBasketView(*rows[0][:totals])
+    products = []
+    for row in rows:
+        item_id, product_id, item_price, amount, tax_rate = row[totals:totals + 5]
+        if item_id is None:
+            continue
+        product_row = row[totals + 5:]
+        product = _product_view(product_row) if product_row[0] is not None else None
+        if product is not None:
+            products.append(product)
+        shopping_basket.items.append(read_models.ShoppingBasketItemView(
+            id=item_id, product_id=product_id, price=item_price, amount=amount, tax_rate=tax_rate, product=product))
+
+    if language is None:
+        await _translate_products(db, products, languages)
     return shopping_basket
 
 
+async def add_item_to_shopping_basket(db: AsyncSession, basket_id: uuid.UUID, item: schemas.ShoppingBasketItemCreate,
+                                      languages: Sequence[str] = DEFAULT_LANGUAGES) -> read_models.ShoppingBasketView:
+    if await add_items_to_shopping_basket(db, basket_id, [item]) is None:
+        return None
+    return await get_shopping_basket(db, basket_id, languages)
+
+
 async def remove_item_from_shopping_basket(db: AsyncSession, item_id: uuid.UUID) -> None:
-    await db.execute(delete(models.ShoppingBasketItem).where(models.ShoppingBasketItem.id == item_id))
+    item = models.ShoppingBasketItem
+    basket_id = await db.scalar(select(item.shopping_basket_id).where(item.id == item_id))
+    if basket_id is not None and await _lock_shopping_basket(db, basket_id):
+        removed = (await db.execute(
+            delete(item).where(item.id == item_id)
+            .returning(item.product_id, item.amount, item.price, item.tax_rate))).first()
+        if removed is not None:
+            await _apply_shopping_basket_changes(
+                db, basket_id, {removed.product_id: _LineChange(removed.amount, 0, removed.price, removed.tax_rate)})
+    await db.commit()
+
+
+async def create_tax_rule(db: AsyncSession, data: schemas.TaxRuleCreate) -> models.TaxRule:
+    # lines already in a basket keep the rate they were added with
+    rule = models.TaxRule
+    now = datetime.now()
+    stmt = pg_insert(rule).values(id=uuid.uuid4(), country=data.country, category_id=data.category_id,
+                                  rate=data.rate, created_at=now, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rule.country, rule.category_id],
+        set_={"rate": stmt.excluded.rate, "updated_at": stmt.excluded.updated_at},
+    ).returning(rule)
+    result = await db.execute(select(rule).from_statement(stmt).execution_options(populate_existing=True))
+    created = result.scalar_one()
+    await db.commit()
+    return created
+
+
+async def list_tax_rules(db: AsyncSession) -> List[models.TaxRule]:
+    rules = await db.execute(select(models.TaxRule).order_by(models.TaxRule.country, models.TaxRule.category_id))
+    return rules.scalars().all()
+
+
+async def delete_tax_rule(db: AsyncSession, rule_id: uuid.UUID) -> None:
+    await db.execute(delete(models.TaxRule).where(models.TaxRule.id == rule_id))
     await db.commit()
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Sequence
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, notifications, serializers
+
+logger = logging.getLogger(__name__)
+
+VERSION_CHANNEL = "cache_versions_changed"
+
+HTTP_CACHE_SIZE = int(os.getenv("HTTP_CACHE_SIZE", "2000"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# stock moves with every basket reservation; rather than a version bump per change each
+# worker bumps the stock group at most this often, and responses showing stock may be
+# reused by clients for as long (Cache-Control: max-age); 0 leaves stock out of the versions
+HTTP_CACHE_MAX_AGE = float(os.getenv("HTTP_CACHE_MAX_AGE", "5"))
+# redis://... to share rendered responses between workers, in-process memory otherwise
+HTTP_CACHE_URL = os.getenv("HTTP_CACHE_URL", "")
+
+# entity groups each cached endpoint depends on
+CATEGORIES = ("categories",)
+TRANSLATIONS = ("cms",)
+STOCK = "stock"
+PRODUCTS = ("products", "categories", "cms", STOCK)
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def dumps(self) -> bytes:
+        meta = json.dumps({"media_type": self.media_type, "headers": self.headers})
+        return meta.encode() + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        meta, body = data.split(b"\n", 1)
+        return cls(body, **json.loads(meta))
+
+
+class CacheBackend(ABC):
+    """Storage for rendered responses keyed by ETag; keys embed the versions, so nothing is ever stale."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    """LRU bounded by entry count and total body size."""
+
+    def __init__(self, maxsize: int = HTTP_CACHE_SIZE, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.body)
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while len(self._entries) > self.maxsize or self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+class RedisBackend(CacheBackend):
+    """Shares rendered responses between workers; entries expire on their own since old keys are never read again."""
+
+    def __init__(self, url: str, ttl: int = 3600, prefix: str = "http-cache:"):
+        import redis.asyncio as redis  # optional dependency, only needed when HTTP_CACHE_URL is set
+
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        data = await self._redis.get(self.prefix + key)
+        return CachedResponse.loads(data) if data is not None else None
+
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        await self._redis.set(self.prefix + key, entry.dumps(), ex=self.ttl)
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(match=self.prefix + "*"):
+            await self._redis.delete(key)
+
+
+def _if_none_match(request: Request) -> set:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return set()
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+class ResponseCache:
+    """Conditional GET support for catalog reads.
+
+    The ETag of a response is derived from the request and the versions of the
+    entity groups it depends on, so a matching If-None-Match is answered with a
+    304 before any database work, and rendered bodies are reused until a write
+    bumps one of the groups. Responses that show stock may be reused by clients
+    for ``max_age`` seconds without asking.
+    """
+
+    def __init__(self, backend: CacheBackend, max_age: float = HTTP_CACHE_MAX_AGE):
+        self.backend = backend
+        self.max_age = max_age
+        self.versions: Dict[str, int] = {}
+
+    def set_versions(self, versions: Dict[str, int]) -> None:
+        for name, version in versions.items():
+            # notifications can arrive after the writer already applied a newer version
+            if version > self.versions.get(name, 0):
+                self.versions[name] = version
+
+    async def load_versions(self, db) -> None:
+        result = await db.execute(select(models.CacheVersion.name, models.CacheVersion.version))
+        self.set_versions(dict(result.all()))
+
+    def etag(self, key: str, groups: Iterable[str]) -> str:
+        versions = ",".join(f"{name}={self.versions.get(name, 0)}" for name in sorted(groups))
+        digest = hashlib.sha1(f"{key}|{versions}".encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    async def respond(self, request: Request, groups: Iterable[str],
+                      build: Callable[[], Awaitable[CachedResponse]], languages: Sequence[str] = ()) -> Response:
+        """``languages`` is the negotiated chain for responses that are translated."""
+        key = request.url.path
+        if request.url.query:
+            key += "?" + "&".join(sorted(request.url.query.split("&")))
+        if languages:
+            key += "#" + ",".join(languages)
+        etag = self.etag(key, groups)
+        fresh_for = f"max-age={self.max_age:g}" if STOCK in groups and self.max_age > 0 else "no-cache"
+        headers = {"ETag": etag, "Cache-Control": fresh_for}
+        if languages:
+            headers["Vary"] = "Accept-Language"
+        if etag in _if_none_match(request):
+            return Response(status_code=304, headers=headers)
+        entry = await self.backend.get(etag)
+        if entry is None:
+            entry = await build()
+            await self.backend.set(etag, entry)
+        return Response(entry.body, media_type=entry.media_type, headers={**entry.headers, **headers})
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+def render(schema, value, headers: Optional[Dict[str, str]] = None) -> CachedResponse:
+    """Validate ``value`` (ORM objects, read models or dicts) against ``schema`` and render it as JSON.
+
+    With FAST_SERIALIZATION, schemas that have a hand-written encoder in ``serializers`` skip pydantic validation.
+    """
+    body = serializers.encode(schema, value)
+    if body is None:
+        adapter = _adapter(schema)
+        body = adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+    return CachedResponse(body, headers=headers or {})
+
+
+responses = ResponseCache(RedisBackend(HTTP_CACHE_URL) if HTTP_CACHE_URL else MemoryBackend())
+
+
+async def bump(db: AsyncSession, *groups: str) -> Dict[str, int]:
+    """Increment the versions of ``groups`` and tell the other workers, in a transaction of its own.
+
+    Every write to a group goes through the same row of ``cache_versions``, so the row lock
+    is only held for one statement and its commit, after the write itself has committed.
+    """
+    version = models.CacheVersion
+    bumped = pg_insert(version).values([dict(name=name, version=1) for name in sorted(set(groups))])
+    bumped = bumped.on_conflict_do_update(
+        index_elements=[version.name], set_={"version": version.version + 1},
+    ).returning(version.name, version.version).cte("bumped")
+    versions = cast(func.json_object_agg(bumped.c.name, bumped.c.version), String)
+    payload = (await db.execute(select(versions, func.pg_notify(VERSION_CHANNEL, versions)))).scalar()
+    await db.commit()
+    return json.loads(payload)
+
+
+async def commit(db: AsyncSession, *groups: str) -> None:
+    """Commit a write to ``groups`` and move their cached responses to new ETags.
+
+    Until the versions are bumped right after, readers may still cache the new data under
+    the old ETags, which is harmless. When the bump fails the write stays committed and
+    cached responses of the groups lag behind until the next write to them.
+    """
+    await db.commit()
+    try:
+        versions = await bump(db, *groups)
+    except Exception:
+        await db.rollback()
+        logger.exception("bumping the cache versions of %s failed", ", ".join(groups))
+        return
+    responses.set_versions(versions)
+
+
+_stock_changes = 0
+
+
+def stock_changed() -> None:
+    """Note that this worker moved product stock, ``bump_stock_forever`` gives it a new version."""
+    global _stock_changes
+    _stock_changes += 1
+
+
+async def bump_stock_forever(session_factory, interval: float = HTTP_CACHE_MAX_AGE) -> None:
+    seen, pending = _stock_changes, False
+    while True:
+        await asyncio.sleep(interval)
+        changed, seen = _stock_changes != seen, _stock_changes
+        # a change is noted before its transaction commits, bumping again on the next tick
+        # covers readers that cached the old stock under the new version in between
+        if changed or pending:
+            try:
+                async with session_factory() as db:
+                    responses.set_versions(await bump(db, STOCK))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("bumping the stock cache version failed")
+        pending = changed
+
+
+def _on_version_notification(payload: str) -> None:
+    responses.set_versions(json.loads(payload))
+
+
+async def _on_listener_connect(conn) -> None:
+    await responses.load_versions(conn)
+
+
+notifications.subscribe(VERSION_CHANNEL, _on_version_notification, _on_listener_connect)
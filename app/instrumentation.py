@@ -0,0 +1,143 @@
+"""Per-request SQL accounting, Server-Timing headers, route metrics and the slow query log.
+
+Cursor events count the statements of the request they run in through a context
+variable; ``InstrumentationMiddleware`` opens that context, answers with
+``Server-Timing: db;dur=..;desc="N queries", app;dur=..`` and records the request
+under its route template in ``metrics``. The work per statement is two clock reads
+and a few additions, so all of it stays on in production.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# statements taking longer are logged and kept in metrics.slow_queries, 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# requests running more statements than this are logged, they usually load rows one by one in a loop
+REQUEST_QUERY_WARNING = int(os.getenv("REQUEST_QUERY_WARNING", "50"))
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+_FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\$\d+(?:::\w+(?:\[\])?(?: WITH(?:OUT)? TIME ZONE)?)?|%\(\w+\)s|%s"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\[\s*\?(?:\s*,\s*\?)*\s*\]"), "[...]"),
+    (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+class RequestStats:
+    __slots__ = ("path", "queries", "db_time")
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    """Statistics of the request being handled, None outside a request."""
+    return _request.get()
+
+
+def normalize(statement: str) -> str:
+    """The statement with literals, parameters and IN/VALUES lists replaced by placeholders."""
+    for pattern, replacement in _FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def _digest(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def fingerprint(statement: str) -> str:
+    """Short id shared by every execution of the same statement, whatever its parameters."""
+    return _digest(normalize(statement))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._instrumentation_start
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        normalized = normalize(statement)
+        key = _digest(normalized)
+        metrics.slow_query(key, normalized, elapsed)
+        logger.warning("slow query %s took %.1f ms%s: %s", key, elapsed * 1000,
+                       f" in {stats.path}" if stats is not None else "", normalized[:1000])
+
+
+def instrument(engine: AsyncEngine) -> AsyncEngine:
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def route_template(scope) -> str:
+    """The path template of the matched route, keeping metric labels bounded."""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # FastAPI releases that keep included routers nested match the router's own route, which
+    # leaves out the prefix given to include_router; it is what the path has in front of it
+    depth = route.path.count("/")
+    return "/".join(scope["path"].split("/")[:-depth]) + route.path
+
+
+class InstrumentationMiddleware:
+    """Counts the statements and database time of every request and records it per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope["path"])
+        token = _request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    total = 1000 * (time.perf_counter() - start)
+                    db = 1000 * stats.db_time
+                    timing = f'db;dur={db:.1f};desc="{stats.queries} queries", app;dur={total - db:.1f}'
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request.reset(token)
+            route = route_template(scope)
+            metrics.route_metrics(scope["method"], route).observe(
+                time.perf_counter() - start, status, stats.queries, stats.db_time)
+            if stats.queries > REQUEST_QUERY_WARNING:
+                logger.warning("%s %s ran %d queries (%.1f ms in the database)", scope["method"], scope["path"],
+                               stats.queries, 1000 * stats.db_time)
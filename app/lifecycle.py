@@ -0,0 +1,103 @@
+"""Getting the database and a worker ready, and shutting a worker down.
+
+``prepare`` brings the database up to date: the migrations, then whatever the app
+derives from other tables and is still missing (category closure, search documents,
+product view rows). It runs once per deploy, from ``run.py migrate`` or from
+``run.py serve`` before it starts the workers, and in every worker only when
+DB_MIGRATE_ON_STARTUP is set, the default for development.
+
+``warm`` runs before a worker takes traffic, once the notification listener is
+connected (its connect hooks would drop what was warmed before): it opens pooled
+connections, loads the translation cache and the response cache versions, and reads
+the catalog pages most requests start from, so Postgres has them in its buffers. ``shutdown`` runs once
+uvicorn has finished the requests in flight: stored baskets are written to Postgres
+and the engines closed.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from . import basket_store, crud, http_cache
+from .database import AsyncSessionLocal, POOL_SIZE, engine, read_session, replica_engines, upgrade_schema
+from .product_view import PRODUCT_VIEW_LANGUAGES, ensure_product_view
+from .search import ensure_product_search
+from .translations import language_chain, translations
+
+logger = logging.getLogger(__name__)
+
+# connections each engine opens before the worker takes traffic
+WARM_CONNECTIONS = int(os.getenv("WARM_CONNECTIONS", str(POOL_SIZE)))
+# products read per view language while warming
+WARM_PRODUCTS = int(os.getenv("WARM_PRODUCTS", "100"))
+
+_imported_at = time.monotonic()
+
+# seconds from the process starting to the worker being ready, None until it is
+startup_seconds: Optional[float] = None
+warmup_seconds: Optional[float] = None
+
+
+def _process_age() -> float:
+    # /proc has when the process started, which includes the imports; elsewhere count from this import
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+
+async def prepare() -> None:
+    await upgrade_schema()
+    async with AsyncSessionLocal() as session:
+        await crud.ensure_category_closure(session)
+        await ensure_product_search(session)
+        await ensure_product_view(session)
+
+
+async def _open_connections(bind: AsyncEngine, n: int) -> None:
+    async def touch():
+        async with bind.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # concurrently, so the pool ends up holding n connections
+    await asyncio.gather(*(touch() for _ in range(n)))
+
+
+async def warm() -> None:
+    start = time.perf_counter()
+    await asyncio.gather(*(_open_connections(bind, WARM_CONNECTIONS) for bind in [engine, *replica_engines]))
+    async with AsyncSessionLocal() as session:
+        await translations.warm(session)
+        await http_cache.responses.load_versions(session)
+    async with read_session() as session:
+        await crud.list_categories(session)
+        for language in PRODUCT_VIEW_LANGUAGES:
+            await crud.list_products(session, limit=WARM_PRODUCTS, languages=language_chain([language]))
+    global warmup_seconds
+    warmup_seconds = time.perf_counter() - start
+
+
+def ready() -> None:
+    global startup_seconds
+    startup_seconds = _process_age()
+    logger.info("worker %d ready %.0f ms after starting, %.0f ms of it warming up",
+                os.getpid(), 1000 * startup_seconds, 1000 * (warmup_seconds or 0))
+
+
+async def shutdown() -> None:
+    if basket_store.store is not None:
+        try:
+            async with AsyncSessionLocal() as session:
+                while await basket_store.store.flush(session):
+                    pass
+        except Exception:
+            logger.exception("flushing stored baskets on shutdown failed")
+    await asyncio.gather(*(bind.dispose() for bind in [engine, *replica_engines]))
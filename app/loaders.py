@@ -0,0 +1,99 @@
+"""Request-scoped batching of lookups by key.
+
+A loader collects the keys asked for while the event loop works through the
+callbacks that are ready and fetches all of them on the next tick with one
+batch function, usually one ``IN (...)`` query. Lookups started together, an
+``asyncio.gather`` over single-item crud calls or separate code paths that each
+need a product, share a statement instead of running one each.
+
+Loaders live in ``session.info``, so they are as long-lived as the request that
+owns the session. The batches of one session run one at a time, since a session
+cannot run statements concurrently; batch functions therefore must not wait on a
+loader themselves. Nothing is cached past its batch: a lookup after a write sees
+the write.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchFunction = Callable[[AsyncSession, List[K]], Awaitable[Dict[K, V]]]
+
+# keys fetched per statement; bigger batches are split
+MAX_BATCH_SIZE = 1000
+
+_LOADERS = "loaders"
+_LOCK = "loaders_lock"
+
+# batches in flight, referenced so they are not garbage collected before they finish
+_batches: set = set()
+
+
+class BatchLoader(Generic[K, V]):
+    def __init__(self, db: AsyncSession, batch: BatchFunction, lock: asyncio.Lock,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        self._db = db
+        self._batch = batch
+        self._lock = lock
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[K, asyncio.Future] = {}
+        # number of batch function calls, for tests and debugging
+        self.batches = 0
+
+    def load(self, key: K) -> "asyncio.Future[Optional[V]]":
+        """Future of the value for ``key``, None when the batch function did not return it."""
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            future = self._pending[key] = loop.create_future()
+        return future
+
+    async def load_many(self, keys: Iterable[K]) -> Dict[K, V]:
+        keys = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*(self.load(key) for key in keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(pending))
+        _batches.add(task)
+        task.add_done_callback(_batches.discard)
+
+    async def _run(self, pending: Dict[K, asyncio.Future]) -> None:
+        keys = list(pending)
+        try:
+            found = {}
+            async with self._lock:
+                for start in range(0, len(keys), self.max_batch_size):
+                    self.batches += 1
+                    found.update(await self._batch(self._db, keys[start:start + self.max_batch_size]))
+        except asyncio.CancelledError:
+            for future in pending.values():
+                future.cancel()
+            raise
+        except Exception as exc:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+def loader(db: AsyncSession, name: Hashable, batch: BatchFunction) -> BatchLoader:
+    """The session's loader called ``name``, created with ``batch`` on first use.
+
+    ``name`` has to cover everything ``batch`` depends on besides the keys, such as the languages.
+    """
+    loaders = db.info.setdefault(_LOADERS, {})
+    found = loaders.get(name)
+    if found is None:
+        lock = db.info.setdefault(_LOCK, asyncio.Lock())
+        found = loaders[name] = BatchLoader(db, batch, lock)
+    return found
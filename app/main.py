@@ -1,18 +1,82 @@
 # app/main.py
-from fastapi import FastAPI
-from .database import engine
-from .models import Base
-from .router import cms, category, product, shopping_basket
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="My Shop API")
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from . import basket_store, changes, database, http_cache, lifecycle, notifications, outbox, repository, reservations
+from .admission import AdmissionMiddleware
+from .instrumentation import InstrumentationMiddleware
+from .database import engine, AsyncSessionLocal
+from .router import bulk, changes as changes_router, cms, category, ops, order, product, search, shopping_basket, tax
+
+logger = logging.getLogger(__name__)
+
+background_tasks = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # uvicorn only hands the worker requests once this has yielded
+    if repository.memory is None:
+        if database.MIGRATE_ON_STARTUP:
+            await lifecycle.prepare()
+        # the listener's connect hooks drop the caches, so it connects before they are warmed
+        listening = asyncio.Event()
+        background_tasks.add(asyncio.create_task(notifications.listen_forever(engine, connected=listening)))
+        try:
+            await asyncio.wait_for(listening.wait(), notifications.LISTEN_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("notification listener not connected after %s seconds, warming up without it",
+                           notifications.LISTEN_CONNECT_TIMEOUT)
+        await lifecycle.warm()
+        background_tasks.add(asyncio.create_task(reservations.sweep_forever(AsyncSessionLocal)))
+        background_tasks.add(asyncio.create_task(outbox.drain_forever(AsyncSessionLocal)))
+        background_tasks.add(asyncio.create_task(basket_store.purge_forever(AsyncSessionLocal)))
+        background_tasks.add(asyncio.create_task(changes.purge_forever(AsyncSessionLocal)))
+        if http_cache.HTTP_CACHE_MAX_AGE > 0:
+            background_tasks.add(asyncio.create_task(http_cache.bump_stock_forever(AsyncSessionLocal)))
+        if basket_store.store is not None:
+            background_tasks.add(asyncio.create_task(basket_store.flush_forever(AsyncSessionLocal)))
+    lifecycle.ready()
+    yield
+    # on shutdown uvicorn stops accepting and waits for the requests in flight before getting here
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await lifecycle.shutdown()
+
+
+app = FastAPI(title="My Shop API", lifespan=lifespan)
+# added first so it runs inside the instrumentation, whose route metrics then include the shed requests
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(InstrumentationMiddleware)
 
 app.include_router(cms.router, prefix="/api")
 app.include_router(category.router, prefix="/api")
 app.include_router(product.router, prefix="/api")
 app.include_router(shopping_basket.router, prefix="/api")
+app.include_router(order.router, prefix="/api")
+app.include_router(search.router, prefix="/api")
+app.include_router(tax.router, prefix="/api")
+app.include_router(bulk.router, prefix="/api")
+app.include_router(changes_router.router, prefix="/api")
+app.include_router(ops.router, prefix="/api")
+
+
+@app.exception_handler(reservations.OutOfStockError)
+async def out_of_stock(request: Request, exc: reservations.OutOfStockError):
+    return JSONResponse(status_code=409, content={"detail": str(exc), "product_id": str(exc.product_id)})
+
+
+@app.exception_handler(basket_store.BasketConflictError)
+async def basket_conflict(request: Request, exc: basket_store.BasketConflictError):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
 
-@app.on_event("startup")
-async def on_startup():
-    async with engine.begin() as conn:
-        # create tables if not exists (dev convenience)
-        await conn.run_sync(Base.metadata.create_all)
+@app.exception_handler(PoolTimeoutError)
+async def pool_exhausted(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": "database busy"}, headers={"Retry-After": "1"})
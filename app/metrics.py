@@ -0,0 +1,201 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# upper bounds in seconds for the pool checkout wait histogram
+WAIT_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+# upper bounds in seconds for request latency
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+# distinct slow statements kept, the one with the least total time makes room for a new one
+SLOW_QUERY_FINGERPRINTS = 500
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else str(bound)
+
+
+class Histogram:
+    """Cumulative histogram: every bucket counts the observations up to its upper bound."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def cumulative(self) -> Dict[str, int]:
+        return {_bound(bound): count for bound, count in zip(self.buckets, self.counts)}
+
+
+class PoolMetrics(Histogram):
+    """Connection checkout wait times for one engine."""
+
+    def __init__(self, buckets: Tuple[float, ...] = WAIT_BUCKETS):
+        super().__init__(buckets)
+        self.timeouts = 0
+
+    @property
+    def checkouts(self) -> int:
+        return self.count
+
+    def snapshot(self) -> dict:
+        return dict(
+            checkouts=self.count,
+            timeouts=self.timeouts,
+            wait_avg_ms=round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            wait_max_ms=round(1000 * self.max, 3),
+            wait_buckets=self.cumulative(),
+        )
+
+
+class RouteMetrics:
+    """Requests to one route: latency, status codes and the database work they did."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.latency = Histogram(buckets)
+        self.statuses: Counter = Counter()
+        self.queries = 0
+        self.db_time = 0.0
+
+    def observe(self, seconds: float, status: int, queries: int, db_time: float) -> None:
+        self.latency.observe(seconds)
+        self.statuses[status] += 1
+        self.queries += queries
+        self.db_time += db_time
+
+
+class QueryMetrics:
+    """Executions of one statement fingerprint that took longer than the slow query threshold."""
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+_pools: Dict[str, PoolMetrics] = {}
+_routes: Dict[Tuple[str, str], RouteMetrics] = {}
+_slow_queries: Dict[str, QueryMetrics] = {}
+
+
+def pool_metrics(name: str) -> PoolMetrics:
+    if name not in _pools:
+        _pools[name] = PoolMetrics()
+    return _pools[name]
+
+
+def route_metrics(method: str, route: str) -> RouteMetrics:
+    key = (method, route)
+    if key not in _routes:
+        _routes[key] = RouteMetrics()
+    return _routes[key]
+
+
+def slow_query(fingerprint: str, statement: str, seconds: float) -> None:
+    entry = _slow_queries.get(fingerprint)
+    if entry is None:
+        if len(_slow_queries) >= SLOW_QUERY_FINGERPRINTS:
+            del _slow_queries[min(_slow_queries, key=lambda key: _slow_queries[key].total)]
+        entry = _slow_queries[fingerprint] = QueryMetrics(statement)
+    entry.observe(seconds)
+
+
+def slow_queries(limit: int = 50) -> List[dict]:
+    ranked = sorted(_slow_queries.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+    return [
+        dict(fingerprint=fingerprint, count=q.count, total_ms=round(1000 * q.total, 3),
+             avg_ms=round(1000 * q.total / q.count, 3), max_ms=round(1000 * q.max, 3), statement=q.statement)
+        for fingerprint, q in ranked
+    ]
+
+
+def _labels(**labels) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _histogram(lines: List[str], name: str, histogram: Histogram, **labels) -> None:
+    for bound, count in histogram.cumulative().items():
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.total}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+def render_prometheus(pools: Dict[str, dict], admission: Optional[Dict[str, dict]] = None) -> str:
+    """Everything collected so far in the Prometheus text format.
+
+    ``pools`` is ``database.pool_status()``, ``admission`` is ``admission.control.status()``.
+    """
+    lines = [
+        "# HELP http_requests_total Requests handled, by route and status code.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route), m in sorted(_routes.items()):
+        for status, count in sorted(m.statuses.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+    lines += ["# HELP http_request_duration_seconds Request latency.",
+              "# TYPE http_request_duration_seconds histogram"]
+    for (method, route), m in sorted(_routes.items()):
+        _histogram(lines, "http_request_duration_seconds", m.latency, method=method, route=route)
+    lines += ["# HELP db_queries_total SQL statements run by requests.", "# TYPE db_queries_total counter"]
+    for (method, route), m in sorted(_routes.items()):
+        lines.append(f"db_queries_total{_labels(method=method, route=route)} {m.queries}")
+    lines += ["# HELP db_query_duration_seconds_total Time requests spent waiting on SQL statements.",
+              "# TYPE db_query_duration_seconds_total counter"]
+    for (method, route), m in sorted(_routes.items()):
+        lines.append(f"db_query_duration_seconds_total{_labels(method=method, route=route)} {m.db_time}")
+    lines += ["# HELP db_slow_queries_total Statements slower than SLOW_QUERY_MS.",
+              "# TYPE db_slow_queries_total counter",
+              f"db_slow_queries_total {sum(q.count for q in _slow_queries.values())}"]
+
+    lines += ["# HELP db_pool_connections Connections of each pool, by state.", "# TYPE db_pool_connections gauge"]
+    for engine, status in sorted(pools.items()):
+        for state in ("checked_in", "checked_out", "overflow"):
+            lines.append(f"db_pool_connections{_labels(engine=engine, state=state)} {status[state]}")
+    lines += ["# HELP db_pool_checkout_timeouts_total Checkouts that gave up waiting for a connection.",
+              "# TYPE db_pool_checkout_timeouts_total counter"]
+    for engine, pool in sorted(_pools.items()):
+        lines.append(f"db_pool_checkout_timeouts_total{_labels(engine=engine)} {pool.timeouts}")
+    lines += ["# HELP db_pool_checkout_wait_seconds Time spent waiting for a pooled connection.",
+              "# TYPE db_pool_checkout_wait_seconds histogram"]
+    for engine, pool in sorted(_pools.items()):
+        _histogram(lines, "db_pool_checkout_wait_seconds", pool, engine=engine)
+
+    if admission:
+        gauges = [("admission_limit", "limit", "Requests of each route group allowed to run at once."),
+                  ("admission_inflight", "inflight", "Requests of each route group running."),
+                  ("admission_queued", "queued", "Requests of each route group waiting for a slot.")]
+        for name, key, description in gauges:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{_labels(group=group)} {status[key]}" for group, status in admission.items()]
+        lines += ["# HELP admission_admitted_total Requests admitted, by route group.",
+                  "# TYPE admission_admitted_total counter"]
+        lines += [f"admission_admitted_total{_labels(group=group)} {status['admitted']}"
+                  for group, status in admission.items()]
+        lines += ["# HELP admission_shed_total Requests answered 503 without running, by route group and reason.",
+                  "# TYPE admission_shed_total counter"]
+        for group, status in admission.items():
+            for reason in ("queue_full", "timeout"):
+                lines.append(f"admission_shed_total{_labels(group=group, reason=reason)} {status['shed'].get(reason, 0)}")
+        lines += ["# HELP admission_queue_wait_seconds Time admitted requests waited for a slot.",
+                  "# TYPE admission_queue_wait_seconds histogram"]
+        for group, status in admission.items():
+            for bound, count in status["queue_wait_buckets"].items():
+                lines.append(f"admission_queue_wait_seconds_bucket{_labels(group=group, le=bound)} {count}")
+            lines.append(f"admission_queue_wait_seconds_sum{_labels(group=group)} {status['queue_wait_sum']}")
+            lines.append(f"admission_queue_wait_seconds_count{_labels(group=group)} {status['queue_wait_count']}")
+    return "\n".join(lines) + "\n"
@@ -2,7 +2,9 @@ import uuid
 
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, Table, ForeignKey, UUID
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Table, ForeignKey, UUID, Index, UniqueConstraint, text
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -18,12 +20,18 @@ class Cms(Base):
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
+    __table_args__ = (
+        UniqueConstraint('code', 'language', name='uq_cms_code_language'),
+    )
+
 
 category_children = Table(
     'category_children',
     Base.metadata,
     Column('parent_id', UUID(as_uuid=True), ForeignKey('categories.id'), primary_key=True),
-    Column('child_id', UUID(as_uuid=True), ForeignKey('categories.id'), primary_key=True)
+    Column('child_id', UUID(as_uuid=True), ForeignKey('categories.id'), primary_key=True),
+    # the primary key serves parent -> children, this one children -> parents
+    Index('ix_category_children_child_id', 'child_id'),
 )
 
 
@@ -46,6 +54,17 @@ class Category(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class CategoryClosure(Base):
+    """Every (ancestor, descendant) pair of the category graph, including (c, c, 0)."""
+    __tablename__ = 'category_closure'
+    ancestor_id = Column(UUID(as_uuid=True), ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = Column(UUID(as_uuid=True), ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_category_closure_descendant_id', 'descendant_id', 'depth'),
+    )
+
 
 class Product(Base):
     __tablename__ = 'products'
@@ -62,9 +81,72 @@ class Product(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     category = relationship("Category")
 
+    __table_args__ = (
+        UniqueConstraint('code', name='uq_products_code'),
+        Index('ix_products_category_id', 'category_id'),
+        # keyset pagination order of list_products
+        Index('ix_products_created_at_id', 'created_at', 'id'),
+        # products whose name or description is a cms code, looked up by equality only;
+        # hash indexes since descriptions can outgrow a btree entry
+        Index('ix_products_name', 'name', postgresql_using='hash'),
+        Index('ix_products_description', 'description', postgresql_using='hash'),
+    )
+
+
+class ProductSearch(Base):
+    """Search document of a product per language, with the translated name and description."""
+    __tablename__ = 'product_search'
+    product_id = Column(UUID(as_uuid=True), ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    language = Column(String, primary_key=True)
+    name = Column(String)
+    description = Column(String)
+    brand = Column(String)
+    category_id = Column(UUID(as_uuid=True))
+    document = Column(TSVECTOR, nullable=False)
+
+    __table_args__ = (
+        Index('ix_product_search_document', 'document', postgresql_using='gin'),
+        Index('ix_product_search_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_product_search_language_category', 'language', 'category_id'),
+        Index('ix_product_search_language_brand', 'language', 'brand'),
+    )
+
+
+event.listen(ProductSearch.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+
+class ProductView(Base):
+    """A product per language as the catalog reads it: translated, with its category name.
+
+    Stock is left out, it changes with every basket and is read from ``products``.
+    """
+    __tablename__ = 'product_view'
+    id = Column('product_id', UUID(as_uuid=True), ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    language = Column(String, primary_key=True)
+    name = Column(String)
+    description = Column(String)
+    brand = Column(String)
+    code = Column(String)
+    image_url = Column(String)
+    price = Column(Integer)
+    category_id = Column(UUID(as_uuid=True))
+    category_name = Column(String)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        # keyset pagination order of list_products
+        Index('ix_product_view_language_created_at', 'language', 'created_at', 'product_id'),
+        Index('ix_product_view_category_id', 'category_id', 'language'),
+        Index('ix_product_view_code', 'code'),
+    )
+
 
 class ShoppingBasket(Base):
     __tablename__ = 'shopping_basket'
+    __table_args__ = (
+        # the stale basket purge walks baskets by last update
+        Index('ix_shopping_basket_updated_at', 'updated_at'),
+    )
     id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True)
 
     items = relationship(
@@ -73,20 +155,49 @@ class ShoppingBasket(Base):
         cascade="all, delete-orphan"
     )
 
+    country = Column(String, nullable=False, default='BE')
+
+    # maintained incrementally by every item mutation in crud, amounts in cents
+    item_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    total_price_inclusive = Column(Integer, nullable=False, default=0)
+    total_price_exclusive = Column(Integer, nullable=False, default=0)
+    tax = Column(Integer, nullable=False, default=0)
+
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
-    @property
-    def total_price_exclusive(self):
-        return self.total_price_inclusive / 1.21
 
-    @property
-    def tax(self):
-        return self.total_price_inclusive - self.total_price_exclusive
+class TaxRule(Base):
+    """VAT rate in basis points for a country, optionally narrowed to a category subtree."""
+    __tablename__ = 'tax_rules'
+    id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True)
+    country = Column(String, nullable=False)
+    category_id = Column(UUID(as_uuid=True), ForeignKey('categories.id', ondelete='CASCADE'))
+    rate = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('country', 'category_id', name='uq_tax_rules_country_category',
+                         postgresql_nulls_not_distinct=True),
+    )
+
+
+class StockReservation(Base):
+    """Stock held for a basket line until ``expires_at``; already subtracted from Product.stock."""
+    __tablename__ = 'stock_reservations'
+    shopping_basket_id = Column(UUID(as_uuid=True), ForeignKey("shopping_basket.id"), primary_key=True)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), primary_key=True)
+    amount = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index('ix_stock_reservations_product_id', 'product_id'),
+    )
 
-    @property
-    def total_price_inclusive(self):
-        return sum(item.price * item.amount for item in self.items)
 
 class ShoppingBasketItem(Base):
     __tablename__ = 'shopping_basket_items'
@@ -100,6 +211,7 @@ class ShoppingBasketItem(Base):
 
     price = Column(Integer)
     amount = Column(Integer)
+    tax_rate = Column(Integer, nullable=False, default=0)
     product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"))
 
     basket = relationship(
@@ -108,9 +220,108 @@ class ShoppingBasketItem(Base):
     )
     product = relationship("Product")
 
+    __table_args__ = (
+        # also the index for lookups by basket, it leads with shopping_basket_id
+        UniqueConstraint('shopping_basket_id', 'product_id', name='uq_shopping_basket_items_basket_product'),
+        # checked by the foreign key when a product is deleted
+        Index('ix_shopping_basket_items_product_id', 'product_id'),
+    )
+
     @property
     def image_url(self):
         return self.product.image_url
     @property
     def name(self):
         return self.product.name
+
+
+class CacheVersion(Base):
+    """Version counter per cached entity group, bumped by every write to that group."""
+    __tablename__ = 'cache_versions'
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class Order(Base):
+    """A checked out basket. Lines, prices and names are copied, later catalog changes leave it alone."""
+    __tablename__ = 'orders'
+    id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True)
+    # the basket is deleted at checkout, its id stays as the natural key of the order
+    shopping_basket_id = Column(UUID(as_uuid=True), nullable=False)
+    idempotency_key = Column(String, nullable=False)
+    country = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='placed')
+
+    # amounts in cents
+    item_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    total_price_inclusive = Column(Integer, nullable=False, default=0)
+    total_price_exclusive = Column(Integer, nullable=False, default=0)
+    tax = Column(Integer, nullable=False, default=0)
+
+    lines = relationship("OrderLine", back_populates="order", cascade="all, delete-orphan", order_by="OrderLine.position")
+
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('idempotency_key', name='uq_orders_idempotency_key'),
+        UniqueConstraint('shopping_basket_id', name='uq_orders_shopping_basket_id'),
+    )
+
+
+class OrderLine(Base):
+    __tablename__ = 'order_lines'
+    order_id = Column(UUID(as_uuid=True), ForeignKey('orders.id', ondelete='CASCADE'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    # no foreign key, products may be deleted while their orders are kept
+    product_id = Column(UUID(as_uuid=True), nullable=False)
+    code = Column(String)
+    name = Column(String)
+    image_url = Column(String)
+    price = Column(Integer, nullable=False)
+    amount = Column(Integer, nullable=False)
+    tax_rate = Column(Integer, nullable=False)
+    tax = Column(Integer, nullable=False)
+
+    order = relationship("Order", back_populates="lines")
+
+
+class OutboxEvent(Base):
+    """Event written in the transaction that caused it, published afterwards by ``outbox.drain_forever``."""
+    __tablename__ = 'outbox'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    topic = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String)
+    available_at = Column(DateTime, nullable=False, default=datetime.now)
+    published_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # the drain only ever looks at what is still pending, which stays a small part of the table
+        Index('ix_outbox_pending', 'available_at', 'id', postgresql_where=text('published_at IS NULL')),
+        Index('ix_outbox_published_at', 'published_at', postgresql_where=text('published_at IS NOT NULL')),
+    )
+
+
+class Change(Base):
+    """A catalog write as the change feed reports it: which entity, which row, upserted or deleted.
+
+    ``txid`` is the writing transaction, the feed is ordered by (txid, id); see ``changes``.
+    """
+    __tablename__ = 'change_log'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    txid = Column(BigInteger, nullable=False, server_default=text("(pg_current_xact_id()::text)::bigint"))
+    entity = Column(String, nullable=False)
+    entity_id = Column(UUID(as_uuid=True), nullable=False)
+    op = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        Index('ix_change_log_txid_id', 'txid', 'id'),
+        Index('ix_change_log_created_at', 'created_at'),
+    )
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks that the listening connection is still alive; a connection that
+# died without closing (failover, a killed idle connection) only shows when it is used
+LISTEN_HEALTH_CHECK_INTERVAL = float(os.getenv("LISTEN_HEALTH_CHECK_INTERVAL", "30"))
+# seconds a starting worker waits for the listener to connect before warming up without it
+LISTEN_CONNECT_TIMEOUT = float(os.getenv("LISTEN_CONNECT_TIMEOUT", "10"))
+
+_handlers: Dict[str, Callable[[str], None]] = {}
+_on_connect: List[Callable[[AsyncConnection], Awaitable[None]]] = []
+
+
+def subscribe(channel: str, handler: Callable[[str], None],
+              on_connect: Callable[[AsyncConnection], Awaitable[None]] = None) -> None:
+    """Call ``handler(payload)`` for every NOTIFY on ``channel``.
+
+    ``on_connect`` runs whenever the listener (re)connects, since notifications sent
+    while it was not listening are lost.
+    """
+    _handlers[channel] = handler
+    if on_connect is not None:
+        _on_connect.append(on_connect)
+
+
+def _dispatch(connection, pid, channel, payload) -> None:
+    try:
+        _handlers[channel](payload)
+    except Exception:
+        logger.exception("handling notification on %s failed", channel)
+
+
+class ListenerLostError(Exception):
+    pass
+
+
+async def _wait_until_lost(driver_connection, interval: float) -> None:
+    lost = asyncio.Event()
+    driver_connection.add_termination_listener(lambda connection: lost.set())
+    while True:
+        try:
+            await asyncio.wait_for(lost.wait(), interval)
+        except asyncio.TimeoutError:
+            # raises as well when the connection is gone
+            await driver_connection.execute("SELECT 1")
+            continue
+        raise ListenerLostError("the listening connection was closed")
+
+
+async def listen_forever(engine: AsyncEngine, retry_delay: float = 5.0,
+                         health_check_interval: float = LISTEN_HEALTH_CHECK_INTERVAL,
+                         connected: Optional[asyncio.Event] = None) -> None:
+    """Keep one connection LISTENing on every subscribed channel for the worker's lifetime.
+
+    When the connection is lost it reconnects, and the ``on_connect`` hooks run again.
+    ``connected`` is set once the first connection listens and its hooks have run, so
+    whatever is loaded after that cannot be thrown away by the hooks.
+    """
+    if engine.dialect.driver != "asyncpg":
+        if connected is not None:
+            connected.set()
+        return
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver_connection = raw.driver_connection
+                for channel in _handlers:
+                    await driver_connection.add_listener(channel, _dispatch)
+                try:
+                    for on_connect in _on_connect:
+                        await on_connect(conn)
+                    await conn.rollback()
+                    if connected is not None:
+                        connected.set()
+                    await _wait_until_lost(driver_connection, health_check_interval)
+                except Exception:
+                    # keep the pool from handing the dead connection to the next attempt
+                    await conn.invalidate()
+                    raise
+                finally:
+                    if not driver_connection.is_closed():
+                        for channel in _handlers:
+                            await driver_connection.remove_listener(channel, _dispatch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("notification listener failed, retrying in %s seconds", retry_delay)
+            await asyncio.sleep(retry_delay)
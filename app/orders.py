@@ -0,0 +1,165 @@
+"""Checkout: a basket becomes an order in a single transaction.
+
+The basket row is locked like every basket mutation does, its lines are checked
+against the current product prices, the stock reservations are fulfilled and the
+order is written with a copy of every line and its translated name. The basket is
+deleted and an ``order.placed`` event is added to the outbox in the same commit.
+
+Lines whose price changed are moved to the current price instead, and checkout
+fails with the new totals; the customer confirms them by checking out again.
+
+A checkout is identified by the client's idempotency key: repeating the request
+with the same key returns the order it created instead of placing another one.
+"""
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import models, outbox, read_models, reservations
+from .crud import _lock_shopping_basket, reprice_shopping_basket_items
+from .tax import line_tax
+from .translations import DEFAULT_LANGUAGES, translations
+
+ORDER_PLACED = "order.placed"
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyBasketError(CheckoutError):
+    def __init__(self, basket_id: uuid.UUID):
+        super().__init__(f"basket {basket_id} has no items")
+
+
+class PriceChangedError(CheckoutError):
+    def __init__(self, product_ids: List[uuid.UUID], totals: read_models.ShoppingBasketTotalsView):
+        super().__init__("prices changed since the products were added to the basket, the basket has the new ones")
+        self.product_ids = product_ids
+        self.totals = totals
+
+
+class AlreadyCheckedOutError(CheckoutError):
+    def __init__(self, order: models.Order):
+        super().__init__(f"basket {order.shopping_basket_id} was already checked out")
+        self.order = order
+
+
+class IdempotencyKeyReusedError(CheckoutError):
+    def __init__(self, key: str):
+        super().__init__(f"idempotency key {key!r} was used for another basket")
+
+
+async def _find_order(db: AsyncSession, idempotency_key: str,
+                      basket_id: Optional[uuid.UUID] = None) -> Optional[models.Order]:
+    order = models.Order
+    condition = order.idempotency_key == idempotency_key
+    if basket_id is not None:
+        condition = or_(condition, order.shopping_basket_id == basket_id)
+    result = await db.scalars(select(order).where(condition).options(selectinload(order.lines)))
+    return result.first()
+
+
+def _replay(order: models.Order, basket_id: uuid.UUID, idempotency_key: str) -> models.Order:
+    if order.idempotency_key != idempotency_key:
+        raise AlreadyCheckedOutError(order)
+    if order.shopping_basket_id != basket_id:
+        raise IdempotencyKeyReusedError(idempotency_key)
+    return order
+
+
+async def _basket_lines(db: AsyncSession, basket_id: uuid.UUID) -> list:
+    item = models.ShoppingBasketItem
+    product = models.Product
+    result = await db.execute(
+        select(item.product_id, item.price, item.amount, item.tax_rate, product.price.label("current_price"),
+               product.code, product.name, product.image_url)
+        .join(product, product.id == item.product_id)
+        .where(item.shopping_basket_id == basket_id)
+        .order_by(product.code, item.id))
+    return result.all()
+
+
+def _event(order: models.Order) -> dict:
+    return dict(
+        order_id=str(order.id),
+        shopping_basket_id=str(order.shopping_basket_id),
+        country=order.country,
+        quantity=order.quantity,
+        total_price_inclusive=order.total_price_inclusive,
+        total_price_exclusive=order.total_price_exclusive,
+        tax=order.tax,
+        lines=[dict(product_id=str(line.product_id), amount=line.amount, price=line.price) for line in order.lines],
+    )
+
+
+async def get_order(db: AsyncSession, order_id: uuid.UUID) -> Optional[models.Order]:
+    result = await db.scalars(
+        select(models.Order).where(models.Order.id == order_id).options(selectinload(models.Order.lines)))
+    return result.first()
+
+
+async def checkout(db: AsyncSession, basket_id: uuid.UUID, idempotency_key: str,
+                   languages: Sequence[str] = DEFAULT_LANGUAGES) -> Tuple[Optional[models.Order], bool]:
+    """Place the order for a basket; returns the order and whether it was created by this call.
+
+    Returns (None, False) for an unknown basket. Raises OutOfStockError or a CheckoutError
+    when the order cannot be placed, leaving the basket as it was, except for
+    PriceChangedError, which is raised once the basket's lines are repriced.
+    """
+    existing = await _find_order(db, idempotency_key)
+    if existing is not None:
+        return _replay(existing, basket_id, idempotency_key), False
+
+    country = await _lock_shopping_basket(db, basket_id)
+    if country is None:
+        # a concurrent checkout may have deleted the basket while we waited for its lock
+        await db.rollback()
+        existing = await _find_order(db, idempotency_key, basket_id)
+        return (_replay(existing, basket_id, idempotency_key), False) if existing else (None, False)
+
+    lines = await _basket_lines(db, basket_id)
+    if not lines:
+        raise EmptyBasketError(basket_id)
+    changed = [line for line in lines if line.price != line.current_price]
+    if changed:
+        totals = await reprice_shopping_basket_items(db, basket_id, [
+            (line.product_id, line.amount, line.price, line.current_price, line.tax_rate) for line in changed])
+        await db.commit()
+        raise PriceChangedError([line.product_id for line in changed], totals)
+    await reservations.fulfil(db, basket_id, {line.product_id: line.amount for line in lines})
+
+    names = await translations.resolve(db, [line.name for line in lines], languages)
+    order = models.Order(id=uuid.uuid4(), shopping_basket_id=basket_id, idempotency_key=idempotency_key,
+                         country=country, language=languages[0], status="placed")
+    order.lines = [
+        models.OrderLine(position=position, product_id=line.product_id, code=line.code,
+                         name=names.get(line.name) or line.name, image_url=line.image_url, price=line.price,
+                         amount=line.amount, tax_rate=line.tax_rate, tax=line_tax(line.price, line.amount, line.tax_rate))
+        for position, line in enumerate(lines, 1)
+    ]
+    order.item_count = len(order.lines)
+    order.quantity = sum(line.amount for line in order.lines)
+    order.total_price_inclusive = sum(line.price * line.amount for line in order.lines)
+    order.tax = sum(line.tax for line in order.lines)
+    order.total_price_exclusive = order.total_price_inclusive - order.tax
+
+    try:
+        # order and lines go out in two statements, the lines as one multi-row insert
+        db.add(order)
+        await db.execute(delete(models.ShoppingBasketItem).where(models.ShoppingBasketItem.shopping_basket_id == basket_id))
+        await db.execute(delete(models.ShoppingBasket).where(models.ShoppingBasket.id == basket_id))
+        await outbox.enqueue(db, ORDER_PLACED, str(order.id), _event(order))
+        await db.commit()
+    except IntegrityError:
+        # the same key was just used by a concurrent checkout of another basket
+        await db.rollback()
+        existing = await _find_order(db, idempotency_key)
+        if existing is None:
+            raise
+        return _replay(existing, basket_id, idempotency_key), False
+    return order, True
@@ -0,0 +1,114 @@
+"""Transactional outbox for events other systems consume.
+
+``enqueue`` writes the event in the caller's transaction, so it exists exactly when
+the change it describes was committed, and the request never waits on a broker.
+``drain_forever`` publishes pending events in id order through the publisher
+registered for their topic, retrying failures with backoff. Delivery is at least
+once: publishers must tolerate seeing an event id twice.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, notifications
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_CHANNEL = "outbox"
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "5"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# after this many failed attempts an event is left for an operator to look at
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+# published events are deleted after this many seconds
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", str(7 * 24 * 3600)))
+
+Publisher = Callable[[models.OutboxEvent], Awaitable[None]]
+
+_publishers: Dict[str, Publisher] = {}
+_pending = asyncio.Event()
+
+
+def register(topic: str, publisher: Publisher) -> None:
+    """Publish events on ``topic`` with ``publisher``; raising leaves the event pending for a retry."""
+    _publishers[topic] = publisher
+
+
+async def _log_event(event: models.OutboxEvent) -> None:
+    logger.info("outbox event %s %s %s", event.id, event.topic, event.key)
+
+
+async def enqueue(db: AsyncSession, topic: str, key: str, payload: dict) -> None:
+    """Add an event to the caller's transaction; nothing is published unless it commits."""
+    await db.execute(insert(models.OutboxEvent).values(topic=topic, key=key, payload=payload))
+    if db.get_bind().dialect.name == "postgresql":
+        # NOTIFY is transactional too, it wakes the drain when the event becomes visible
+        await db.execute(select(func.pg_notify(OUTBOX_CHANNEL, topic)))
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, 3600))
+
+
+async def drain(db: AsyncSession, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Publish one batch of pending events; rows locked by another worker are skipped. Returns the batch size."""
+    event = models.OutboxEvent
+    now = datetime.now()
+    events = (await db.scalars(
+        select(event)
+        .where(event.published_at.is_(None), event.available_at <= now, event.attempts < OUTBOX_MAX_ATTEMPTS)
+        .order_by(event.available_at, event.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True))).all()
+    for e in events:
+        try:
+            await _publishers.get(e.topic, _log_event)(e)
+        except Exception as exc:
+            e.attempts += 1
+            e.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+            e.available_at = datetime.now() + _backoff(e.attempts)
+            logger.warning("publishing outbox event %s on %s failed (attempt %d): %s",
+                           e.id, e.topic, e.attempts, e.last_error)
+        else:
+            e.published_at = datetime.now()
+    await db.commit()
+    return len(events)
+
+
+async def purge_published(db: AsyncSession, retention: float = OUTBOX_RETENTION) -> int:
+    event = models.OutboxEvent
+    result = await db.execute(
+        delete(event).where(event.published_at < datetime.now() - timedelta(seconds=retention)))
+    await db.commit()
+    return result.rowcount
+
+
+async def drain_forever(session_factory, interval: float = OUTBOX_INTERVAL,
+                        batch_size: int = OUTBOX_BATCH_SIZE) -> None:
+    while True:
+        _pending.clear()
+        try:
+            async with session_factory() as db:
+                while await drain(db, batch_size) >= batch_size:
+                    pass
+                await purge_published(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("draining the outbox failed")
+        # polling catches up on retries and on notifications missed while not listening
+        try:
+            await asyncio.wait_for(_pending.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _on_outbox_notification(payload: str) -> None:
+    _pending.set()
+
+
+notifications.subscribe(OUTBOX_CHANNEL, _on_outbox_notification)
@@ -0,0 +1,57 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+
+def encode_cursor(*values) -> str:
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        raise TypeError(f"cannot encode {type(value).__name__} in a cursor")
+
+    raw = json.dumps(values, default=default, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Return the raw values of a cursor, raising ValueError when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor")
+    return values
+
+
+def encode_product_cursor(product) -> str:
+    return encode_cursor(product.created_at, product.id)
+
+
+def decode_product_cursor(cursor: str):
+    values = decode_cursor(cursor)
+    try:
+        created_at, product_id = values
+        return datetime.fromisoformat(created_at), uuid.UUID(product_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def encode_change_cursor(txid: int, change_id: int, issued_at: datetime) -> str:
+    return encode_cursor(txid, change_id, issued_at)
+
+
+def decode_change_cursor(cursor: str):
+    """Return the (txid, id) position of a change feed cursor and when it was issued."""
+    values = decode_cursor(cursor)
+    try:
+        txid, change_id, issued_at = values
+        if not isinstance(txid, int) or not isinstance(change_id, int):
+            raise ValueError("invalid cursor")
+        return (txid, change_id), datetime.fromisoformat(issued_at)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
@@ -0,0 +1,76 @@
+"""The ``product_view`` read model: each product per language, translated and with its category name.
+
+Rows are kept for PRODUCT_VIEW_LANGUAGES and refreshed by the writes they depend
+on, in the same transaction: products by id, cms changes by code and category
+renames by category. Catalog reads whose language chain is the fallback chain of
+one of those languages read the table, every other chain translates on the fly.
+"""
+import os
+from typing import List, Optional, Sequence
+
+from sqlalchemy import String, column, delete, exists, func, or_, select, true, values
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .translations import DEFAULT_LANGUAGE, cms_value, language_chain
+
+PRODUCT_VIEW_LANGUAGES = [
+    lang.strip() for lang in os.getenv("PRODUCT_VIEW_LANGUAGES", DEFAULT_LANGUAGE).split(",") if lang.strip()]
+
+_CHAINS = {language_chain([language]): language for language in PRODUCT_VIEW_LANGUAGES}
+
+_COLUMNS = ("name", "description", "brand", "code", "image_url", "price", "category_id", "category_name",
+            "created_at")
+
+
+def view_language(languages: Sequence[str]) -> Optional[str]:
+    """The language whose rows answer a request for ``languages``, None when no rows do."""
+    return _CHAINS.get(tuple(languages))
+
+
+async def refresh_product_view(db: AsyncSession, product_ids=None, codes=None, category_ids=None,
+                               languages: Optional[List[str]] = None) -> None:
+    """Recompute rows in one INSERT ... SELECT.
+
+    Narrow the work down with ``product_ids`` (a list or a select of ids), ``codes`` (products
+    whose name or description is one of these cms codes), ``category_ids`` and ``languages``.
+    """
+    languages = [lang for lang in (languages or PRODUCT_VIEW_LANGUAGES) if lang in PRODUCT_VIEW_LANGUAGES]
+    if not languages:
+        return
+    langs = values(column("language", String), column("chain", ARRAY(String)), name="languages").data(
+        [(lang, list(language_chain([lang]))) for lang in languages])
+    product = models.Product
+    category = models.Category
+    rows = (
+        select(product.id, langs.c.language,
+               func.coalesce(cms_value(product.name, langs.c.chain), product.name),
+               func.coalesce(cms_value(product.description, langs.c.chain), product.description),
+               product.brand, product.code, product.image_url, product.price, product.category_id, category.name,
+               product.created_at)
+        .select_from(product)
+        .outerjoin(category, category.id == product.category_id)
+        .join(langs, true())
+    )
+    if product_ids is not None:
+        rows = rows.where(product.id.in_(product_ids))
+    if codes is not None:
+        rows = rows.where(or_(product.name.in_(codes), product.description.in_(codes)))
+    if category_ids is not None:
+        rows = rows.where(product.category_id.in_(category_ids))
+    view = models.ProductView
+    stmt = pg_insert(view).from_select(["product_id", "language", *_COLUMNS], rows)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[view.id, view.language],
+        set_={c: stmt.excluded[c] for c in _COLUMNS},
+    ))
+
+
+async def ensure_product_view(db: AsyncSession) -> None:
+    view = models.ProductView
+    await db.execute(delete(view).where(view.language.not_in(PRODUCT_VIEW_LANGUAGES)))
+    for language in PRODUCT_VIEW_LANGUAGES:
+        if not await db.scalar(select(exists().where(view.language == language))):
+            await refresh_product_view(db, languages=[language])
+    await db.commit()
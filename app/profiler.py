@@ -0,0 +1,69 @@
+"""On demand sampling profiler for the event loop thread.
+
+A background thread reads the stack of the loop thread every ``interval`` seconds
+through ``sys._current_frames`` and counts identical stacks. The loop itself is
+never interrupted, so profiling a busy worker costs it little beyond the GIL
+switches. The result is in the collapsed format flamegraph.pl and speedscope read.
+Only available with PROFILER_ENABLED=true, and one profile runs at a time.
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_running = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def profile(seconds: float, interval: float) -> SamplingProfiler:
+    """Sample the thread running the event loop for ``seconds`` while it keeps serving requests."""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusyError("a profile is already running")
+    try:
+        profiler = SamplingProfiler(threading.get_ident(), interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+        finally:
+            profiler.stop()
+        return profiler
+    finally:
+        _running.release()
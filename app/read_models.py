@@ -0,0 +1,88 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+import uuid
+
+
+@dataclass
+class CategoryView:
+    id: uuid.UUID
+    name: str
+
+
+@dataclass
+class CategoryNode:
+    id: uuid.UUID
+    name: str
+    created_at: datetime
+    updated_at: datetime
+    children: List["CategoryNode"] = field(default_factory=list)
+
+
+@dataclass
+class ProductView:
+    id: uuid.UUID
+    name: str
+    description: Optional[str]
+    brand: Optional[str]
+    code: Optional[str]
+    stock: int
+    image_url: Optional[str]
+    price: int
+    category: Optional[CategoryView] = None
+    created_at: Optional[datetime] = None
+
+
+@dataclass
+class SearchHit(ProductView):
+    rank: float = 0.0
+
+
+@dataclass
+class FacetCount:
+    value: str
+    label: Optional[str]
+    count: int
+
+
+@dataclass
+class SearchResult:
+    total: int = 0
+    total_exact: bool = True
+    items: List[SearchHit] = field(default_factory=list)
+    categories: List[FacetCount] = field(default_factory=list)
+    brands: List[FacetCount] = field(default_factory=list)
+
+
+@dataclass
+class ShoppingBasketItemView:
+    id: uuid.UUID
+    product_id: uuid.UUID
+    price: int
+    amount: int
+    tax_rate: int = 0
+    product: Optional[ProductView] = None
+
+    @property
+    def image_url(self):
+        return self.product.image_url if self.product else None
+
+    @property
+    def name(self):
+        return self.product.name if self.product else None
+
+
+@dataclass
+class ShoppingBasketTotalsView:
+    id: uuid.UUID
+    country: str
+    item_count: int = 0
+    quantity: int = 0
+    total_price_inclusive: int = 0
+    total_price_exclusive: int = 0
+    tax: int = 0
+
+
+@dataclass
+class ShoppingBasketView(ShoppingBasketTotalsView):
+    items: List[ShoppingBasketItemView] = field(default_factory=list)
@@ -0,0 +1,697 @@
+"""Storage behind the catalog, cms, basket and tax routes.
+
+The routes ask a ``Repository`` for what they need instead of running crud on a
+session themselves. ``SqlRepository`` is crud and the basket store on a request's
+session, everything as before. ``MemoryRepository`` keeps products, categories,
+translations, baskets and tax rules in dicts with the indexes the routes look them
+up by, so with REPOSITORY=memory the app serves those routes without Postgres: the
+API tests run in milliseconds anywhere, and benchmarks of routing and serialization
+measure the app alone, against a database-backed run as the comparison.
+
+Search, orders, bulk import and export and the change feed only exist on Postgres;
+under the memory repository their routes fail like they would with the database down.
+"""
+import os
+import uuid
+from abc import ABC, abstractmethod
+from bisect import bisect_right, insort
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncGenerator, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import basket_store, crud, http_cache, models, read_models, schemas
+from .basket_store import StoredBasket
+from .database import read_session, write_session
+from .pagination import decode_product_cursor
+from .reservations import OutOfStockError
+from .tax import DEFAULT_COUNTRY, DEFAULT_TAX_RATE
+from .translations import DEFAULT_LANGUAGES
+
+# sql, or memory to serve the routes from dicts in this process
+REPOSITORY = os.getenv("REPOSITORY", "sql")
+
+
+class Repository(ABC):
+    """What the routes read and write; methods follow their crud counterparts."""
+
+    @abstractmethod
+    async def create_cms(self, data: schemas.CmsCreate) -> models.Cms:
+        ...
+
+    @abstractmethod
+    async def list_cms(self) -> List[models.Cms]:
+        ...
+
+    @abstractmethod
+    async def resolve_cms(self, codes: Sequence[str], languages: Sequence[str] = DEFAULT_LANGUAGES) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    async def create_category(self, data: schemas.CategoryCreate) -> read_models.CategoryNode:
+        ...
+
+    @abstractmethod
+    async def get_category(self, category_id: uuid.UUID) -> Optional[read_models.CategoryNode]:
+        ...
+
+    @abstractmethod
+    async def get_categories(self, category_ids: Sequence[uuid.UUID]) -> List[read_models.CategoryNode]:
+        ...
+
+    @abstractmethod
+    async def list_categories(self) -> List[read_models.CategoryNode]:
+        ...
+
+    @abstractmethod
+    async def get_category_tree(self) -> List[read_models.CategoryNode]:
+        ...
+
+    @abstractmethod
+    async def get_category_ancestors(self, category_id: uuid.UUID) -> list:
+        ...
+
+    @abstractmethod
+    async def update_category(self, category_id: uuid.UUID,
+                              data: schemas.CategoryUpdate) -> Optional[read_models.CategoryNode]:
+        """Raises crud.CategoryCycleError when a new child is an ancestor."""
+
+    @abstractmethod
+    async def delete_category(self, category_id: uuid.UUID) -> None:
+        ...
+
+    @abstractmethod
+    async def create_product(self, data: schemas.ProductCreate):
+        ...
+
+    @abstractmethod
+    async def get_product(self, product_id: uuid.UUID,
+                          languages: Sequence[str] = DEFAULT_LANGUAGES) -> Optional[read_models.ProductView]:
+        ...
+
+    @abstractmethod
+    async def get_products(self, product_ids: Sequence[uuid.UUID] = (), codes: Sequence[str] = (),
+                           languages: Sequence[str] = DEFAULT_LANGUAGES) -> List[read_models.ProductView]:
+        ...
+
+    @abstractmethod
+    async def list_products(self, limit: Optional[int] = None, languages: Sequence[str] = DEFAULT_LANGUAGES,
+                            **filters) -> List[read_models.ProductView]:
+        ...
+
+    @abstractmethod
+    def stream_products(self, limit: Optional[int] = None, languages: Sequence[str] = DEFAULT_LANGUAGES,
+                        **filters) -> AsyncIterator[read_models.ProductView]:
+        ...
+
+    @abstractmethod
+    async def update_product(self, product_id: uuid.UUID, data: schemas.ProductUpdate,
+                             languages: Sequence[str] = DEFAULT_LANGUAGES) -> Optional[read_models.ProductView]:
+        ...
+
+    @abstractmethod
+    async def delete_product(self, product_id: uuid.UUID) -> None:
+        ...
+
+    @abstractmethod
+    async def create_shopping_basket(self, data: schemas.ShoppingBasketCreate):
+        ...
+
+    @abstractmethod
+    async def get_shopping_basket(self, basket_id: uuid.UUID, languages: Sequence[str] = DEFAULT_LANGUAGES
+                                  ) -> Optional[read_models.ShoppingBasketView]:
+        ...
+
+    @abstractmethod
+    async def get_shopping_basket_totals(self, basket_id: uuid.UUID
+                                         ) -> Optional[read_models.ShoppingBasketTotalsView]:
+        ...
+
+    @abstractmethod
+    async def add_item_to_shopping_basket(self, basket_id: uuid.UUID, item: schemas.ShoppingBasketItemCreate,
+                                          languages: Sequence[str] = DEFAULT_LANGUAGES
+                                          ) -> Optional[read_models.ShoppingBasketView]:
+        ...
+
+    @abstractmethod
+    async def add_items_to_shopping_basket(self, basket_id: uuid.UUID, items: List[schemas.ShoppingBasketItemCreate]
+                                           ) -> Optional[read_models.ShoppingBasketTotalsView]:
+        ...
+
+    @abstractmethod
+    async def set_shopping_basket_item_amount(self, basket_id: uuid.UUID, product_id: uuid.UUID, amount: int
+                                              ) -> Optional[read_models.ShoppingBasketTotalsView]:
+        ...
+
+    @abstractmethod
+    async def change_shopping_basket_item_amount(self, basket_id: uuid.UUID, product_id: uuid.UUID, delta: int
+                                                 ) -> Optional[read_models.ShoppingBasketTotalsView]:
+        ...
+
+    @abstractmethod
+    async def remove_item_from_shopping_basket(self, item_id: uuid.UUID) -> None:
+        ...
+
+    @abstractmethod
+    async def create_tax_rule(self, data: schemas.TaxRuleCreate) -> models.TaxRule:
+        ...
+
+    @abstractmethod
+    async def list_tax_rules(self) -> List[models.TaxRule]:
+        ...
+
+    @abstractmethod
+    async def delete_tax_rule(self, rule_id: uuid.UUID) -> None:
+        ...
+
+
+class SqlRepository(Repository):
+    """crud and the basket store on one session."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create_cms(self, data):
+        return await crud.create_cms(self.db, data)
+
+    async def list_cms(self):
+        return await crud.list_cms(self.db)
+
+    async def resolve_cms(self, codes, languages=DEFAULT_LANGUAGES):
+        return await crud.resolve_cms(self.db, codes, languages)
+
+    async def create_category(self, data):
+        category = await crud.create_category(self.db, data)
+        return await crud.get_category(self.db, category.id)
+
+    async def get_category(self, category_id):
+        return await crud.get_category(self.db, category_id)
+
+    async def get_categories(self, category_ids):
+        return await crud.get_categories(self.db, category_ids)
+
+    async def list_categories(self):
+        return await crud.list_categories(self.db)
+
+    async def get_category_tree(self):
+        return await crud.get_category_tree(self.db)
+
+    async def get_category_ancestors(self, category_id):
+        return await crud.get_category_ancestors(self.db, category_id)
+
+    async def update_category(self, category_id, data):
+        return await crud.update_category(self.db, category_id, data)
+
+    async def delete_category(self, category_id):
+        await crud.delete_category(self.db, category_id)
+
+    async def create_product(self, data):
+        return await crud.create_product(self.db, data)
+
+    async def get_product(self, product_id, languages=DEFAULT_LANGUAGES):
+        return await crud.get_product(self.db, product_id, languages)
+
+    async def get_products(self, product_ids=(), codes=(), languages=DEFAULT_LANGUAGES):
+        return await crud.get_products(self.db, product_ids, codes, languages)
+
+    async def list_products(self, limit=None, languages=DEFAULT_LANGUAGES, **filters):
+        return await crud.list_products(self.db, limit=limit, languages=languages, **filters)
+
+    def stream_products(self, limit=None, languages=DEFAULT_LANGUAGES, **filters):
+        return crud.stream_products(self.db, limit=limit, languages=languages, **filters)
+
+    async def update_product(self, product_id, data, languages=DEFAULT_LANGUAGES):
+        return await crud.update_product(self.db, product_id, data, languages)
+
+    async def delete_product(self, product_id):
+        await crud.delete_product(self.db, product_id)
+
+    async def create_shopping_basket(self, data):
+        return await basket_store.create_shopping_basket(self.db, data)
+
+    async def get_shopping_basket(self, basket_id, languages=DEFAULT_LANGUAGES):
+        return await basket_store.get_shopping_basket(self.db, basket_id, languages)
+
+    async def get_shopping_basket_totals(self, basket_id):
+        return await basket_store.get_shopping_basket_totals(self.db, basket_id)
+
+    async def add_item_to_shopping_basket(self, basket_id, item, languages=DEFAULT_LANGUAGES):
+        return await basket_store.add_item_to_shopping_basket(self.db, basket_id, item, languages)
+
+    async def add_items_to_shopping_basket(self, basket_id, items):
+        return await basket_store.add_items_to_shopping_basket(self.db, basket_id, items)
+
+    async def set_shopping_basket_item_amount(self, basket_id, product_id, amount):
+        return await basket_store.set_shopping_basket_item_amount(self.db, basket_id, product_id, amount)
+
+    async def change_shopping_basket_item_amount(self, basket_id, product_id, delta):
+        return await basket_store.change_shopping_basket_item_amount(self.db, basket_id, product_id, delta)
+
+    async def remove_item_from_shopping_basket(self, item_id):
+        await basket_store.remove_item_from_shopping_basket(self.db, item_id)
+
+    async def create_tax_rule(self, data):
+        return await crud.create_tax_rule(self.db, data)
+
+    async def list_tax_rules(self):
+        return await crud.list_tax_rules(self.db)
+
+    async def delete_tax_rule(self, rule_id):
+        await crud.delete_tax_rule(self.db, rule_id)
+
+
+def _product_key(product) -> Tuple[datetime, uuid.UUID]:
+    # keyset pagination order of list_products
+    return product.created_at, product.id
+
+
+class MemoryRepository(Repository):
+    """Everything in this process, for tests and benchmarks; one worker only, nothing survives a restart.
+
+    Products are indexed by id, code and category and kept sorted in listing order,
+    so pages start with a bisect. Stock is taken when items go into a basket and
+    given back when they leave it, like the reservations in Postgres, without expiry.
+    Writes bump the versions of the cached response groups they change.
+    """
+
+    def __init__(self):
+        self.cms: Dict[Tuple[str, str], models.Cms] = {}
+        self.categories: Dict[uuid.UUID, read_models.CategoryNode] = {}
+        self.parents: Dict[uuid.UUID, Dict[uuid.UUID, None]] = {}
+        self.products: Dict[uuid.UUID, models.Product] = {}
+        self.product_codes: Dict[str, uuid.UUID] = {}
+        self.category_products: Dict[uuid.UUID, Dict[uuid.UUID, None]] = {}
+        self.product_order: List[Tuple[datetime, uuid.UUID]] = []
+        self.baskets: Dict[uuid.UUID, StoredBasket] = {}
+        self.basket_items: Dict[uuid.UUID, uuid.UUID] = {}
+        self.tax_rules: Dict[Tuple[str, Optional[uuid.UUID]], models.TaxRule] = {}
+
+    @staticmethod
+    def _bump(*groups: str) -> None:
+        versions = http_cache.responses.versions
+        http_cache.responses.set_versions({group: versions.get(group, 0) + 1 for group in groups})
+
+    # cms
+
+    async def create_cms(self, data):
+        now = datetime.now()
+        translation = self.cms.get((data.code, data.language))
+        if translation is None:
+            translation = self.cms[(data.code, data.language)] = models.Cms(
+                id=uuid.uuid4(), code=data.code, language=data.language, created_at=now)
+        translation.value = data.value
+        translation.updated_at = now
+        self._bump("cms")
+        return translation
+
+    async def list_cms(self):
+        return list(self.cms.values())
+
+    def _translate(self, code: Optional[str], languages: Sequence[str]) -> Optional[str]:
+        for language in languages:
+            translation = self.cms.get((code, language))
+            if translation is not None:
+                return translation.value
+        return None
+
+    async def resolve_cms(self, codes, languages=DEFAULT_LANGUAGES):
+        resolved = {code: self._translate(code, languages) for code in codes}
+        return {code: value for code, value in resolved.items() if value is not None}
+
+    # categories
+
+    def _walk(self, category_id: uuid.UUID, up: bool) -> Dict[uuid.UUID, int]:
+        """Depth of every ancestor (or descendant) of a category, itself at 0, breadth first like the closure."""
+        depths = {category_id: 0}
+        queue = deque([category_id])
+        while queue:
+            current = queue.popleft()
+            if up:
+                following = self.parents.get(current, ())
+            else:
+                following = [child.id for child in self.categories[current].children]
+            for other in following:
+                if other not in depths and depths[current] < crud.MAX_CATEGORY_DEPTH:
+                    depths[other] = depths[current] + 1
+                    queue.append(other)
+        return depths
+
+    def _set_children(self, category: read_models.CategoryNode, children_ids: Iterable[uuid.UUID]) -> None:
+        for child in category.children:
+            self.parents[child.id].pop(category.id, None)
+        children = [self.categories[child_id] for child_id in dict.fromkeys(children_ids) if child_id in self.categories]
+        # children come in the order the categories were made, as the tree query returns them
+        category.children = sorted(children, key=lambda child: (child.created_at, child.id))
+        for child in category.children:
+            self.parents[child.id][category.id] = None
+
+    async def create_category(self, data):
+        now = datetime.now()
+        category = read_models.CategoryNode(id=uuid.uuid4(), name=data.name, created_at=now, updated_at=now)
+        self.categories[category.id] = category
+        self.parents[category.id] = {}
+        self._set_children(category, data.children_ids or [])
+        self._bump("categories")
+        return category
+
+    async def get_category(self, category_id):
+        return self.categories.get(category_id)
+
+    async def get_categories(self, category_ids):
+        found = dict.fromkeys(category_id for category_id in category_ids if category_id in self.categories)
+        return [self.categories[category_id] for category_id in found]
+
+    async def list_categories(self):
+        return list(self.categories.values())
+
+    async def get_category_tree(self):
+        return [category for category_id, category in self.categories.items() if not self.parents[category_id]]
+
+    async def get_category_ancestors(self, category_id):
+        if category_id not in self.categories:
+            return []
+        depths = self._walk(category_id, up=True)
+        return [read_models.CategoryView(id=ancestor_id, name=self.categories[ancestor_id].name)
+                for ancestor_id in sorted(depths, key=depths.get, reverse=True)]
+
+    async def update_category(self, category_id, data):
+        category = self.categories.get(category_id)
+        if category is None:
+            return None
+        groups = ["categories"]
+        if data.name is not None and data.name != category.name:
+            category.name = data.name
+            # product responses carry the category name
+            groups.append("products")
+        if data.children_ids is not None:
+            ancestors = self._walk(category_id, up=True)
+            cycle = next((child_id for child_id in data.children_ids if child_id in ancestors), None)
+            if cycle is not None:
+                raise crud.CategoryCycleError(f"category {cycle} is an ancestor of {category_id}")
+            self._set_children(category, data.children_ids)
+        category.updated_at = datetime.now()
+        self._bump(*groups)
+        return category
+
+    async def delete_category(self, category_id):
+        category = self.categories.pop(category_id, None)
+        if category is None:
+            return
+        self._set_children(category, [])
+        for parent_id in self.parents.pop(category_id):
+            parent = self.categories[parent_id]
+            parent.children = [child for child in parent.children if child.id != category_id]
+        for product_id in self.category_products.pop(category_id, {}):
+            self.products[product_id].category_id = None
+        for key in [key for key in self.tax_rules if key[1] == category_id]:
+            del self.tax_rules[key]
+        self._bump("categories", "products")
+
+    # products
+
+    def _index_product(self, product: models.Product) -> None:
+        if product.code is not None:
+            self.product_codes[product.code] = product.id
+        if product.category_id is not None:
+            self.category_products.setdefault(product.category_id, {})[product.id] = None
+
+    def _unindex_product(self, product: models.Product) -> None:
+        if product.code is not None:
+            self.product_codes.pop(product.code, None)
+        if product.category_id is not None:
+            self.category_products.get(product.category_id, {}).pop(product.id, None)
+
+    def _check_code(self, code: Optional[str], product_id: Optional[uuid.UUID] = None) -> None:
+        # what uq_products_code enforces in Postgres
+        if code is not None and self.product_codes.get(code, product_id) != product_id:
+            raise crud.ProductCodeTakenError(code)
+
+    def _check_category(self, category_id: Optional[uuid.UUID]) -> None:
+        # the foreign key on products.category_id
+        if category_id is not None and category_id not in self.categories:
+            raise crud.UnknownCategoryError(category_id)
+
+    def _view(self, product: models.Product, languages: Sequence[str]) -> read_models.ProductView:
+        category = self.categories.get(product.category_id) if product.category_id is not None else None
+        return read_models.ProductView(
+            id=product.id,
+            name=self._translate(product.name, languages) or product.name,
+            description=self._translate(product.description, languages) or product.description,
+            brand=product.brand, code=product.code, stock=product.stock, image_url=product.image_url,
+            price=product.price,
+            category=read_models.CategoryView(id=category.id, name=category.name) if category else None,
+            created_at=product.created_at)
+
+    async def create_product(self, data):
+        self._check_code(data.code)
+        self._check_category(data.category_id)
+        now = datetime.now()
+        product = models.Product(
+            id=uuid.uuid4(),
+            name=data.name,
+            description=data.description,
+            brand=data.brand,
+            code=data.code,
+            stock=data.stock or 0,
+            image_url=data.image_url,
+            category_id=data.category_id,
+            price=data.price or 0,
+            created_at=now,
+            updated_at=now,
+        )
+        self.products[product.id] = product
+        insort(self.product_order, _product_key(product))
+        self._index_product(product)
+        self._bump("products")
+        return product
+
+    async def get_product(self, product_id, languages=DEFAULT_LANGUAGES):
+        product = self.products.get(product_id)
+        return self._view(product, languages) if product is not None else None
+
+    async def get_products(self, product_ids=(), codes=(), languages=DEFAULT_LANGUAGES):
+        found = dict.fromkeys(product_id for product_id in product_ids if product_id in self.products)
+        for code in codes:
+            if code in self.product_codes:
+                found.setdefault(self.product_codes[code], None)
+        return [self._view(self.products[product_id], languages) for product_id in found]
+
+    def _listing(self, cursor: Optional[str] = None, category_id: Optional[uuid.UUID] = None,
+                 brand: Optional[str] = None, min_price: Optional[int] = None, max_price: Optional[int] = None,
+                 category_subtree_id: Optional[uuid.UUID] = None) -> Iterable[models.Product]:
+        start = bisect_right(self.product_order, decode_product_cursor(cursor)) if cursor is not None else 0
+        category_ids = None
+        if category_id is not None:
+            category_ids = {category_id}
+        if category_subtree_id is not None:
+            subtree = self._walk(category_subtree_id, up=False) if category_subtree_id in self.categories else {}
+            category_ids = subtree.keys() & category_ids if category_ids is not None else subtree.keys()
+        for _, product_id in self.product_order[start:]:
+            product = self.products[product_id]
+            if category_ids is not None and product.category_id not in category_ids:
+                continue
+            if brand is not None and product.brand != brand:
+                continue
+            if min_price is not None and product.price < min_price:
+                continue
+            if max_price is not None and product.price > max_price:
+                continue
+            yield product
+
+    async def list_products(self, limit=None, languages=DEFAULT_LANGUAGES, **filters):
+        products = []
+        for product in self._listing(**filters):
+            if limit is not None and len(products) >= limit:
+                break
+            products.append(self._view(product, languages))
+        return products
+
+    async def stream_products(self, limit=None, languages=DEFAULT_LANGUAGES, **filters):
+        for product in await self.list_products(limit, languages, **filters):
+            yield product
+
+    async def update_product(self, product_id, data, languages=DEFAULT_LANGUAGES):
+        product = self.products.get(product_id)
+        if product is None:
+            return None
+        changes = data.dict(exclude_unset=True)
+        if "code" in changes:
+            self._check_code(changes["code"], product_id)
+        if "category_id" in changes:
+            self._check_category(changes["category_id"])
+        self._unindex_product(product)
+        for k, v in changes.items():
+            setattr(product, k, v)
+        product.updated_at = datetime.now()
+        self._index_product(product)
+        self._bump("products")
+        return self._view(product, languages)
+
+    async def delete_product(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is not None:
+            self._unindex_product(product)
+            self.product_order.remove(_product_key(product))
+        self._bump("products")
+
+    # baskets
+
+    def _tax_rate(self, country: str, category_id: Optional[uuid.UUID]) -> int:
+        # the closest rule on the category or an ancestor, then the country-wide rule, as tax.tax_rate_for
+        if category_id in self.categories:
+            depths = self._walk(category_id, up=True)
+            for ancestor_id in sorted(depths, key=depths.get):
+                rule = self.tax_rules.get((country, ancestor_id))
+                if rule is not None:
+                    return rule.rate
+        rule = self.tax_rules.get((country, None))
+        return rule.rate if rule is not None else DEFAULT_TAX_RATE
+
+    def _set_line(self, basket: StoredBasket, product_id: uuid.UUID, amount: int) -> None:
+        """Give ``product_id`` ``amount`` in the basket, taking or returning the difference in stock."""
+        line = basket.lines.get(product_id)
+        old = line.amount if line is not None else 0
+        product = self.products.get(product_id)
+        if line is None and (product is None or amount <= 0):
+            # unknown products are skipped, as the insert ... select in crud does
+            return
+        if product is not None:
+            if amount - old > product.stock:
+                raise OutOfStockError(product_id, amount - old)
+            product.stock -= amount - old
+            if amount != old:
+                self._bump(http_cache.STOCK)
+        if line is None:
+            basket.add(product_id, amount, product.price, self._tax_rate(basket.country, product.category_id))
+            self.basket_items[basket.lines[product_id].id] = basket.id
+        else:
+            if amount <= 0:
+                self.basket_items.pop(line.id, None)
+            basket.set_amount(product_id, amount)
+        basket.updated_at = datetime.now()
+
+    def _add(self, basket: StoredBasket, amounts: Dict[uuid.UUID, int]) -> None:
+        # checked up front, so a basket is left alone when one of the products is out of stock
+        for product_id in sorted(amounts):
+            product = self.products.get(product_id)
+            if product is not None and amounts[product_id] > product.stock:
+                raise OutOfStockError(product_id, amounts[product_id])
+        for product_id in sorted(amounts):
+            line = basket.lines.get(product_id)
+            self._set_line(basket, product_id, (line.amount if line is not None else 0) + amounts[product_id])
+
+    def _basket_view(self, basket: StoredBasket, languages: Sequence[str]) -> read_models.ShoppingBasketView:
+        view = read_models.ShoppingBasketView(**vars(basket.totals()))
+        for line in basket.lines.values():
+            product = self.products.get(line.product_id)
+            view.items.append(read_models.ShoppingBasketItemView(
+                id=line.id, product_id=line.product_id, price=line.price, amount=line.amount,
+                tax_rate=line.tax_rate, product=self._view(product, languages) if product is not None else None))
+        return view
+
+    async def create_shopping_basket(self, data):
+        basket = StoredBasket(uuid.uuid4(), data.country or DEFAULT_COUNTRY)
+        if data.items:
+            self._add(basket, crud.requested_amounts(data.items))
+        self.baskets[basket.id] = basket
+        return basket
+
+    async def get_shopping_basket(self, basket_id, languages=DEFAULT_LANGUAGES):
+        basket = self.baskets.get(basket_id)
+        return self._basket_view(basket, languages) if basket is not None else None
+
+    async def get_shopping_basket_totals(self, basket_id):
+        basket = self.baskets.get(basket_id)
+        return basket.totals() if basket is not None else None
+
+    async def add_item_to_shopping_basket(self, basket_id, item, languages=DEFAULT_LANGUAGES):
+        if await self.add_items_to_shopping_basket(basket_id, [item]) is None:
+            return None
+        return await self.get_shopping_basket(basket_id, languages)
+
+    async def add_items_to_shopping_basket(self, basket_id, items):
+        basket = self.baskets.get(basket_id)
+        if basket is None:
+            return None
+        self._add(basket, crud.requested_amounts(items))
+        return basket.totals()
+
+    async def set_shopping_basket_item_amount(self, basket_id, product_id, amount):
+        basket = self.baskets.get(basket_id)
+        if basket is None:
+            return None
+        self._set_line(basket, product_id, amount)
+        return basket.totals()
+
+    async def change_shopping_basket_item_amount(self, basket_id, product_id, delta):
+        basket = self.baskets.get(basket_id)
+        if basket is None:
+            return None
+        line = basket.lines.get(product_id)
+        if delta > 0:
+            self._add(basket, {product_id: delta})
+        elif delta < 0 and line is not None:
+            self._set_line(basket, product_id, max(line.amount + delta, 0))
+        return basket.totals()
+
+    async def remove_item_from_shopping_basket(self, item_id):
+        basket = self.baskets.get(self.basket_items.get(item_id))
+        line = basket.line_by_id(item_id) if basket is not None else None
+        if line is not None:
+            self._set_line(basket, line.product_id, 0)
+
+    # tax rules
+
+    async def create_tax_rule(self, data):
+        now = datetime.now()
+        rule = self.tax_rules.get((data.country, data.category_id))
+        if rule is None:
+            rule = self.tax_rules[(data.country, data.category_id)] = models.TaxRule(
+                id=uuid.uuid4(), country=data.country, category_id=data.category_id, created_at=now)
+        rule.rate = data.rate
+        rule.updated_at = now
+        return rule
+
+    async def list_tax_rules(self):
+        # Postgres sorts the country-wide rule after the category ones
+        return sorted(self.tax_rules.values(), key=lambda rule: (
+            rule.country, rule.category_id is None, rule.category_id.int if rule.category_id else 0))
+
+    async def delete_tax_rule(self, rule_id):
+        for key, rule in list(self.tax_rules.items()):
+            if rule.id == rule_id:
+                del self.tax_rules[key]
+
+
+memory: Optional[MemoryRepository] = MemoryRepository() if REPOSITORY == "memory" else None
+
+
+@asynccontextmanager
+async def reading() -> AsyncGenerator[Repository, None]:
+    """Repository for reads, on a read replica when DATABASE_REPLICA_URLS is set."""
+    if memory is not None:
+        yield memory
+        return
+    async with read_session() as db:
+        yield SqlRepository(db)
+
+
+@asynccontextmanager
+async def writing() -> AsyncGenerator[Repository, None]:
+    if memory is not None:
+        yield memory
+        return
+    async with write_session() as db:
+        yield SqlRepository(db)
+
+
+async def get_repository() -> AsyncGenerator[Repository, None]:
+    async with writing() as repository:
+        yield repository
+
+
+async def get_read_repository() -> AsyncGenerator[Repository, None]:
+    async with reading() as repository:
+        yield repository
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import Integer, column, delete, func, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import http_cache, models
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = float(os.getenv("STOCK_RESERVATION_TTL", "900"))
+SWEEP_INTERVAL = float(os.getenv("STOCK_SWEEP_INTERVAL", "30"))
+SWEEP_BATCH_SIZE = int(os.getenv("STOCK_SWEEP_BATCH_SIZE", "500"))
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id: uuid.UUID, requested: int):
+        super().__init__(f"not enough stock for product {product_id}")
+        self.product_id = product_id
+        self.requested = requested
+
+
+def _expires_at() -> datetime:
+    return datetime.now() + timedelta(seconds=RESERVATION_TTL)
+
+
+async def reserve(db: AsyncSession, basket_id: uuid.UUID, amounts: Dict[uuid.UUID, int]) -> None:
+    """Take ``amounts`` out of product stock and hold them for the basket.
+
+    Stock is decremented with a conditional UPDATE, so it can never go negative. Raises
+    OutOfStockError on the first product that cannot be served; the caller must roll back.
+    """
+    reservation = models.StockReservation
+    # lock products in a stable order so concurrent multi-product reservations cannot deadlock
+    for product_id in sorted(amounts):
+        amount = amounts[product_id]
+        if amount <= 0:
+            continue
+        remaining = await db.scalar(
+            update(models.Product)
+            .where(models.Product.id == product_id, models.Product.stock >= amount)
+            .values(stock=models.Product.stock - amount)
+            .returning(models.Product.stock))
+        if remaining is None:
+            raise OutOfStockError(product_id, amount)
+        http_cache.stock_changed()
+        stmt = pg_insert(reservation).values(
+            shopping_basket_id=basket_id, product_id=product_id, amount=amount, expires_at=_expires_at())
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[reservation.shopping_basket_id, reservation.product_id],
+            set_={"amount": reservation.amount + stmt.excluded.amount, "expires_at": stmt.excluded.expires_at},
+        ))
+
+
+async def release(db: AsyncSession, basket_id: uuid.UUID, amounts: Dict[uuid.UUID, int]) -> None:
+    """Give up to ``amounts`` of the basket's reservations back to product stock."""
+    reservation = models.StockReservation
+    for product_id in sorted(amounts):
+        amount = amounts[product_id]
+        if amount <= 0:
+            continue
+        key = (reservation.shopping_basket_id == basket_id, reservation.product_id == product_id)
+        # each statement is atomic on the reservation row, so a concurrent sweep can never be released twice
+        kept = await db.scalar(
+            update(reservation).where(*key, reservation.amount > amount)
+            .values(amount=reservation.amount - amount).returning(reservation.amount))
+        if kept is not None:
+            released = amount
+        else:
+            released = await db.scalar(delete(reservation).where(*key).returning(reservation.amount))
+        if released:
+            await db.execute(
+                update(models.Product).where(models.Product.id == product_id)
+                .values(stock=models.Product.stock + released))
+            http_cache.stock_changed()
+
+
+async def release_all(db: AsyncSession, basket_id: uuid.UUID) -> None:
+    reservation = models.StockReservation
+    result = await db.execute(
+        select(reservation.product_id, reservation.amount).where(reservation.shopping_basket_id == basket_id))
+    await release(db, basket_id, dict(result.all()))
+
+
+async def fulfil(db: AsyncSession, basket_id: uuid.UUID, amounts: Dict[uuid.UUID, int]) -> None:
+    """Turn the basket's reservations into sold stock for an order of ``amounts``.
+
+    Reservations that expired and were swept back are taken from stock again and
+    surplus ones are given back, with one statement for the reservations and one for
+    all products. Raises OutOfStockError when a shortfall cannot be served; the caller
+    must roll back.
+    """
+    reservation = models.StockReservation
+    product = models.Product
+    reserved = dict((await db.execute(
+        delete(reservation).where(reservation.shopping_basket_id == basket_id)
+        .returning(reservation.product_id, reservation.amount))).all())
+    deltas = {pid: amounts.get(pid, 0) - reserved.get(pid, 0) for pid in amounts.keys() | reserved.keys()}
+    deltas = {pid: delta for pid, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # lock in the order reserve() does, so a checkout cannot deadlock with basket mutations
+    await db.execute(select(product.id).where(product.id.in_(sorted(deltas))).order_by(product.id).with_for_update())
+    requested = values(
+        column("product_id", product.id.type),
+        column("delta", Integer),
+        name="requested",
+    ).data(list(deltas.items()))
+    updated = set((await db.scalars(
+        update(product)
+        .where(product.id == requested.c.product_id, product.stock >= requested.c.delta)
+        .values(stock=product.stock - requested.c.delta)
+        .returning(product.id))).all())
+    for product_id in sorted(deltas):
+        if product_id not in updated:
+            raise OutOfStockError(product_id, deltas[product_id])
+    http_cache.stock_changed()
+
+
+async def extend(db: AsyncSession, basket_id: uuid.UUID) -> None:
+    reservation = models.StockReservation
+    await db.execute(
+        update(reservation).where(reservation.shopping_basket_id == basket_id).values(expires_at=_expires_at()))
+
+
+async def sweep_expired(db: AsyncSession, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Release one batch of expired reservations; rows held by in-flight basket mutations are skipped."""
+    reservation = models.StockReservation
+    expired_keys = (
+        select(reservation.shopping_basket_id, reservation.product_id)
+        .where(reservation.expires_at < datetime.now())
+        .order_by(reservation.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    expired = (
+        delete(reservation)
+        .where(tuple_(reservation.shopping_basket_id, reservation.product_id).in_(expired_keys))
+        .returning(reservation.product_id, reservation.amount)
+        .cte("expired")
+    )
+    restocked = (
+        select(expired.c.product_id, func.sum(expired.c.amount).label("amount"), func.count().label("reservations"))
+        .group_by(expired.c.product_id)
+        .cte("restocked")
+    )
+    products = models.Product.__table__
+    result = await db.execute(
+        update(products)
+        .where(products.c.id == restocked.c.product_id)
+        .values(stock=products.c.stock + restocked.c.amount)
+        .returning(restocked.c.reservations))
+    swept = sum(result.scalars().all())
+    await db.commit()
+    if swept:
+        http_cache.stock_changed()
+    return swept
+
+
+async def sweep_forever(session_factory, interval: float = SWEEP_INTERVAL,
+                        batch_size: int = SWEEP_BATCH_SIZE) -> None:
+    while True:
+        try:
+            async with session_factory() as db:
+                while await sweep_expired(db, batch_size) >= batch_size:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("stock reservation sweep failed")
+        await asyncio.sleep(interval)
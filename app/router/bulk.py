@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, bulk
+from ..database import get_db, ReadSessionLocal
+
+router = APIRouter(prefix="/bulk/v1", tags=["bulk"])
+
+IMPORTS = {
+    "products": bulk.import_products,
+    "categories": bulk.import_categories,
+    "translations": bulk.import_translations,
+}
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _format(request: Request, format: Optional[str]) -> str:
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    if format not in bulk.FORMATS:
+        raise HTTPException(422, f"unsupported format {format}")
+    return format
+
+
+@router.post("/{table}", response_model=schemas.ImportReport)
+async def import_rows(table: str, request: Request,
+                      format: Optional[str] = Query(None, description="csv or ndjson, defaults to the content type"),
+                      batch_size: int = Query(bulk.BATCH_SIZE, ge=1, le=5000),
+                      db: AsyncSession = Depends(get_db)):
+    if table not in IMPORTS:
+        raise HTTPException(404, "not found")
+    fmt = _format(request, format)
+    return await IMPORTS[table](db, bulk.iter_lines(request.stream()), fmt, batch_size=batch_size)
+
+
+@router.get("/{table}")
+async def export_rows(table: str, format: str = Query("ndjson", pattern="^(csv|ndjson)$")):
+    if table not in bulk.EXPORTS:
+        raise HTTPException(404, "not found")
+
+    async def chunks():
+        async with ReadSessionLocal() as session:
+            async for chunk in bulk.export_rows(session, table, format):
+                yield chunk
+
+    return StreamingResponse(chunks(), media_type=MEDIA_TYPES[format])
@@ -1,37 +1,85 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Optional, Tuple
 import uuid
-from sqlalchemy.ext.asyncio import AsyncSession
-from .. import schemas, crud
-from ..database import get_db
+from .. import schemas, crud, http_cache, serializers
+from ..repository import Repository, get_read_repository, get_repository, reading
+from ..pagination import encode_product_cursor, decode_product_cursor
+from ..translations import get_languages
 
 router = APIRouter(prefix="/category/v1", tags=["categories"])
 
+MAX_BATCH = 200
+
 @router.post("/categories", response_model=schemas.CategoryRead, status_code=201)
-async def create_category(payload: schemas.CategoryCreate, db: AsyncSession = Depends(get_db)):
-    c = await crud.create_category(db, payload)
-    return await crud.get_category(db, c.id)
+async def create_category(payload: schemas.CategoryCreate, repo: Repository = Depends(get_repository)):
+    return await repo.create_category(payload)
 
 @router.get("/categories", response_model=List[schemas.CategoryRead])
-async def list_categories(db: AsyncSession = Depends(get_db)):
-    rows = await crud.list_categories(db)
-    return rows
+async def list_categories(request: Request):
+    async def build():
+        async with reading() as repo:
+            return http_cache.render(List[schemas.CategoryRead], await repo.list_categories())
+
+    return await http_cache.responses.respond(request, http_cache.CATEGORIES, build)
+
+@router.get("/tree", response_model=List[schemas.CategoryRead])
+async def get_category_tree(repo: Repository = Depends(get_read_repository)):
+    return serializers.response(List[schemas.CategoryRead], await repo.get_category_tree())
+
+# declared before /categories/{category_id}, which would take "batch" for an id
+@router.get("/categories/batch", response_model=List[schemas.CategoryRead])
+async def get_categories(ids: List[uuid.UUID] = Query([], alias="id"),
+                         repo: Repository = Depends(get_read_repository)):
+    if len(ids) > MAX_BATCH:
+        raise HTTPException(422, f"at most {MAX_BATCH} ids")
+    return serializers.response(List[schemas.CategoryRead], await repo.get_categories(ids))
 
 @router.get("/categories/{category_id}", response_model=schemas.CategoryRead)
-async def get_category(category_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    c = await crud.get_category(db, category_id)
+async def get_category(category_id: uuid.UUID, repo: Repository = Depends(get_read_repository)):
+    c = await repo.get_category(category_id)
     if not c:
         raise HTTPException(404, "not found")
-    return c
+    return serializers.response(schemas.CategoryRead, c)
+
+@router.get("/categories/{category_id}/ancestors", response_model=List[schemas.CategoryReadSimple])
+async def get_category_ancestors(category_id: uuid.UUID, repo: Repository = Depends(get_read_repository)):
+    ancestors = await repo.get_category_ancestors(category_id)
+    if not ancestors:
+        raise HTTPException(404, "not found")
+    return serializers.response(List[schemas.CategoryReadSimple], ancestors)
+
+@router.get("/categories/{category_id}/products", response_model=List[schemas.ProductRead])
+async def list_category_products(category_id: uuid.UUID, response: Response,
+                                 cursor: Optional[str] = None,
+                                 limit: int = Query(100, ge=1, le=1000),
+                                 repo: Repository = Depends(get_read_repository),
+                                 languages: Tuple[str, ...] = Depends(get_languages)):
+    if cursor is not None:
+        try:
+            decode_product_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "invalid cursor")
+    products = await repo.list_products(limit=limit + 1, languages=languages, cursor=cursor,
+                                        category_subtree_id=category_id)
+    headers = {}
+    if len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Cursor"] = encode_product_cursor(products[-1])
+    response.headers.update(headers)
+    return serializers.response(List[schemas.ProductRead], products, headers=headers)
 
 @router.put("/categories/{category_id}", response_model=schemas.CategoryRead)
-async def update_category(category_id: uuid.UUID, payload: schemas.CategoryUpdate, db: AsyncSession = Depends(get_db)):
-    c = await crud.update_category(db, category_id, payload)
+async def update_category(category_id: uuid.UUID, payload: schemas.CategoryUpdate,
+                          repo: Repository = Depends(get_repository)):
+    try:
+        c = await repo.update_category(category_id, payload)
+    except crud.CategoryCycleError as e:
+        raise HTTPException(409, str(e))
     if not c:
         raise HTTPException(404, "not found")
     return c
 
 @router.delete("/categories/{category_id}", status_code=204)
-async def delete_category(category_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    await crud.delete_category(db, category_id)
+async def delete_category(category_id: uuid.UUID, repo: Repository = Depends(get_repository)):
+    await repo.delete_category(category_id)
     return None
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import changes, schemas, serializers
+from ..database import get_read_db, read_session
+
+router = APIRouter(prefix="/changes/v1", tags=["changes"])
+
+MAX_WAIT = 30
+# seconds between keepalive comments on an idle stream, which also carry a fresh cursor
+STREAM_KEEPALIVE = 15
+STREAM_BATCH = 500
+
+
+def _position(cursor: str) -> Tuple[changes.Position, datetime]:
+    try:
+        return changes.decode(cursor)
+    except changes.CursorExpiredError as e:
+        raise HTTPException(410, f"{e}, start over from /head")
+    except ValueError:
+        raise HTTPException(400, "invalid cursor")
+
+
+def _entities(entities: List[str]) -> List[str]:
+    unknown = set(entities) - set(changes.ENTITIES)
+    if unknown:
+        raise HTTPException(422, f"unknown entities {sorted(unknown)}, expected some of {list(changes.ENTITIES)}")
+    return entities
+
+
+def _change(change) -> dict:
+    return {"entity": change.entity, "id": change.entity_id, "op": change.op, "changed_at": change.created_at}
+
+
+@router.get("/head", response_model=schemas.ChangeCursor)
+async def get_head(db: AsyncSession = Depends(get_read_db)):
+    return {"cursor": changes.encode(await changes.head(db))}
+
+@router.get("/changes", response_model=schemas.ChangePage)
+async def list_changes(since: str,
+                       limit: int = Query(500, ge=1, le=1000),
+                       entities: List[str] = Query([], alias="entity"),
+                       wait: float = Query(0, ge=0, le=MAX_WAIT),
+                       db: AsyncSession = Depends(get_read_db)):
+    after, issued_at = _position(since)
+    found = await changes.wait_for_changes(db, after, limit, _entities(entities), wait)
+    if found:
+        after = (found[-1].txid, found[-1].id)
+    # a full page may have more behind it, the cursor only gets younger once the consumer catches up
+    issued_at = changes.read_through(issued_at, found[-1] if len(found) == limit else None)
+    return {"changes": [_change(c) for c in found], "next": changes.encode(after, issued_at)}
+
+@router.get("/stream")
+async def stream_changes(since: Optional[str] = None,
+                         entities: List[str] = Query([], alias="entity"),
+                         last_event_id: Optional[str] = Header(None)):
+    # a reconnecting EventSource sends the id of the last event it got
+    cursor = last_event_id or since
+    entities = _entities(entities)
+    if cursor is not None:
+        after, issued_at = _position(cursor)
+    else:
+        async with read_session() as db:
+            after, issued_at = await changes.head(db), datetime.now()
+
+    async def events():
+        position, read_at = after, issued_at
+        async with read_session() as db:
+            while True:
+                found = await changes.wait_for_changes(db, position, STREAM_BATCH, entities, STREAM_KEEPALIVE)
+                batch = [((c.txid, c.id), changes.read_through(read_at, c), _change(c)) for c in found]
+                # no connection is held while the client reads
+                await db.rollback()
+                if not batch:
+                    read_at = changes.read_through(read_at)
+                    yield f"id: {changes.encode(position, read_at)}\n: keepalive\n\n"
+                    continue
+                for position, read_at, change in batch:
+                    data = serializers.dumps(change).decode()
+                    yield f"id: {changes.encode(position, read_at)}\nevent: change\ndata: {data}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,15 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from sqlalchemy.ext.asyncio import AsyncSession
-from .. import schemas, crud
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import Dict, List, Tuple
+from .. import schemas, http_cache
+from ..repository import Repository, get_read_repository, get_repository, reading
+from ..translations import get_languages
 
 router = APIRouter(prefix="/cms/v1", tags=["cms"])
 
+MAX_BATCH = 500
+
 @router.post("/translations", response_model=schemas.CmsRead, status_code=201)
-async def create_cms(payload: schemas.CmsCreate, db: AsyncSession = Depends(get_db)):
-    return await crud.create_cms(db, payload)
+async def create_cms(payload: schemas.CmsCreate, repo: Repository = Depends(get_repository)):
+    return await repo.create_cms(payload)
 
 @router.get("/translations", response_model=List[schemas.CmsRead])
-async def list_cms(db: AsyncSession = Depends(get_db)):
-    return await crud.list_cms(db)
+async def list_cms(request: Request):
+    async def build():
+        async with reading() as repo:
+            return http_cache.render(List[schemas.CmsRead], await repo.list_cms())
+
+    return await http_cache.responses.respond(request, http_cache.TRANSLATIONS, build)
+
+@router.get("/translations/batch", response_model=Dict[str, str])
+async def resolve_cms(codes: List[str] = Query([], alias="code"), repo: Repository = Depends(get_read_repository),
+                      languages: Tuple[str, ...] = Depends(get_languages)):
+    if len(codes) > MAX_BATCH:
+        raise HTTPException(422, f"at most {MAX_BATCH} codes")
+    return await repo.resolve_cms(codes, languages)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from .. import admission, lifecycle, metrics, profiler
+from ..database import pool_status
+
+router = APIRouter(prefix="/ops/v1", tags=["ops"])
+
+@router.get("/ready")
+async def get_ready():
+    if lifecycle.startup_seconds is None:
+        raise HTTPException(503, "starting")
+    return {"startup_seconds": round(lifecycle.startup_seconds, 3), "warmup_seconds": round(lifecycle.warmup_seconds or 0, 3)}
+
+@router.get("/pool")
+async def get_pool_status():
+    return pool_status()
+
+@router.get("/admission")
+async def get_admission_status():
+    return admission.control.status()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(pool_status(), admission.control.status()), media_type="text/plain; version=0.0.4")
+
+@router.get("/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=500)):
+    return metrics.slow_queries(limit)
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def get_profile(seconds: float = Query(10, gt=0, le=profiler.PROFILE_MAX_SECONDS),
+                      interval_ms: float = Query(5, ge=1, le=1000)):
+    if not profiler.PROFILER_ENABLED:
+        raise HTTPException(404, "not found")
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(409, str(e))
+    return PlainTextResponse(result.collapsed(), headers={"X-Profile-Samples": str(result.samples)})
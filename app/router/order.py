@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+import uuid
+from typing import Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, basket_store, orders
+from ..database import get_db, get_read_db
+from ..translations import get_languages
+
+router = APIRouter(prefix="/order/v1", tags=["orders"])
+
+@router.post("/orders", response_model=schemas.OrderRead, status_code=201)
+async def place_order(payload: schemas.OrderCreate, response: Response,
+                      idempotency_key: str = Header(..., min_length=8, max_length=255),
+                      db: AsyncSession = Depends(get_db),
+                      languages: Tuple[str, ...] = Depends(get_languages)):
+    # a basket still in the store has to be in Postgres, with its stock reserved, before it can be checked out
+    await basket_store.hand_over(db, payload.shopping_basket_id)
+    try:
+        order, created = await orders.checkout(db, payload.shopping_basket_id, idempotency_key, languages)
+    except orders.PriceChangedError as e:
+        raise HTTPException(409, {"message": str(e), "product_ids": [str(pid) for pid in e.product_ids],
+                                  "totals": jsonable_encoder(e.totals)})
+    except orders.AlreadyCheckedOutError as e:
+        raise HTTPException(409, {"message": str(e), "order_id": str(e.order.id)})
+    except orders.EmptyBasketError as e:
+        raise HTTPException(409, str(e))
+    except orders.IdempotencyKeyReusedError as e:
+        raise HTTPException(422, str(e))
+    if order is None:
+        raise HTTPException(404, "basket not found")
+    if not created:
+        response.status_code = 200
+        response.headers["Idempotent-Replayed"] = "true"
+    return order
+
+@router.get("/orders/{order_id}", response_model=schemas.OrderRead)
+async def get_order(order_id: uuid.UUID, db: AsyncSession = Depends(get_read_db)):
+    order = await orders.get_order(db, order_id)
+    if not order:
+        raise HTTPException(404, "not found")
+    return order
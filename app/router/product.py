@@ -1,36 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Tuple
+import json
 import uuid
-from sqlalchemy.ext.asyncio import AsyncSession
-from .. import schemas, crud
-from ..database import get_db
+from .. import crud, schemas, http_cache, serializers
+from ..repository import Repository, get_read_repository, get_repository, reading
+from ..pagination import encode_product_cursor, decode_product_cursor
+from ..translations import get_languages
 
 router = APIRouter(prefix="/product/v1", tags=["products"])
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# ids plus codes one multi-get may ask for
+MAX_BATCH = 200
+
+
+def _parse_fields(fields: Optional[str]):
+    if fields is None:
+        return None
+    selected = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = selected - set(schemas.ProductRead.model_fields)
+    if unknown:
+        raise HTTPException(422, f"unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def _encode(product, fields):
+    return jsonable_encoder(schemas.ProductRead.model_validate(product, from_attributes=True), include=fields)
+
 @router.post("/products", response_model=schemas.ProductRead, status_code=201)
-async def create_product(payload: schemas.ProductCreate, db: AsyncSession = Depends(get_db)):
-    p = await crud.create_product(db, payload)
-    return p
+async def create_product(payload: schemas.ProductCreate, repo: Repository = Depends(get_repository),
+                         languages: Tuple[str, ...] = Depends(get_languages)):
+    try:
+        p = await repo.create_product(payload)
+    except crud.ProductCodeTakenError as e:
+        raise HTTPException(409, str(e))
+    except crud.UnknownCategoryError as e:
+        raise HTTPException(422, str(e))
+    return await repo.get_product(p.id, languages)
 
 @router.get("/products", response_model=List[schemas.ProductRead])
-async def list_products(db: AsyncSession = Depends(get_db)):
-    return await crud.list_products(db)
+async def list_products(request: Request,
+                        cursor: Optional[str] = None,
+                        limit: Optional[int] = Query(None, ge=1),
+                        category_id: Optional[uuid.UUID] = None,
+                        brand: Optional[str] = None,
+                        min_price: Optional[int] = None,
+                        max_price: Optional[int] = None,
+                        fields: Optional[str] = Query(None, description="comma separated subset of product fields"),
+                        format: str = Query("json", pattern="^(json|ndjson)$"),
+                        languages: Tuple[str, ...] = Depends(get_languages)):
+    selected = _parse_fields(fields)
+    filters = dict(cursor=cursor, category_id=category_id, brand=brand, min_price=min_price, max_price=max_price)
+    if cursor is not None:
+        try:
+            decode_product_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "invalid cursor")
+
+    if format == "ndjson":
+        async def lines():
+            # the request session is released once the handler returns, so the stream owns its own
+            async with reading() as repo:
+                async for product in repo.stream_products(limit=limit, languages=languages, **filters):
+                    yield json.dumps(_encode(product, selected)) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    limit = min(limit or PAGE_SIZE, MAX_PAGE_SIZE)
+
+    async def build():
+        async with reading() as repo:
+            products = await repo.list_products(limit=limit + 1, languages=languages, **filters)
+        headers = {}
+        if len(products) > limit:
+            products = products[:limit]
+            headers["X-Next-Cursor"] = encode_product_cursor(products[-1])
+        if selected is not None:
+            body = json.dumps([_encode(p, selected) for p in products]).encode()
+            return http_cache.CachedResponse(body, headers=headers)
+        return http_cache.render(List[schemas.ProductRead], products, headers)
+
+    return await http_cache.responses.respond(request, http_cache.PRODUCTS, build, languages=languages)
+
+# declared before /{product_id}, which would take "batch" for an id
+@router.get("/batch", response_model=List[schemas.ProductRead])
+async def get_products(ids: List[uuid.UUID] = Query([], alias="id"), codes: List[str] = Query([], alias="code"),
+                       repo: Repository = Depends(get_read_repository),
+                       languages: Tuple[str, ...] = Depends(get_languages)):
+    if len(ids) + len(codes) > MAX_BATCH:
+        raise HTTPException(422, f"at most {MAX_BATCH} ids and codes")
+    products = await repo.get_products(ids, codes, languages)
+    return serializers.response(List[schemas.ProductRead], products)
 
 @router.get("/{product_id}", response_model=schemas.ProductRead)
-async def get_product(product_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    p = await crud.get_product(db, product_id)
-    if not p:
-        raise HTTPException(404, "not found")
-    return p
+async def get_product(product_id: uuid.UUID, request: Request, languages: Tuple[str, ...] = Depends(get_languages)):
+    async def build():
+        async with reading() as repo:
+            p = await repo.get_product(product_id, languages)
+            if not p:
+                raise HTTPException(404, "not found")
+            return http_cache.render(schemas.ProductRead, p)
+
+    return await http_cache.responses.respond(request, http_cache.PRODUCTS, build, languages=languages)
 
 @router.put("/{product_id}", response_model=schemas.ProductRead)
-async def update_product(product_id: uuid.UUID, payload: schemas.ProductUpdate, db: AsyncSession = Depends(get_db)):
-    p = await crud.update_product(db, product_id, payload)
+async def update_product(product_id: uuid.UUID, payload: schemas.ProductUpdate,
+                         repo: Repository = Depends(get_repository),
+                         languages: Tuple[str, ...] = Depends(get_languages)):
+    try:
+        p = await repo.update_product(product_id, payload, languages)
+    except crud.ProductCodeTakenError as e:
+        raise HTTPException(409, str(e))
+    except crud.UnknownCategoryError as e:
+        raise HTTPException(422, str(e))
     if not p:
         raise HTTPException(404, "not found")
     return p
 
 @router.delete("/{product_id}", status_code=204)
-async def delete_product(product_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    await crud.delete_product(db, product_id)
+async def delete_product(product_id: uuid.UUID, repo: Repository = Depends(get_repository)):
+    await repo.delete_product(product_id)
     return None
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Query
+from typing import List, Optional, Tuple
+import uuid
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, search
+from ..database import get_read_db
+from ..translations import get_languages
+
+router = APIRouter(prefix="/search/v1", tags=["search"])
+
+@router.get("/products", response_model=schemas.SearchResults)
+async def search_products(q: str = Query(..., min_length=1, max_length=200),
+                          category_id: Optional[uuid.UUID] = None,
+                          brand: Optional[str] = None,
+                          limit: int = Query(20, ge=1, le=100),
+                          offset: int = Query(0, ge=0, le=10000),
+                          db: AsyncSession = Depends(get_read_db),
+                          languages: Tuple[str, ...] = Depends(get_languages)):
+    return await search.search_products(db, q, languages, category_id=category_id, brand=brand, limit=limit, offset=offset)
+
+@router.get("/suggest", response_model=List[schemas.SearchSuggestion])
+async def suggest(q: str = Query(..., min_length=1, max_length=100),
+                  limit: int = Query(10, ge=1, le=50),
+                  db: AsyncSession = Depends(get_read_db),
+                  languages: Tuple[str, ...] = Depends(get_languages)):
+    return await search.suggest_products(db, q, languages, limit=limit)
@@ -1,31 +1,67 @@
 from fastapi import APIRouter, Depends, HTTPException
 import uuid
-from sqlalchemy.ext.asyncio import AsyncSession
-from .. import schemas, crud
-from ..database import get_db
+from typing import Tuple
+from .. import schemas, serializers
+from ..repository import Repository, get_read_repository, get_repository
+from ..translations import get_languages
 
 router = APIRouter(prefix="/shopping-basket/v1", tags=["shopping basket"])
 
 @router.post("/shopping-baskets", response_model=schemas.ShoppingBasketId, status_code=201)
-async def create_basket(payload: schemas.ShoppingBasketCreate, db: AsyncSession = Depends(get_db)):
-    shopping_basket = await crud.create_shopping_basket(db, payload)
-    return await crud.get_shopping_basket(db, shopping_basket.id)
+async def create_basket(payload: schemas.ShoppingBasketCreate, repo: Repository = Depends(get_repository),
+                        languages: Tuple[str, ...] = Depends(get_languages)):
+    shopping_basket = await repo.create_shopping_basket(payload)
+    return await repo.get_shopping_basket(shopping_basket.id, languages)
 
 @router.get("/shopping-baskets/{basket_id}", response_model=schemas.ShoppingBasketRead)
-async def get_basket(basket_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    shopping_basket = await crud.get_shopping_basket(db, basket_id)
+async def get_basket(basket_id: uuid.UUID, repo: Repository = Depends(get_read_repository),
+                     languages: Tuple[str, ...] = Depends(get_languages)):
+    shopping_basket = await repo.get_shopping_basket(basket_id, languages)
     if not shopping_basket:
         raise HTTPException(404, "not found")
-    return shopping_basket
+    return serializers.response(schemas.ShoppingBasketRead, shopping_basket)
+
+@router.get("/shopping-baskets/{basket_id}/summary", response_model=schemas.ShoppingBasketTotals)
+async def get_basket_summary(basket_id: uuid.UUID, repo: Repository = Depends(get_read_repository)):
+    totals = await repo.get_shopping_basket_totals(basket_id)
+    if not totals:
+        raise HTTPException(404, "not found")
+    return totals
 
 @router.post("/shopping-baskets/{basket_id}", response_model=schemas.ShoppingBasketRead, status_code=200)
-async def add_item(basket_id: uuid.UUID, payload: schemas.ShoppingBasketItemCreate, db: AsyncSession = Depends(get_db)):
-    shopping_basket = await crud.add_item_to_shopping_basket(db, basket_id, payload)
+async def add_item(basket_id: uuid.UUID, payload: schemas.ShoppingBasketItemCreate,
+                   repo: Repository = Depends(get_repository),
+                   languages: Tuple[str, ...] = Depends(get_languages)):
+    shopping_basket = await repo.add_item_to_shopping_basket(basket_id, payload, languages)
     if not shopping_basket:
         raise HTTPException(404, "basket not found")
-    return shopping_basket
+    return serializers.response(schemas.ShoppingBasketRead, shopping_basket)
+
+@router.post("/shopping-baskets/{basket_id}/items", response_model=schemas.ShoppingBasketTotals)
+async def add_items(basket_id: uuid.UUID, payload: schemas.ShoppingBasketItemsAdd,
+                    repo: Repository = Depends(get_repository)):
+    totals = await repo.add_items_to_shopping_basket(basket_id, payload.items)
+    if not totals:
+        raise HTTPException(404, "basket not found")
+    return totals
+
+@router.put("/shopping-baskets/{basket_id}/items/{product_id}", response_model=schemas.ShoppingBasketTotals)
+async def set_item_amount(basket_id: uuid.UUID, product_id: uuid.UUID, payload: schemas.ShoppingBasketItemAmount,
+                          repo: Repository = Depends(get_repository)):
+    totals = await repo.set_shopping_basket_item_amount(basket_id, product_id, payload.amount)
+    if not totals:
+        raise HTTPException(404, "basket not found")
+    return totals
+
+@router.patch("/shopping-baskets/{basket_id}/items/{product_id}", response_model=schemas.ShoppingBasketTotals)
+async def change_item_amount(basket_id: uuid.UUID, product_id: uuid.UUID, payload: schemas.ShoppingBasketItemDelta,
+                             repo: Repository = Depends(get_repository)):
+    totals = await repo.change_shopping_basket_item_amount(basket_id, product_id, payload.delta)
+    if not totals:
+        raise HTTPException(404, "basket not found")
+    return totals
 
 @router.delete("/shopping-baskets/items/{item_id}", status_code=204)
-async def remove_item(item_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
-    await crud.remove_item_from_shopping_basket(db, item_id)
+async def remove_item(item_id: uuid.UUID, repo: Repository = Depends(get_repository)):
+    await repo.remove_item_from_shopping_basket(item_id)
     return None
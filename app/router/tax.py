@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from typing import List
+import uuid
+from .. import schemas
+from ..repository import Repository, get_repository
+
+router = APIRouter(prefix="/tax/v1", tags=["tax"])
+
+@router.post("/rules", response_model=schemas.TaxRuleRead, status_code=201)
+async def create_rule(payload: schemas.TaxRuleCreate, repo: Repository = Depends(get_repository)):
+    return await repo.create_tax_rule(payload)
+
+@router.get("/rules", response_model=List[schemas.TaxRuleRead])
+async def list_rules(repo: Repository = Depends(get_repository)):
+    return await repo.list_tax_rules()
+
+@router.delete("/rules/{rule_id}", status_code=204)
+async def delete_rule(rule_id: uuid.UUID, repo: Repository = Depends(get_repository)):
+    await repo.delete_tax_rule(rule_id)
+    return None
@@ -27,6 +27,12 @@ class CategoryUpdate(BaseModel):
     children_ids: Optional[List[uuid.UUID]] = None
 
 
+class CategoryImport(BaseModel):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4)
+    name: str
+    parent_id: Optional[uuid.UUID] = None
+
+
 class CategoryRead(BaseModel):
     id: uuid.UUID
     name: str
@@ -83,15 +89,58 @@ class ProductRead(BaseModel):
         orm_mode = True
 
 
+class SearchHit(ProductRead):
+    rank: float
+
+
+class FacetCount(BaseModel):
+    value: str
+    label: Optional[str] = None
+    count: int
+
+
+class SearchResults(BaseModel):
+    total: int
+    total_exact: bool = True
+    items: List[SearchHit] = []
+    categories: List[FacetCount] = []
+    brands: List[FacetCount] = []
+
+    class Config:
+        orm_mode = True
+
+
+class SearchSuggestion(BaseModel):
+    id: uuid.UUID
+    name: str
+
+    class Config:
+        orm_mode = True
+
+
 class ShoppingBasketItemBase(BaseModel):
     price: Optional[int] = 0
     amount: Optional[int] = 1
+    tax_rate: Optional[int] = 0
     image_url: Optional[str] = None
     name: Optional[str] = None
 
 
 class ShoppingBasketItemCreate(BaseModel):
     product_id: Optional[uuid.UUID]
+    amount: int = Field(1, ge=1)
+
+
+class ShoppingBasketItemsAdd(BaseModel):
+    items: List[ShoppingBasketItemCreate]
+
+
+class ShoppingBasketItemAmount(BaseModel):
+    amount: int = Field(..., ge=0)
+
+
+class ShoppingBasketItemDelta(BaseModel):
+    delta: int
 
 
 class ShoppingBasketItemRead(ShoppingBasketItemBase):
@@ -105,21 +154,113 @@ class ShoppingBasketItemRead(ShoppingBasketItemBase):
 
 class ShoppingBasketCreate(BaseModel):
     items: Optional[List[ShoppingBasketItemCreate]] = []
+    country: Optional[str] = None
 
 
 class ShoppingBasketId(BaseModel):
     id: uuid.UUID
 
 
+class ShoppingBasketTotals(BaseModel):
+    id: uuid.UUID
+    country: str
+    item_count: int = 0
+    quantity: int = 0
+    total_price_exclusive: int = 0
+    total_price_inclusive: int = 0
+    tax: int = 0
+
+    class Config:
+        orm_mode = True
+
+
 class ShoppingBasketRead(BaseModel):
     id: uuid.UUID
+    country: Optional[str] = None
     items: List[ShoppingBasketItemRead] = []
-    total_price_exclusive: Optional[float] = 0.0
-    total_price_inclusive: Optional[float] = 0.0
-    tax: Optional[float] = 0.0
+    total_price_exclusive: int = 0
+    total_price_inclusive: int = 0
+    tax: int = 0
 
     class Config:
         orm_mode = True
 
 
+class OrderCreate(BaseModel):
+    shopping_basket_id: uuid.UUID
+
+
+class OrderLineRead(BaseModel):
+    position: int
+    product_id: uuid.UUID
+    code: Optional[str] = None
+    name: Optional[str] = None
+    image_url: Optional[str] = None
+    price: int
+    amount: int
+    tax_rate: int
+    tax: int
+
+    class Config:
+        orm_mode = True
+
+
+class OrderRead(BaseModel):
+    id: uuid.UUID
+    shopping_basket_id: uuid.UUID
+    status: str
+    country: str
+    language: str
+    item_count: int = 0
+    quantity: int = 0
+    total_price_exclusive: int = 0
+    total_price_inclusive: int = 0
+    tax: int = 0
+    lines: List[OrderLineRead] = []
+    created_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class TaxRuleCreate(BaseModel):
+    country: str
+    category_id: Optional[uuid.UUID] = None
+    rate: int = Field(..., ge=0, description="basis points, 2100 is 21%")
+
+
+class TaxRuleRead(TaxRuleCreate):
+    id: uuid.UUID
+
+    class Config:
+        orm_mode = True
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    processed: int
+    written: int
+    errors: List[ImportRowError] = []
+
+
+class ChangeRead(BaseModel):
+    entity: str
+    id: uuid.UUID
+    op: str = Field(..., description="upsert or delete")
+    changed_at: datetime
+
+
+class ChangePage(BaseModel):
+    changes: List[ChangeRead] = []
+    next: str = Field(..., description="cursor to read on from, also when there were no changes")
+
+
+class ChangeCursor(BaseModel):
+    cursor: str
+
+
 CategoryRead.update_forward_refs()
@@ -0,0 +1,196 @@
+import os
+import re
+import uuid
+from typing import List, Optional, Sequence
+
+from sqlalchemy import String, cast, column, delete, exists, func, literal_column, or_, select, true, values
+from sqlalchemy.dialects.postgresql import ARRAY, REGCONFIG, TSVECTOR, aggregate_order_by, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import type_coerce
+
+from . import models, read_models
+from .translations import DEFAULT_LANGUAGE, DEFAULT_LANGUAGES, cms_value, language_chain
+
+# languages a search document is kept for, each product gets one row per language
+SEARCH_LANGUAGES = [lang.strip() for lang in os.getenv("SEARCH_LANGUAGES", DEFAULT_LANGUAGE).split(",") if lang.strip()]
+
+# stemming per language prefix, other languages are indexed word for word
+TEXT_SEARCH_CONFIGS = {"nl": "dutch", "en": "english", "fr": "french", "de": "german"}
+
+FACET_SIZE = 20
+# matches looked at per query; ranking and facets of broader queries are computed over the first ones found
+SEARCH_MAX_MATCHES = int(os.getenv("SEARCH_MAX_MATCHES", "10000"))
+
+
+def text_search_config(language: str) -> str:
+    return TEXT_SEARCH_CONFIGS.get(language.split("_")[0].lower(), "simple")
+
+
+def search_language(languages: Sequence[str]) -> str:
+    return next((language for language in languages if language in SEARCH_LANGUAGES), SEARCH_LANGUAGES[0])
+
+
+def tsquery_text(q: str, prefix: bool = True) -> Optional[str]:
+    """Turn free text into a to_tsquery expression matching every word, the last one as a prefix."""
+    terms = re.findall(r"[^\W_]+", q.lower())
+    if not terms:
+        return None
+    if prefix:
+        terms[-1] += ":*"
+    return " & ".join(terms)
+
+
+def _weighted(config, text, weight: str):
+    return func.setweight(func.to_tsvector(config, func.coalesce(text, "")), literal_column(f"'{weight}'"))
+
+
+async def refresh_product_search(db: AsyncSession, product_ids=None, codes=None,
+                                 languages: Optional[List[str]] = None) -> None:
+    """Recompute search documents in one INSERT ... SELECT.
+
+    Narrow the work down with ``product_ids`` (a list or a select of ids), ``codes`` (products
+    whose name or description is one of these cms codes) and ``languages``.
+    """
+    languages = [lang for lang in (languages or SEARCH_LANGUAGES) if lang in SEARCH_LANGUAGES]
+    if not languages:
+        return
+    langs = values(column("language", String), column("config", String), column("chain", ARRAY(String)),
+                   name="languages").data(
+        [(lang, text_search_config(lang), list(language_chain([lang]))) for lang in languages])
+    product = models.Product
+    config = cast(langs.c.config, REGCONFIG)
+    name_value = func.coalesce(cms_value(product.name, langs.c.chain), product.name)
+    description_value = func.coalesce(cms_value(product.description, langs.c.chain), product.description)
+    document = type_coerce(
+        _weighted(config, name_value, "A")
+        .op("||")(_weighted(config, func.concat_ws(" ", product.brand, product.code), "B"))
+        .op("||")(_weighted(config, description_value, "C")),
+        TSVECTOR)
+    rows = (
+        select(product.id, langs.c.language, name_value, description_value, product.brand, product.category_id, document)
+        .select_from(product)
+        .join(langs, true())
+    )
+    if product_ids is not None:
+        rows = rows.where(product.id.in_(product_ids))
+    if codes is not None:
+        rows = rows.where(or_(product.name.in_(codes), product.description.in_(codes)))
+    search = models.ProductSearch
+    stmt = pg_insert(search).from_select(
+        ["product_id", "language", "name", "description", "brand", "category_id", "document"], rows)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[search.product_id, search.language],
+        set_={c: stmt.excluded[c] for c in ("name", "description", "brand", "category_id", "document")},
+    ))
+
+
+async def ensure_product_search(db: AsyncSession) -> None:
+    search = models.ProductSearch
+    await db.execute(delete(search).where(search.language.not_in(SEARCH_LANGUAGES)))
+    for language in SEARCH_LANGUAGES:
+        if not await db.scalar(select(exists().where(search.language == language))):
+            await refresh_product_search(db, languages=[language])
+    await db.commit()
+
+
+def _hit(row, rank: float) -> read_models.SearchHit:
+    (product_id, name, description, brand, code, stock, image_url, price, created_at,
+     category_id, category_name) = row
+    category = read_models.CategoryView(category_id, category_name) if category_id is not None else None
+    return read_models.SearchHit(product_id, name, description, brand, code, stock, image_url, price,
+                                 category, created_at, rank)
+
+
+def _json_list(stmt, columns, order_by):
+    # aggregate the rows of a subquery into one json column, so every part of a search is one statement
+    sq = stmt.subquery()
+    return select(func.coalesce(
+        func.json_agg(aggregate_order_by(func.json_build_array(*(sq.c[c] for c in columns)), *order_by(sq))),
+        literal_column("'[]'::json"))).scalar_subquery()
+
+
+async def search_products(db: AsyncSession, q: str, languages: Sequence[str] = DEFAULT_LANGUAGES,
+                          category_id: Optional[uuid.UUID] = None, brand: Optional[str] = None,
+                          limit: int = 20, offset: int = 0) -> read_models.SearchResult:
+    """Ranked matches for ``q`` with facet counts by category and brand.
+
+    Matching, ranking, the total and both facets come from one scan of the
+    matches, capped at SEARCH_MAX_MATCHES; past the cap ``total_exact`` is False.
+    Each facet is counted with every filter except its own, so picking a brand
+    still shows how many matches the other brands have.
+    """
+    text = tsquery_text(q)
+    if text is None:
+        return read_models.SearchResult()
+    language = search_language(languages)
+    search = models.ProductSearch
+    query = func.to_tsquery(cast(text_search_config(language), REGCONFIG), text)
+    matches = (
+        select(search.product_id, search.category_id, search.brand,
+               func.ts_rank_cd(search.document, query).label("rank"))
+        .where(search.language == language, search.document.bool_op("@@")(query))
+        .limit(SEARCH_MAX_MATCHES + 1)
+        .cte("matches")
+    )
+    by_category = [] if category_id is None else [matches.c.category_id.in_(
+        select(models.CategoryClosure.descendant_id).where(models.CategoryClosure.ancestor_id == category_id))]
+    by_brand = [] if brand is None else [matches.c.brand == brand]
+
+    category = models.Category
+    count = func.count().label("count")
+    hits = _json_list(
+        select(matches.c.product_id, matches.c.rank).where(*by_category, *by_brand)
+        .order_by(matches.c.rank.desc(), matches.c.product_id).limit(limit).offset(offset),
+        ("product_id", "rank"), order_by=lambda sq: (sq.c.rank.desc(), sq.c.product_id))
+    matched = select(func.count()).select_from(matches).scalar_subquery()
+    total = select(func.count()).select_from(matches).where(*by_category, *by_brand).scalar_subquery()
+    categories = _json_list(
+        select(category.id, category.name, count).select_from(matches)
+        .join(category, category.id == matches.c.category_id)
+        .where(*by_brand)
+        .group_by(category.id, category.name)
+        .order_by(count.desc(), category.name)
+        .limit(FACET_SIZE),
+        ("id", "name", "count"), order_by=lambda sq: (sq.c["count"].desc(), sq.c.name))
+    brands = _json_list(
+        select(matches.c.brand, count)
+        .where(*by_category, matches.c.brand.is_not(None))
+        .group_by(matches.c.brand)
+        .order_by(count.desc(), matches.c.brand)
+        .limit(FACET_SIZE),
+        ("brand", "count"), order_by=lambda sq: (sq.c["count"].desc(), sq.c.brand))
+    matched, total, hits, categories, brands = (
+        await db.execute(select(matched, total, hits, categories, brands))).one()
+
+    ranks = {uuid.UUID(product_id): rank for product_id, rank in hits}
+    product = models.Product
+    rows = await db.execute(
+        select(search.product_id, search.name, search.description, product.brand, product.code, product.stock,
+               product.image_url, product.price, product.created_at, category.id, category.name)
+        .join(product, product.id == search.product_id)
+        .outerjoin(category, category.id == product.category_id)
+        .where(search.language == language, search.product_id.in_(ranks)))
+    items = sorted((_hit(row, ranks[row[0]]) for row in rows.all()), key=lambda hit: (-hit.rank, hit.id))
+
+    return read_models.SearchResult(
+        total=min(total, SEARCH_MAX_MATCHES),
+        total_exact=matched <= SEARCH_MAX_MATCHES,
+        items=items,
+        categories=[read_models.FacetCount(value, label, n) for value, label, n in categories],
+        brands=[read_models.FacetCount(value, value, n) for value, n in brands],
+    )
+
+
+async def suggest_products(db: AsyncSession, q: str, languages: Sequence[str] = DEFAULT_LANGUAGES, limit: int = 10):
+    """Product names starting with ``q`` or with a word starting with it, served by the trigram index."""
+    q = q.strip()
+    if not q:
+        return []
+    search = models.ProductSearch
+    result = await db.execute(
+        select(search.product_id.label("id"), search.name)
+        .where(search.language == search_language(languages),
+               or_(search.name.istartswith(q, autoescape=True), search.name.icontains(" " + q, autoescape=True)))
+        .order_by(func.similarity(search.name, q).desc(), search.name)
+        .limit(limit))
+    return result.all()
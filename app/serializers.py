@@ -0,0 +1,107 @@
+import os
+from typing import Callable, Dict, List, Optional
+
+from fastapi import Response
+from pydantic_core import to_json
+
+from . import schemas
+
+try:
+    import orjson  # optional dependency, encodes large bodies faster than pydantic_core
+except ImportError:
+    orjson = None
+
+# build JSON straight from read models and ORM objects instead of validating them against
+# the response schemas first; the encoders below produce the same documents
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() in ("1", "true", "yes")
+
+
+def dumps(value) -> bytes:
+    # str() covers types the encoders do not know, such as the UUID class asyncpg returns
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return to_json(value, fallback=str)
+
+
+def category_simple(category) -> Optional[dict]:
+    if category is None:
+        return None
+    return {"id": category.id, "name": category.name}
+
+
+def category(node) -> dict:
+    return {
+        "id": node.id,
+        "name": node.name,
+        "children": [category(child) for child in node.children],
+        "created_at": node.created_at,
+        "updated_at": node.updated_at,
+    }
+
+
+def product(p) -> dict:
+    return {
+        "id": p.id,
+        "name": p.name,
+        "description": p.description,
+        "brand": p.brand,
+        "code": p.code,
+        "stock": p.stock,
+        "image_url": p.image_url,
+        "category": category_simple(p.category),
+        "price": p.price,
+    }
+
+
+def basket_item(item) -> dict:
+    p = item.product
+    return {
+        "price": item.price,
+        "amount": item.amount,
+        "tax_rate": item.tax_rate,
+        "image_url": p.image_url if p is not None else None,
+        "name": p.name if p is not None else None,
+        "id": item.id,
+        "product_id": item.product_id,
+        "product": product(p) if p is not None else None,
+    }
+
+
+def basket(b) -> dict:
+    return {
+        "id": b.id,
+        "country": b.country,
+        "items": [basket_item(item) for item in b.items],
+        "total_price_exclusive": b.total_price_exclusive,
+        "total_price_inclusive": b.total_price_inclusive,
+        "tax": b.tax,
+    }
+
+
+def _many(encode: Callable) -> Callable:
+    return lambda values: [encode(value) for value in values]
+
+
+ENCODERS: Dict[object, Callable] = {
+    schemas.CategoryReadSimple: category_simple,
+    List[schemas.CategoryReadSimple]: _many(category_simple),
+    schemas.CategoryRead: category,
+    List[schemas.CategoryRead]: _many(category),
+    schemas.ProductRead: product,
+    List[schemas.ProductRead]: _many(product),
+    schemas.ShoppingBasketRead: basket,
+}
+
+
+def encode(schema, value) -> Optional[bytes]:
+    """JSON for ``value`` as ``schema`` without validating it, or None when the fast path is off or has no encoder."""
+    encoder = ENCODERS.get(schema) if FAST_SERIALIZATION else None
+    return dumps(encoder(value)) if encoder is not None else None
+
+
+def response(schema, value, status_code: int = 200, headers: Optional[Dict[str, str]] = None):
+    """``value`` rendered as ``schema`` on the fast path, otherwise ``value`` itself for the route's response_model."""
+    body = encode(schema, value)
+    if body is None:
+        return value
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
@@ -0,0 +1,42 @@
+import os
+
+from sqlalchemy import func, select
+
+from . import models
+
+DEFAULT_COUNTRY = os.getenv("DEFAULT_COUNTRY", "BE")
+DEFAULT_TAX_RATE = int(os.getenv("DEFAULT_TAX_RATE", "2100"))
+
+BASIS_POINTS = 10000
+
+
+def line_tax(price: int, amount: int, rate: int) -> int:
+    """VAT included in a tax-inclusive line, in cents, rounded half up."""
+    gross = price * amount * rate
+    divisor = BASIS_POINTS + rate
+    return (2 * gross + divisor) // (2 * divisor)
+
+
+def tax_rate_for(country, category_id):
+    """SQL expression for the rate that applies to a product category in a country.
+
+    The closest rule on the category or one of its ancestors wins, then the
+    country-wide rule, then DEFAULT_TAX_RATE.
+    """
+    rule = models.TaxRule
+    closure = models.CategoryClosure
+    by_category = (
+        select(rule.rate)
+        .join(closure, closure.ancestor_id == rule.category_id)
+        .where(rule.country == country, closure.descendant_id == category_id)
+        .order_by(closure.depth)
+        .limit(1)
+        .scalar_subquery()
+    )
+    by_country = (
+        select(rule.rate)
+        .where(rule.country == country, rule.category_id.is_(None))
+        .limit(1)
+        .scalar_subquery()
+    )
+    return func.coalesce(by_category, by_country, DEFAULT_TAX_RATE)
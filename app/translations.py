@@ -0,0 +1,225 @@
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Query, Request
+from sqlalchemy import any_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from . import models, notifications
+
+DEFAULT_LANGUAGE = "nl_BE"
+CMS_CHANNEL = "cms_changed"
+
+# tried in order after the languages a request asks for
+FALLBACK_LANGUAGES = tuple(
+    lang.strip() for lang in os.getenv("FALLBACK_LANGUAGES", f"{DEFAULT_LANGUAGE},nl,en").split(",") if lang.strip())
+MAX_LANGUAGES = 8
+
+CMS_CACHE_SIZE = int(os.getenv("CMS_CACHE_SIZE", "50000"))
+CMS_CACHE_TTL = float(os.getenv("CMS_CACHE_TTL", "300"))
+
+MISSING = object()
+
+
+class TranslationCache:
+    """Bounded LRU cache of cms values keyed by (code, language).
+
+    Absent translations are cached as ``None`` so repeated misses do not hit
+    the database either.
+    """
+
+    def __init__(self, maxsize: int = CMS_CACHE_SIZE, ttl: float = CMS_CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Optional[str]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, code: str, language: str):
+        key = (code, language)
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < self._clock():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, code: str, language: str, value: Optional[str]) -> None:
+        key = (code, language)
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, code: Optional[str] = None, language: Optional[str] = None) -> None:
+        if code is None and language is None:
+            self._entries.clear()
+        elif code is not None and language is not None:
+            self._entries.pop((code, language), None)
+        else:
+            for key in [k for k in self._entries if code in (None, k[0]) and language in (None, k[1])]:
+                del self._entries[key]
+
+    async def warm(self, db: AsyncSession, language: Optional[str] = None) -> int:
+        stmt = select(models.Cms.code, models.Cms.value, models.Cms.language).limit(self.maxsize)
+        if language is not None:
+            stmt = stmt.where(models.Cms.language == language)
+        result = await db.execute(stmt)
+        count = 0
+        for code, value, lang in result.all():
+            self.put(code, lang, value)
+            count += 1
+        return count
+
+    def _first(self, code: str, languages: Sequence[str]):
+        # the first translation along the chain, None when there is none, MISSING when the cache cannot tell
+        for language in languages:
+            value = self.get(code, language)
+            if value is MISSING or value is not None:
+                return value
+        return None
+
+    async def resolve(self, db: AsyncSession, codes: Iterable[Optional[str]],
+                      languages: Sequence[str]) -> Dict[str, Optional[str]]:
+        """Translate every code to the first language of ``languages`` that has a value.
+
+        Whatever the cache cannot answer is fetched with one query for all codes and languages.
+        """
+        if isinstance(languages, str):
+            languages = (languages,)
+        resolved: Dict[str, Optional[str]] = {}
+        misses = set()
+        for code in codes:
+            if code is None or code in resolved or code in misses:
+                continue
+            value = self._first(code, languages)
+            if value is MISSING:
+                misses.add(code)
+            else:
+                resolved[code] = value
+        if misses:
+            result = await db.execute(
+                select(models.Cms.code, models.Cms.language, models.Cms.value)
+                .where(models.Cms.code.in_(misses))
+                .where(models.Cms.language.in_(languages))
+            )
+            found = {(code, language): value for code, language, value in result.all()}
+            for code in misses:
+                for language in languages:
+                    if self.get(code, language) is MISSING:
+                        self.put(code, language, found.get((code, language)))
+                resolved[code] = self._first(code, languages)
+        return resolved
+
+
+translations = TranslationCache()
+
+_LANGUAGE_TAG = re.compile(r"^[A-Za-z]{1,8}(?:[-_][A-Za-z0-9]{1,8})*$")
+
+
+def normalize_language(tag: str) -> Optional[str]:
+    """``nl-be`` -> ``nl_BE``, the form languages are stored in; None for anything that is not a language tag."""
+    tag = tag.strip()
+    if not _LANGUAGE_TAG.match(tag):
+        return None
+    parts = re.split("[-_]", tag)
+    language = parts[0].lower()
+    region = parts[-1] if len(parts) > 1 and len(parts[-1]) == 2 else None
+    return f"{language}_{region.upper()}" if region else language
+
+
+def parse_accept_language(header: Optional[str]) -> List[str]:
+    """Languages from an Accept-Language header, most preferred first."""
+    weighted = []
+    for position, item in enumerate((header or "").split(",")):
+        tag, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        language = normalize_language(tag)
+        if language is not None and quality > 0:
+            weighted.append((-quality, position, language))
+    return [language for _, _, language in sorted(weighted)]
+
+
+def language_chain(preferred: Iterable[str] = ()) -> Tuple[str, ...]:
+    """Every preferred language followed by its base language, then FALLBACK_LANGUAGES."""
+    chain = []
+    for language in preferred:
+        for candidate in (language, language.split("_")[0]):
+            if candidate not in chain and len(chain) < MAX_LANGUAGES:
+                chain.append(candidate)
+    for language in FALLBACK_LANGUAGES:
+        if language not in chain:
+            chain.append(language)
+    return tuple(chain)
+
+
+DEFAULT_LANGUAGES = language_chain()
+
+
+def get_languages(request: Request, lang: Optional[str] = Query(
+        None, description="comma separated languages, overrides Accept-Language")) -> Tuple[str, ...]:
+    """Language fallback chain of a request, from ?lang= or the Accept-Language header."""
+    if lang:
+        preferred = [normalize_language(tag) for tag in lang.split(",")]
+    else:
+        preferred = parse_accept_language(request.headers.get("accept-language"))
+    return language_chain(language for language in preferred if language)
+
+
+def cms_value(code, chain):
+    """SQL scalar subquery for the value of cms ``code`` in the first language of the array ``chain`` that has one.
+
+    Statements that store translations use it with ``language_chain([language])``, the chain
+    a request for that language resolves through.
+    """
+    cms = aliased(models.Cms)
+    return (
+        select(cms.value)
+        .where(cms.code == code, cms.language == any_(chain))
+        .order_by(func.array_position(chain, cms.language))
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+async def notify_cms_changed(db: AsyncSession, code: Optional[str] = None, language: Optional[str] = None) -> None:
+    # NOTIFY is transactional, so other workers only see it once the write commits.
+    # Without a code and language every worker drops its whole cache.
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    payload = json.dumps({"code": code, "language": language})
+    await db.execute(select(func.pg_notify(CMS_CHANNEL, payload)))
+
+
+def _on_cms_notification(payload: str) -> None:
+    try:
+        data = json.loads(payload)
+        translations.invalidate(data.get("code"), data.get("language"))
+    except ValueError:
+        translations.invalidate()
+
+
+async def _on_listener_connect(conn) -> None:
+    # anything may have changed while we were not listening
+    translations.invalidate()
+
+
+notifications.subscribe(CMS_CHANNEL, _on_cms_notification, _on_listener_connect)
@@ -0,0 +1,84 @@
+"""Query count and latency of shopping basket reads per basket size.
+
+Runs against the database configured through DATABASE_URL and removes the
+rows it seeds afterwards::
+
+    python -m benchmarks.basket_hydration --sizes 1 10 50 200 --iterations 200
+"""
+import argparse
+import asyncio
+import uuid
+
+from sqlalchemy import delete
+
+from app import crud, models
+from app.database import engine, AsyncSessionLocal
+from app.translations import translations
+from .common import QueryCounter, summarize, timed
+
+
+async def seed(sizes):
+    run = uuid.uuid4().hex[:8]
+    async with AsyncSessionLocal() as db:
+        category = models.Category(name=f"bench-{run}")
+        products = [
+            models.Product(name=f"bench.{run}.{i}.name", description=f"bench.{run}.{i}.description",
+                           code=f"bench-{run}-{i}", price=100 + i, stock=1000, category=category)
+            for i in range(max(sizes))
+        ]
+        db.add_all(products)
+        db.add_all(models.Cms(code=p.name, value=f"Product {i}", language="nl_BE") for i, p in enumerate(products))
+        baskets = {}
+        for size in sizes:
+            basket = models.ShoppingBasket(items=[
+                models.ShoppingBasketItem(product=p, price=p.price, amount=1) for p in products[:size]
+            ])
+            db.add(basket)
+            baskets[size] = basket
+        await db.commit()
+        return category, products, {size: basket.id for size, basket in baskets.items()}
+
+
+async def cleanup(category, products, basket_ids):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.ShoppingBasketItem).where(
+            models.ShoppingBasketItem.shopping_basket_id.in_(basket_ids)))
+        await db.execute(delete(models.ShoppingBasket).where(models.ShoppingBasket.id.in_(basket_ids)))
+        await db.execute(delete(models.Cms).where(models.Cms.code.in_([p.name for p in products])))
+        await db.execute(delete(models.Product).where(models.Product.id.in_([p.id for p in products])))
+        await db.execute(delete(models.Category).where(models.Category.id == category.id))
+        await db.commit()
+
+
+async def measure(basket_id, iterations, warm_cache):
+    samples = []
+    with QueryCounter(engine) as counter:
+        for _ in range(iterations):
+            if not warm_cache:
+                translations.invalidate()
+            async with AsyncSessionLocal() as db:
+                with timed(samples):
+                    await crud.get_shopping_basket(db, basket_id)
+    return counter.count / iterations, summarize(samples)
+
+
+async def main(sizes, iterations):
+    category, products, basket_ids = await seed(sizes)
+    try:
+        print(f"{'items':>6} {'cache':>6} {'queries':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for size in sizes:
+            for warm_cache in (False, True):
+                queries, stats = await measure(basket_ids[size], iterations, warm_cache)
+                print(f"{size:>6} {'warm' if warm_cache else 'cold':>6} {queries:>8.1f} "
+                      f"{stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    finally:
+        await cleanup(category, products, list(basket_ids.values()))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.iterations))
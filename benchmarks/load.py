@@ -0,0 +1,214 @@
+"""Scenario driven load against the whole API, reporting throughput, latency and SQL statements per endpoint.
+
+Seed a disposable database with ``benchmarks.seed`` first. In-process mode serves the
+app through an ASGI transport against DATABASE_URL; with --base-url the scenarios go
+over HTTP to a running server instead. Either way the statements every request runs
+are read from its Server-Timing header::
+
+    python -m benchmarks.load --mix browse=6 basket=3 checkout=1 --users 32 --duration 60 --json run.json
+    python -m benchmarks.load --base-url http://localhost:8000 --users 128 --duration 60
+
+Pass --baseline with the JSON of an earlier run to exit non-zero when an endpoint now
+runs more statements, fails more often or got slower at p95 than --tolerance allows.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from .common import summarize
+from .scenarios import CATEGORY_API, PRODUCT_API, SCENARIOS, Catalog, Visit
+
+# the app reports the statements of every request in its Server-Timing header
+_SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+@dataclass
+class EndpointStats:
+    samples: List[float] = field(default_factory=list)
+    queries: List[int] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+
+
+class Recorder:
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+        self.recording = False
+        self.scenarios = Counter()
+
+    def record(self, name: str, seconds: float, status: int, queries: Optional[str]) -> None:
+        if not self.recording:
+            return
+        stats = self.endpoints[name]
+        stats.samples.append(seconds)
+        stats.statuses[status] += 1
+        # 409 is a basket running into sold out stock, which the scenarios expect under load
+        if status >= 500 or (status >= 400 and status != 409):
+            stats.errors += 1
+        if queries is not None:
+            stats.queries.append(int(queries))
+
+    def results(self, duration: float) -> dict:
+        endpoints = {}
+        for name, stats in sorted(self.endpoints.items()):
+            endpoints[name] = dict(
+                requests=len(stats.samples),
+                rps=round(len(stats.samples) / duration, 2),
+                error_rate=round(stats.errors / len(stats.samples), 4),
+                statuses={str(status): n for status, n in sorted(stats.statuses.items())},
+                queries=round(sum(stats.queries) / len(stats.queries), 2) if stats.queries else None,
+                **{k: round(v, 3) for k, v in summarize(stats.samples).items() if k.endswith("_ms")},
+            )
+        total = sum(e["requests"] for e in endpoints.values())
+        return dict(duration_s=round(duration, 2), requests=total, rps=round(total / duration, 2),
+                    scenarios=dict(self.scenarios), endpoints=endpoints)
+
+
+def client_request(client: httpx.AsyncClient, recorder: Recorder):
+    async def request(name, method, url, **kw):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kw)
+        queries = _SERVER_TIMING_QUERIES.search(response.headers.get("server-timing", ""))
+        recorder.record(name, time.perf_counter() - start, response.status_code, queries and queries.group(1))
+        return response
+
+    return request
+
+
+async def load_catalog(client: httpx.AsyncClient, size: int = 1000) -> Catalog:
+    categories = (await client.get(f"{CATEGORY_API}/categories")).json()
+    products = (await client.get(f"{PRODUCT_API}/products",
+                                 params={"limit": size, "fields": "id,name,brand"})).json()
+    words = sorted({word.lower() for p in products for word in re.findall(r"[^\W\d_]{4,}", p["name"] or "")})
+    catalog = Catalog(
+        categories=[c["id"] for c in categories],
+        products=[p["id"] for p in products],
+        brands=sorted({p["brand"] for p in products if p["brand"]}),
+        words=words,
+    )
+    if not (catalog.categories and catalog.products and catalog.words):
+        sys.exit("the catalog is empty, seed it with `python -m benchmarks.seed` first")
+    return catalog
+
+
+async def user(n: int, request, catalog: Catalog, mix: Dict[str, int], languages: List[str],
+               deadline: float, seed: int, recorder: Recorder) -> None:
+    rng = random.Random(seed * 1000 + n)
+    names, weights = list(mix), list(mix.values())
+    visit = Visit(request, catalog, rng, headers={"Accept-Language": rng.choice(languages)})
+    while time.perf_counter() < deadline:
+        scenario = rng.choices(names, weights)[0]
+        await SCENARIOS[scenario](visit)
+        if recorder.recording:
+            recorder.scenarios[scenario] += 1
+
+
+async def run(client: httpx.AsyncClient, args) -> dict:
+    catalog = await load_catalog(client)
+    recorder = Recorder()
+    request = client_request(client, recorder)
+    start = time.perf_counter()
+    deadline = start + args.warmup + args.duration
+    users = [asyncio.create_task(user(n, request, catalog, args.mix, args.languages, deadline, args.seed, recorder))
+             for n in range(args.users)]
+    await asyncio.sleep(args.warmup)
+    recorder.recording = True
+    measured = time.perf_counter()
+    await asyncio.gather(*users)
+    return recorder.results(time.perf_counter() - measured)
+
+
+def report(results: dict) -> None:
+    print(f"{results['requests']} requests in {results['duration_s']}s, {results['rps']} req/s, "
+          f"scenarios {results['scenarios']}")
+    print(f"{'endpoint':<20} {'requests':>8} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'queries':>8}")
+    for name, e in results["endpoints"].items():
+        queries = f"{e['queries']:.1f}" if e["queries"] is not None else "-"
+        print(f"{name:<20} {e['requests']:>8} {e['rps']:>8.1f} {e['error_rate']:>7.1%} {e['p50_ms']:>8.2f} "
+              f"{e['p95_ms']:>8.2f} {e['p99_ms']:>8.2f} {queries:>8}")
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    found = []
+    for name, before in baseline["endpoints"].items():
+        after = results["endpoints"].get(name)
+        if after is None:
+            continue
+        if before["queries"] is not None and after["queries"] is not None and after["queries"] > before["queries"] + 0.5:
+            found.append(f"{name}: {before['queries']} -> {after['queries']} queries per request")
+        if after["error_rate"] > before["error_rate"] + 0.01:
+            found.append(f"{name}: error rate {before['error_rate']:.1%} -> {after['error_rate']:.1%}")
+        # a millisecond of slack keeps noise on very fast endpoints from failing the run
+        if after["p95_ms"] > before["p95_ms"] * (1 + tolerance) + 1:
+            found.append(f"{name}: p95 {before['p95_ms']:.2f} -> {after['p95_ms']:.2f} ms")
+    return found
+
+
+def parse_mix(values: List[str]) -> Dict[str, int]:
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}, pick from {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+async def main(args) -> int:
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+            results = await run(client, args)
+    else:
+        from app.database import engines
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+                results = await run(client, args)
+        for engine in engines.values():
+            await engine.dispose()
+
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mix", nargs="+", default=["browse=6", "basket=3", "checkout=1"],
+                        help="scenario=weight pairs")
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--languages", nargs="+", default=["nl-BE", "fr-BE,fr;q=0.9", "en"],
+                        help="Accept-Language headers the users pick from")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", help="run over HTTP against a running server instead of in-process")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown against the baseline")
+    args = parser.parse_args()
+    try:
+        args.mix = parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,124 @@
+"""Hammer one product with concurrent add-to-basket requests and check that stock is never oversold.
+
+In-process mode calls crud directly with one session per request against DATABASE_URL.
+With --base-url the same scenario runs over HTTP against a running server::
+
+    python -m benchmarks.oversell --stock 100 --requests 2000 --concurrency 64
+    python -m benchmarks.oversell --base-url http://localhost:8000 --concurrency 128
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from app import crud, models, schemas
+from app.database import engine, AsyncSessionLocal
+from app.reservations import OutOfStockError
+from .common import summarize
+
+BASKET_API = "/api/shopping-basket/v1/shopping-baskets"
+
+
+async def seed(stock: int, baskets: int):
+    async with AsyncSessionLocal() as db:
+        product = models.Product(name="flash-sale", code=f"flash-{uuid.uuid4().hex[:8]}", price=999, stock=stock)
+        shopping_baskets = [models.ShoppingBasket() for _ in range(baskets)]
+        db.add(product)
+        db.add_all(shopping_baskets)
+        await db.commit()
+        return product.id, [b.id for b in shopping_baskets]
+
+
+async def check(product_id, basket_ids, stock: int, accepted: int) -> bool:
+    async with AsyncSessionLocal() as db:
+        remaining = await db.scalar(select(models.Product.stock).where(models.Product.id == product_id))
+        reserved = await db.scalar(select(func.coalesce(func.sum(models.StockReservation.amount), 0))
+                                   .where(models.StockReservation.product_id == product_id))
+        in_baskets = await db.scalar(select(func.coalesce(func.sum(models.ShoppingBasketItem.amount), 0))
+                                     .where(models.ShoppingBasketItem.product_id == product_id))
+    print(f"initial stock {stock}, accepted {accepted}, remaining {remaining}, reserved {reserved}, "
+          f"in baskets {in_baskets}")
+    return remaining >= 0 and accepted <= stock and remaining + reserved == stock and in_baskets == accepted
+
+
+async def cleanup(product_id, basket_ids):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.StockReservation).where(models.StockReservation.product_id == product_id))
+        await db.execute(delete(models.ShoppingBasketItem).where(models.ShoppingBasketItem.product_id == product_id))
+        await db.execute(delete(models.ShoppingBasket).where(models.ShoppingBasket.id.in_(basket_ids)))
+        await db.execute(delete(models.Product).where(models.Product.id == product_id))
+        await db.commit()
+
+
+def in_process_add(product_id):
+    async def add(basket_id) -> bool:
+        async with AsyncSessionLocal() as db:
+            try:
+                item = schemas.ShoppingBasketItemCreate(product_id=product_id)
+                return await crud.add_items_to_shopping_basket(db, basket_id, [item]) is not None
+            except OutOfStockError:
+                return False
+    return add
+
+
+def http_add(client, product_id):
+    async def add(basket_id) -> bool:
+        response = await client.post(f"{BASKET_API}/{basket_id}/items", json={"items": [{"product_id": str(product_id)}]})
+        if response.status_code == 409:
+            return False
+        response.raise_for_status()
+        return True
+    return add
+
+
+async def run(add, basket_ids, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, outcomes = [], {"accepted": 0, "rejected": 0, "failed": 0}
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                outcomes["accepted" if await add(basket_ids[i % len(basket_ids)]) else "rejected"] += 1
+            except Exception:
+                outcomes["failed"] += 1
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    stats = summarize(samples)
+    print(f"{requests} adds in {elapsed:.2f}s ({requests / elapsed:.0f}/s) with concurrency {concurrency}: "
+          f"{outcomes['accepted']} accepted, {outcomes['rejected']} out of stock, {outcomes['failed']} failed, "
+          f"p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+    return outcomes["accepted"]
+
+
+async def main(args) -> int:
+    product_id, basket_ids = await seed(args.stock, args.baskets)
+    try:
+        if args.base_url:
+            import httpx
+            async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+                accepted = await run(http_add(client, product_id), basket_ids, args.requests, args.concurrency)
+        else:
+            accepted = await run(in_process_add(product_id), basket_ids, args.requests, args.concurrency)
+        ok = await check(product_id, basket_ids, args.stock, accepted)
+        print("OK: no oversell" if ok else "FAILED: stock oversold or out of sync")
+        return 0 if ok else 1
+    finally:
+        await cleanup(product_id, basket_ids)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--baskets", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--base-url", help="run over HTTP against a running server instead of in-process")
+    sys.exit(asyncio.run(main(parser.parse_args())))
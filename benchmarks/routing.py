@@ -0,0 +1,139 @@
+"""Cost of the app itself per request: middleware, routing, validation and serialization.
+
+Sends catalog and basket requests one at a time through an ASGI transport and
+reports wall and CPU time per endpoint. With the memory repository there is no
+database, what is left is the app; with ``--repository sql`` the same requests run
+against DATABASE_URL (seeded with ``benchmarks.seed``), and the difference is what
+the database adds::
+
+    python -m benchmarks.routing --repository memory --products 2000 --iterations 500
+    python -m benchmarks.routing --repository sql --iterations 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+from app import repository, schemas
+from .common import summarize
+from .scenarios import BASKET_API, CATEGORY_API, PRODUCT_API, Catalog
+
+PAGE_SIZE = 24
+BATCH = 40
+# lines of the basket the basket requests work on
+BASKET_LINES = 10
+
+
+async def seed_memory(memory: repository.MemoryRepository, n_products: int, n_categories: int) -> None:
+    rng = random.Random(1)
+    categories = []
+    for i in range(n_categories):
+        parent = rng.choice(categories) if categories else None
+        category = await memory.create_category(schemas.CategoryCreate(name=f"category {i}"))
+        categories.append(category)
+        if parent is not None:
+            await memory.update_category(parent.id, schemas.CategoryUpdate(
+                children_ids=[child.id for child in parent.children] + [category.id]))
+    for i in range(n_products):
+        await memory.create_product(schemas.ProductCreate(
+            name=f"Product {i}", description=f"Description of product {i}", brand=f"brand {i % 30}",
+            code=f"P{i}", stock=1_000_000, image_url=f"https://img.example/{i}.jpg", price=100 + i,
+            category_id=rng.choice(categories).id))
+
+
+async def load_catalog(client: httpx.AsyncClient, size: int = 1000) -> Tuple[Catalog, List[str]]:
+    """The catalog to pick from and the products with stock to put in baskets."""
+    catalog = Catalog()
+    in_stock = []
+    catalog.categories = [c["id"] for c in (await client.get(f"{CATEGORY_API}/categories")).json()]
+    response = await client.get(f"{PRODUCT_API}/products", params={"limit": size})
+    for product in response.json():
+        catalog.products.append(product["id"])
+        if product["brand"]:
+            catalog.brands.append(product["brand"])
+        if product["stock"] >= BASKET_LINES:
+            in_stock.append(product["id"])
+    return catalog, in_stock
+
+
+def requests(client: httpx.AsyncClient, catalog: Catalog, rng: random.Random, basket: str, in_stock: List[str]):
+    """Endpoint name and a coroutine factory per request kind; the basket keeps its size from round to round."""
+    added = []
+
+    def add():
+        added.append(rng.choice(in_stock))
+        return client.post(f"{BASKET_API}/{basket}/items", json={"items": [{"product_id": added[-1]}]})
+
+    def remove():
+        return client.patch(f"{BASKET_API}/{basket}/items/{added.pop()}", json={"delta": -1})
+
+    return {
+        "product detail": lambda: client.get(f"{PRODUCT_API}/{rng.choice(catalog.products)}"),
+        "product list": lambda: client.get(f"{PRODUCT_API}/products",
+                                           params={"limit": PAGE_SIZE, "brand": rng.choice(catalog.brands)}),
+        "product batch": lambda: client.get(f"{PRODUCT_API}/batch", params=[
+            ("id", product) for product in rng.sample(catalog.products, min(BATCH, len(catalog.products)))]),
+        "category tree": lambda: client.get(f"{CATEGORY_API}/tree"),
+        "category products": lambda: client.get(f"{CATEGORY_API}/categories/{rng.choice(catalog.categories)}/products",
+                                                 params={"limit": PAGE_SIZE}),
+        "add items": add,
+        "basket": lambda: client.get(f"{BASKET_API}/{basket}"),
+        "change amount": remove,
+    }
+
+
+async def run(client: httpx.AsyncClient, iterations: int, seed: int) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    catalog, in_stock = await load_catalog(client)
+    lines = [{"product_id": product} for product in rng.sample(in_stock, BASKET_LINES)]
+    basket = (await client.post(BASKET_API, json={"items": lines})).json()["id"]
+    kinds = requests(client, catalog, rng, basket, in_stock)
+    wall: Dict[str, List[float]] = defaultdict(list)
+    cpu: Dict[str, List[float]] = defaultdict(list)
+    for _ in range(iterations):
+        for name, send in kinds.items():
+            start, start_cpu = time.perf_counter(), time.process_time()
+            response = await send()
+            wall[name].append(time.perf_counter() - start)
+            cpu[name].append(time.process_time() - start_cpu)
+            response.raise_for_status()
+    return {name: dict(wall=summarize(wall[name]), cpu=summarize(cpu[name])) for name in kinds}
+
+
+async def main(args) -> int:
+    from app.database import engines
+    from app.main import app
+
+    if args.repository == "memory":
+        repository.memory = repository.MemoryRepository()
+        await seed_memory(repository.memory, args.products, args.categories)
+    else:
+        repository.memory = None
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            results = await run(client, args.iterations, args.seed)
+    for engine in engines.values():
+        await engine.dispose()
+
+    print(f"{args.repository} repository, {args.iterations} requests per endpoint")
+    print(f"{'endpoint':<20} {'p50 ms':>8} {'p99 ms':>8} {'cpu p50':>8} {'cpu p99':>8}")
+    for name, stats in results.items():
+        print(f"{name:<20} {stats['wall']['p50_ms']:>8.2f} {stats['wall']['p99_ms']:>8.2f} "
+              f"{stats['cpu']['p50_ms']:>8.2f} {stats['cpu']['p99_ms']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repository", choices=["memory", "sql"], default="memory")
+    parser.add_argument("--products", type=int, default=2000, help="products seeded into the memory repository")
+    parser.add_argument("--categories", type=int, default=100, help="categories seeded into the memory repository")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    sys.exit(asyncio.run(main(parser.parse_args())))
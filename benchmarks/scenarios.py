@@ -0,0 +1,122 @@
+"""User journeys the load runner replays, each a coroutine taking a ``Visit``.
+
+Every request is recorded under the endpoint name given here, so results stay
+comparable between runs whatever ids the catalog holds.
+"""
+import random
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+CATEGORY_API = "/api/category/v1"
+PRODUCT_API = "/api/product/v1"
+SEARCH_API = "/api/search/v1"
+BASKET_API = "/api/shopping-basket/v1/shopping-baskets"
+ORDER_API = "/api/order/v1/orders"
+
+PAGE_SIZE = 24
+# products of a landing page, fetched with one multi-get
+FEATURED = 40
+
+
+@dataclass
+class Catalog:
+    """Ids and words sampled from the seeded catalog before the run starts."""
+    categories: List[str] = field(default_factory=list)
+    products: List[str] = field(default_factory=list)
+    brands: List[str] = field(default_factory=list)
+    words: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Visit:
+    """One virtual user going through a scenario; ``request`` records every call it makes."""
+    request: Callable[..., Awaitable]
+    catalog: Catalog
+    rng: random.Random
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    async def _send(self, name: str, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kw):
+        return await self.request(name, method, url, headers={**self.headers, **(headers or {})}, **kw)
+
+    async def get(self, name: str, url: str, **kw):
+        return await self._send(name, "GET", url, **kw)
+
+    async def post(self, name: str, url: str, **kw):
+        return await self._send(name, "POST", url, **kw)
+
+    async def put(self, name: str, url: str, **kw):
+        return await self._send(name, "PUT", url, **kw)
+
+    async def patch(self, name: str, url: str, **kw):
+        return await self._send(name, "PATCH", url, **kw)
+
+    async def delete(self, name: str, url: str, **kw):
+        return await self._send(name, "DELETE", url, **kw)
+
+
+async def browse(visit: Visit) -> None:
+    """Category navigation with paging, product pages, a page of featured products and a search with suggestions."""
+    rng, catalog = visit.rng, visit.catalog
+    await visit.get("category tree", f"{CATEGORY_API}/tree")
+    category = rng.choice(catalog.categories)
+    response = await visit.get("category products", f"{CATEGORY_API}/categories/{category}/products",
+                               params={"limit": PAGE_SIZE})
+    cursor = response.headers.get("x-next-cursor")
+    if cursor:
+        await visit.get("category products", f"{CATEGORY_API}/categories/{category}/products",
+                        params={"limit": PAGE_SIZE, "cursor": cursor})
+    await visit.get("product list", f"{PRODUCT_API}/products",
+                    params={"limit": PAGE_SIZE, "brand": rng.choice(catalog.brands)})
+    for product in rng.sample(catalog.products, 3):
+        await visit.get("product detail", f"{PRODUCT_API}/{product}")
+    featured = rng.sample(catalog.products, min(FEATURED, len(catalog.products)))
+    await visit.get("product batch", f"{PRODUCT_API}/batch", params=[("id", product) for product in featured])
+    word = rng.choice(catalog.words)
+    await visit.get("suggest", f"{SEARCH_API}/suggest", params={"q": word[:3]})
+    await visit.get("search", f"{SEARCH_API}/products", params={"q": word})
+
+
+async def build_basket(visit: Visit) -> Optional[str]:
+    """A new basket filled one product at a time, then viewed."""
+    rng, catalog = visit.rng, visit.catalog
+    response = await visit.post("create basket", BASKET_API, json={})
+    if response.status_code != 201:
+        return None
+    basket_id = response.json()["id"]
+    for product in rng.sample(catalog.products, rng.randint(1, 5)):
+        await visit.get("product detail", f"{PRODUCT_API}/{product}")
+        await visit.post("add items", f"{BASKET_API}/{basket_id}/items",
+                         json={"items": [{"product_id": product, "amount": rng.randint(1, 3)}]})
+    await visit.get("basket", f"{BASKET_API}/{basket_id}")
+    return basket_id
+
+
+async def checkout(visit: Visit) -> None:
+    """Reviewing a basket, amounts changed, a line removed and totals checked, then placing the order."""
+    basket_id = await build_basket(visit)
+    if basket_id is None:
+        return
+    basket = (await visit.get("basket", f"{BASKET_API}/{basket_id}")).json()
+    items = basket.get("items", [])
+    if items:
+        first = items[0]
+        await visit.put("set amount", f"{BASKET_API}/{basket_id}/items/{first['product_id']}",
+                        json={"amount": first["amount"] + 1})
+        await visit.patch("change amount", f"{BASKET_API}/{basket_id}/items/{first['product_id']}",
+                          json={"delta": -1})
+    if len(items) > 1:
+        await visit.delete("remove item", f"{BASKET_API}/items/{items[-1]['id']}")
+    await visit.get("basket summary", f"{BASKET_API}/{basket_id}/summary")
+    await visit.get("basket", f"{BASKET_API}/{basket_id}")
+    key = f"{basket_id}-{visit.rng.getrandbits(32):08x}"
+    response = await visit.post("place order", ORDER_API, json={"shopping_basket_id": basket_id},
+                                headers={"Idempotency-Key": key})
+    if response.status_code == 201:
+        await visit.get("order", f"{ORDER_API}/{response.json()['id']}")
+
+
+SCENARIOS: Dict[str, Callable[[Visit], Awaitable]] = {
+    "browse": browse,
+    "basket": build_basket,
+    "checkout": checkout,
+}
@@ -0,0 +1,113 @@
+"""CPU time to turn products, categories and baskets into JSON bodies, per serialization path.
+
+No database is needed, the read models are built in memory::
+
+    python -m benchmarks.serialization --products 1000 --categories 500 --basket-items 200 --iterations 50
+
+Paths compared:
+
+* ``response_model``: what FastAPI does with a returned value, validate against the
+  route's response_model, dump to Python, then ``json.dumps``
+* ``pydantic``: one validation and a JSON dump through a TypeAdapter (``http_cache.render``)
+* ``fast``: the encoders in ``app.serializers``, no validation (FAST_SERIALIZATION=true)
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app import read_models, schemas, serializers
+from app.http_cache import _adapter
+from .common import summarize
+
+
+def products(n):
+    now = datetime.now()
+    categories = [read_models.CategoryView(uuid.uuid4(), f"category {i}") for i in range(20)]
+    return [
+        read_models.ProductView(uuid.uuid4(), f"Product {i}", f"Description of product {i}", f"brand {i % 30}",
+                                f"P{i}", i % 100, f"https://img.example/{i}.jpg", 100 + i, categories[i % 20], now)
+        for i in range(n)
+    ]
+
+
+def categories(n, fanout=10):
+    now = datetime.now()
+    nodes = [read_models.CategoryNode(uuid.uuid4(), f"category {i}", now, now) for i in range(n)]
+    for i, node in enumerate(nodes[1:], 1):
+        nodes[(i - 1) // fanout].children.append(node)
+    return nodes
+
+
+def basket(n):
+    items = [read_models.ShoppingBasketItemView(uuid.uuid4(), p.id, p.price, 1 + i % 3, 2100, p)
+             for i, p in enumerate(products(n))]
+    return read_models.ShoppingBasketView(uuid.uuid4(), "BE", len(items), sum(i.amount for i in items), 0, 0, 0,
+                                          items=items)
+
+
+def response_model(schema):
+    field = create_model_field("response", schema, mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def run(value):
+        content = loop.run_until_complete(serialize_response(field=field, response_content=value))
+        return JSONResponse(content).body
+
+    return run
+
+
+def pydantic(schema):
+    adapter = _adapter(schema)
+    return lambda value: adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+
+
+def fast(schema):
+    encoder = serializers.ENCODERS[schema]
+    return lambda value: serializers.dumps(encoder(value))
+
+
+PATHS = {"response_model": response_model, "pydantic": pydantic, "fast": fast}
+
+
+def measure(run, value, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run(value)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main(n_products, n_categories, n_items, iterations):
+    cases = [
+        (f"{n_products} products", List[schemas.ProductRead], products(n_products)),
+        (f"{n_categories} categories", List[schemas.CategoryRead], categories(n_categories)[:1]),
+        (f"basket of {n_items}", schemas.ShoppingBasketRead, basket(n_items)),
+    ]
+    encoder = "orjson" if serializers.orjson is not None else "pydantic_core"
+    print(f"fast path encodes with {encoder}")
+    print(f"{'payload':>18} {'path':>15} {'p50 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    for label, schema, value in cases:
+        baseline = None
+        for name, path in PATHS.items():
+            stats = measure(path(schema), value, iterations)
+            baseline = baseline or stats["p50_ms"]
+            print(f"{label:>18} {name:>15} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                  f"{baseline / stats['p50_ms']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--basket-items", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    main(args.products, args.categories, args.basket_items, args.iterations)
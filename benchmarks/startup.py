@@ -0,0 +1,78 @@
+"""Cold start to ready: how long `run.py serve` takes until a worker answers, and the first requests after.
+
+Starts the server as a separate process against DATABASE_URL, polls the readiness
+endpoint and then times a few catalog requests, the ones warming up is meant to make
+fast from the start::
+
+    python -m benchmarks.startup --workers 2 --runs 3
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .common import summarize
+
+READY = "/api/ops/v1/ready"
+FIRST_REQUESTS = ["/api/product/v1/products?limit=20", "/api/category/v1/categories", "/api/category/v1/tree"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_once(workers: int, timeout: float) -> dict:
+    port = _free_port()
+    command = [sys.executable, "run.py", "serve", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--no-migrate"]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError(f"server not ready after {timeout}s")
+                try:
+                    response = client.get(READY)
+                    if response.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+            ready = time.perf_counter() - start
+            reported = response.json()
+            first = []
+            for path in FIRST_REQUESTS:
+                request_start = time.perf_counter()
+                client.get(path).raise_for_status()
+                first.append(time.perf_counter() - request_start)
+    finally:
+        server.terminate()
+        server.wait(30)
+    return dict(ready_s=ready, worker_startup_s=reported["startup_seconds"], warmup_s=reported["warmup_seconds"],
+                first_requests=first)
+
+
+def main(args) -> int:
+    runs = [start_once(args.workers, args.timeout) for _ in range(args.runs)]
+    for i, run in enumerate(runs, 1):
+        print(f"run {i}: ready after {run['ready_s']:.2f}s (worker reports {run['worker_startup_s']:.2f}s, "
+              f"{run['warmup_s']:.2f}s warming up)")
+    first = summarize([t for run in runs for t in run["first_requests"]])
+    print(f"first requests after ready: p50 {first['p50_ms']:.1f} ms, p99 {first['p99_ms']:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the server")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,158 @@
+"""initial schema
+
+The tables as create_all used to make them at startup. A database created that way
+is adopted with `alembic stamp 0001` followed by `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 14:58:48.999376
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # trigram index on product_search.name
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_table('cache_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('categories',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('cms',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('code', sa.String(), nullable=True),
+    sa.Column('value', sa.String(), nullable=True),
+    sa.Column('language', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code', 'language', name='uq_cms_code_language')
+    )
+    op.create_table('shopping_basket',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('country', sa.String(), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('total_price_inclusive', sa.Integer(), nullable=False),
+    sa.Column('total_price_exclusive', sa.Integer(), nullable=False),
+    sa.Column('tax', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('category_children',
+    sa.Column('parent_id', sa.UUID(), nullable=False),
+    sa.Column('child_id', sa.UUID(), nullable=False),
+    sa.ForeignKeyConstraint(['child_id'], ['categories.id'], ),
+    sa.ForeignKeyConstraint(['parent_id'], ['categories.id'], ),
+    sa.PrimaryKeyConstraint('parent_id', 'child_id')
+    )
+    op.create_table('category_closure',
+    sa.Column('ancestor_id', sa.UUID(), nullable=False),
+    sa.Column('descendant_id', sa.UUID(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_category_closure_descendant_id', 'category_closure', ['descendant_id', 'depth'], unique=False)
+    op.create_table('products',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('brand', sa.String(), nullable=True),
+    sa.Column('code', sa.String(), nullable=True),
+    sa.Column('stock', sa.Integer(), nullable=True),
+    sa.Column('image_url', sa.String(), nullable=True),
+    sa.Column('category_id', sa.UUID(), nullable=True),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code', name='uq_products_code')
+    )
+    op.create_table('tax_rules',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('country', sa.String(), nullable=False),
+    sa.Column('category_id', sa.UUID(), nullable=True),
+    sa.Column('rate', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('country', 'category_id', name='uq_tax_rules_country_category', postgresql_nulls_not_distinct=True)
+    )
+    op.create_table('product_search',
+    sa.Column('product_id', sa.UUID(), nullable=False),
+    sa.Column('language', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('brand', sa.String(), nullable=True),
+    sa.Column('category_id', sa.UUID(), nullable=True),
+    sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'language')
+    )
+    op.create_index('ix_product_search_document', 'product_search', ['document'], unique=False, postgresql_using='gin')
+    op.create_index('ix_product_search_language_brand', 'product_search', ['language', 'brand'], unique=False)
+    op.create_index('ix_product_search_language_category', 'product_search', ['language', 'category_id'], unique=False)
+    op.create_index('ix_product_search_name_trgm', 'product_search', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_table('shopping_basket_items',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('shopping_basket_id', sa.UUID(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('tax_rate', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.UUID(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['shopping_basket_id'], ['shopping_basket.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('shopping_basket_id', 'product_id', name='uq_shopping_basket_items_basket_product')
+    )
+    op.create_table('stock_reservations',
+    sa.Column('shopping_basket_id', sa.UUID(), nullable=False),
+    sa.Column('product_id', sa.UUID(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['shopping_basket_id'], ['shopping_basket.id'], ),
+    sa.PrimaryKeyConstraint('shopping_basket_id', 'product_id')
+    )
+    op.create_index('ix_stock_reservations_expires_at', 'stock_reservations', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_stock_reservations_expires_at', table_name='stock_reservations')
+    op.drop_table('stock_reservations')
+    op.drop_table('shopping_basket_items')
+    op.drop_index('ix_product_search_name_trgm', table_name='product_search', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.drop_index('ix_product_search_language_category', table_name='product_search')
+    op.drop_index('ix_product_search_language_brand', table_name='product_search')
+    op.drop_index('ix_product_search_document', table_name='product_search', postgresql_using='gin')
+    op.drop_table('product_search')
+    op.drop_table('tax_rules')
+    op.drop_table('products')
+    op.drop_index('ix_category_closure_descendant_id', table_name='category_closure')
+    op.drop_table('category_closure')
+    op.drop_table('category_children')
+    op.drop_table('shopping_basket')
+    op.drop_table('cms')
+    op.drop_table('categories')
+    op.drop_table('cache_versions')
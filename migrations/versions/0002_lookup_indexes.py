@@ -0,0 +1,39 @@
+"""lookup indexes
+
+Indexes behind the foreign key lookups, the reverse category edge and the product
+listing order, so none of the crud queries scan products, basket items or
+reservations. Built concurrently, writes keep going while they are created.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 14:59:14.292159
+"""
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_category_children_child_id', 'category_children', ['child_id'], {}),
+    ('ix_products_category_id', 'products', ['category_id'], {}),
+    ('ix_products_created_at_id', 'products', ['created_at', 'id'], {}),
+    ('ix_products_name', 'products', ['name'], {'postgresql_using': 'hash'}),
+    ('ix_products_description', 'products', ['description'], {'postgresql_using': 'hash'}),
+    ('ix_shopping_basket_items_product_id', 'shopping_basket_items', ['product_id'], {}),
+    ('ix_stock_reservations_product_id', 'stock_reservations', ['product_id'], {}),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kw)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,28 @@
+"""shopping basket updated_at index
+
+Lets the stale basket purge find the oldest baskets without scanning the table.
+Built concurrently like the other lookup indexes.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 18:02:41.518320
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_shopping_basket_updated_at', 'shopping_basket', ['updated_at'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_shopping_basket_updated_at', table_name='shopping_basket',
+                      postgresql_concurrently=True, if_exists=True)
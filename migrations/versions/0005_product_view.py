@@ -0,0 +1,45 @@
+"""product view
+
+The per language product read model. Created empty, the application fills it for
+PRODUCT_VIEW_LANGUAGES on startup, like the search documents.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 15:27:15.957261
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('product_view',
+    sa.Column('product_id', sa.UUID(), nullable=False),
+    sa.Column('language', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('brand', sa.String(), nullable=True),
+    sa.Column('code', sa.String(), nullable=True),
+    sa.Column('image_url', sa.String(), nullable=True),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('category_id', sa.UUID(), nullable=True),
+    sa.Column('category_name', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'language')
+    )
+    op.create_index('ix_product_view_category_id', 'product_view', ['category_id', 'language'], unique=False)
+    op.create_index('ix_product_view_code', 'product_view', ['code'], unique=False)
+    op.create_index('ix_product_view_language_created_at', 'product_view', ['language', 'created_at', 'product_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_view_language_created_at', table_name='product_view')
+    op.drop_index('ix_product_view_code', table_name='product_view')
+    op.drop_index('ix_product_view_category_id', table_name='product_view')
+    op.drop_table('product_view')
@@ -0,0 +1,37 @@
+"""change log
+
+The catalog change feed. Starts empty: consumers take a full copy first and follow
+the feed from the cursor they got before copying.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 15:32:07.831291
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('change_log',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('txid', sa.BigInteger(), server_default=sa.text('(pg_current_xact_id()::text)::bigint'), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('entity_id', sa.UUID(), nullable=False),
+    sa.Column('op', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_log_created_at', 'change_log', ['created_at'], unique=False)
+    op.create_index('ix_change_log_txid_id', 'change_log', ['txid', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_change_log_txid_id', table_name='change_log')
+    op.drop_index('ix_change_log_created_at', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import copy
+import os
+import sys
+import time
+
+import uvicorn
+
+from app import bulk, database, lifecycle
+from app.database import engine, AsyncSessionLocal
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+IMPORTS = {
+    "products": bulk.import_products,
+    "categories": bulk.import_categories,
+    "translations": bulk.import_translations,
+}
+
+
+async def _read_lines(path: str):
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def _print_progress(report: bulk.ImportReport) -> None:
+    print(f"\r{report.processed} rows read, {report.written} written, {len(report.errors)} errors",
+          end="", file=sys.stderr, flush=True)
+
+
+async def import_file(table: str, path: str, fmt: str, batch_size: int) -> int:
+    async with AsyncSessionLocal() as db:
+        report = await IMPORTS[table](db, _read_lines(path), fmt, batch_size=batch_size, on_progress=_print_progress)
+    await engine.dispose()
+    print(file=sys.stderr)
+    for error in report.errors:
+        print(f"line {error.line}: {error.error}", file=sys.stderr)
+    return 1 if report.errors else 0
+
+
+async def export_table(table: str, path: str, fmt: str) -> int:
+    with (sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")) as out:
+        async with AsyncSessionLocal() as db:
+            async for chunk in bulk.export_rows(db, table, fmt):
+                out.write(chunk)
+    await engine.dispose()
+    return 0
+
+
+async def migrate() -> int:
+    start = time.perf_counter()
+    await lifecycle.prepare()
+    await engine.dispose()
+    print(f"database ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def _log_config() -> dict:
+    # uvicorn's logging plus the app's loggers, applied again in every worker process
+    config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    config["loggers"]["app"] = {"handlers": ["default"], "level": LOG_LEVEL, "propagate": False}
+    return config
+
+
+def serve(host: str, port: int, workers: int, prepare: bool, graceful_timeout: int) -> int:
+    if prepare:
+        asyncio.run(migrate())
+    # the database is ready, workers go straight to warming up; spawned ones read the environment
+    os.environ["DB_MIGRATE_ON_STARTUP"] = "false"
+    database.MIGRATE_ON_STARTUP = False
+    uvicorn.run("app.main:app", host=host, port=port, workers=workers, log_config=_log_config(),
+                timeout_graceful_shutdown=graceful_timeout, proxy_headers=True)
+    return 0
+
+
+def _format(path: str, fmt: str) -> str:
+    return fmt or ("csv" if path.endswith(".csv") else "ndjson")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="My Shop API tooling")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="upsert rows from a CSV or NDJSON file")
+    import_parser.add_argument("table", choices=sorted(IMPORTS))
+    import_parser.add_argument("path", help="input file, - for stdin")
+    import_parser.add_argument("--format", choices=bulk.FORMATS)
+    import_parser.add_argument("--batch-size", type=int, default=bulk.BATCH_SIZE)
+
+    export_parser = commands.add_parser("export", help="stream a table as CSV or NDJSON")
+    export_parser.add_argument("table", choices=sorted(bulk.EXPORTS))
+    export_parser.add_argument("path", nargs="?", default="-", help="output file, - for stdout")
+    export_parser.add_argument("--format", choices=bulk.FORMATS)
+
+    serve_parser = commands.add_parser("serve", help="run the API with a uvicorn worker per core")
+    serve_parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    serve_parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    serve_parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    serve_parser.add_argument("--no-migrate", dest="prepare", action="store_false",
+                              help="skip migrations, e.g. when the deploy ran `run.py migrate` already")
+    serve_parser.add_argument("--graceful-timeout", type=int, default=30,
+                              help="seconds requests in flight get to finish on shutdown")
+
+    commands.add_parser("migrate", help="apply migrations and build the derived tables that are missing")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        return serve(args.host, args.port, args.workers, args.prepare, args.graceful_timeout)
+    if args.command == "migrate":
+        return asyncio.run(migrate())
+    if args.command == "import":
+        return asyncio.run(import_file(args.table, args.path, _format(args.path, args.format), args.batch_size))
+    return asyncio.run(export_table(args.table, args.path, _format(args.path, args.format)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
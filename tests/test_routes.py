@@ -1,10 +1,147 @@
+import asyncio
+import uuid
+
+import pytest
 from fastapi.testclient import TestClient
-from run import app
+
+from app import http_cache, repository
+from app.main import app
 
 client = TestClient(app)
 
-def test_create_item():
-    response = client.post("/api/ping")
-    assert response.status_code == 200
-    assert response.json()["name"] == "name"
-    assert response.json()["status"] == "ok"
+CATEGORIES = "/api/category/v1/categories"
+PRODUCTS = "/api/product/v1"
+BASKETS = "/api/shopping-basket/v1/shopping-baskets"
+
+
+@pytest.fixture(autouse=True)
+def memory_repository(monkeypatch):
+    monkeypatch.setattr(repository, "memory", repository.MemoryRepository())
+    # cached responses of an earlier test carry the same versions as this one's
+    asyncio.run(http_cache.responses.backend.clear())
+
+
+def create_product(**fields):
+    response = client.post(f"{PRODUCTS}/products", json={"name": "Product", "price": 100, "stock": 10, **fields})
+    assert response.status_code == 201
+    return response.json()
+
+
+def test_products_are_listed_in_pages_and_filtered_by_category_subtree():
+    shoes = client.post(CATEGORIES, json={"name": "Shoes"}).json()
+    clothes = client.post(CATEGORIES, json={"name": "Clothes", "children_ids": [shoes["id"]]}).json()
+    assert [c["name"] for c in clothes["children"]] == ["Shoes"]
+    for i in range(3):
+        create_product(name=f"Shoe {i}", code=f"S{i}", category_id=shoes["id"])
+    create_product(name="Hat", code="H1")
+
+    first = client.get(f"{PRODUCTS}/products", params={"limit": 2})
+    assert [p["name"] for p in first.json()] == ["Shoe 0", "Shoe 1"]
+    rest = client.get(f"{PRODUCTS}/products", params={"limit": 2, "cursor": first.headers["x-next-cursor"]})
+    assert [p["name"] for p in rest.json()] == ["Shoe 2", "Hat"]
+    assert "x-next-cursor" not in rest.headers
+
+    subtree = client.get(f"{CATEGORIES}/{clothes['id']}/products").json()
+    assert [p["name"] for p in subtree] == ["Shoe 0", "Shoe 1", "Shoe 2"]
+    assert subtree[0]["category"] == {"id": shoes["id"], "name": "Shoes"}
+    ancestors = client.get(f"{CATEGORIES}/{shoes['id']}/ancestors").json()
+    assert [c["name"] for c in ancestors] == ["Clothes", "Shoes"]
+    assert [c["name"] for c in client.get("/api/category/v1/tree").json()] == ["Clothes"]
+
+
+def test_cached_listings_follow_writes():
+    product = create_product(name="Lamp")
+    listing = client.get(f"{PRODUCTS}/products")
+    assert client.get(f"{PRODUCTS}/products", headers={"If-None-Match": listing.headers["etag"]}).status_code == 304
+
+    update = {"name": "Desk lamp", "description": None, "brand": None, "code": None, "stock": 10,
+              "image_url": None, "category_id": None, "price": 100}
+    assert client.put(f"{PRODUCTS}/{product['id']}", json=update).status_code == 200
+    changed = client.get(f"{PRODUCTS}/products", headers={"If-None-Match": listing.headers["etag"]})
+    assert changed.status_code == 200
+    assert [p["name"] for p in changed.json()] == ["Desk lamp"]
+
+
+def test_cached_products_follow_stock_taken_by_baskets():
+    product = create_product(name="Lamp")
+    listing = client.get(f"{PRODUCTS}/products")
+    assert listing.headers["cache-control"] == f"max-age={http_cache.HTTP_CACHE_MAX_AGE:g}"
+    assert client.get(CATEGORIES).headers["cache-control"] == "no-cache"
+
+    items = [{"product_id": product["id"], "amount": 3}]
+    assert client.post(BASKETS, json={"country": "BE", "items": items}).status_code == 201
+    changed = client.get(f"{PRODUCTS}/products", headers={"If-None-Match": listing.headers["etag"]})
+    assert changed.status_code == 200
+    assert changed.json()[0]["stock"] == 7
+
+
+def test_product_codes_are_unique_and_categories_must_exist():
+    lamp = create_product(name="Lamp", code="L1")
+    duplicate = client.post(f"{PRODUCTS}/products", json={"name": "Other lamp", "price": 100, "code": "L1"})
+    assert duplicate.status_code == 409
+    unknown = client.post(f"{PRODUCTS}/products", json={"name": "Chair", "price": 100,
+                                                         "category_id": str(uuid.uuid4())})
+    assert unknown.status_code == 422
+
+    other = create_product(name="Desk", code="D1")
+    update = {"name": "Desk", "description": None, "brand": None, "code": "L1", "stock": 10,
+              "image_url": None, "category_id": None, "price": 100}
+    assert client.put(f"{PRODUCTS}/{other['id']}", json=update).status_code == 409
+    assert client.put(f"{PRODUCTS}/{lamp['id']}", json={**update, "name": "Lamp"}).status_code == 200
+
+
+def test_products_are_translated_along_the_language_chain():
+    product = create_product(name="product.lamp", code="L1")
+    client.post("/api/cms/v1/translations", json={"code": "product.lamp", "value": "Lamp", "language": "en"})
+    client.post("/api/cms/v1/translations", json={"code": "product.lamp", "value": "Lampe", "language": "fr"})
+
+    assert client.get(f"{PRODUCTS}/{product['id']}", headers={"Accept-Language": "fr-BE"}).json()["name"] == "Lampe"
+    assert client.get(f"{PRODUCTS}/{product['id']}", headers={"Accept-Language": "de"}).json()["name"] == "Lamp"
+    batch = client.get(f"{PRODUCTS}/batch", params={"code": ["L1", "missing"], "lang": "fr"}).json()
+    assert [p["name"] for p in batch] == ["Lampe"]
+
+
+def test_a_category_cannot_become_its_own_descendant():
+    parent = client.post(CATEGORIES, json={"name": "Parent"}).json()
+    child = client.post(CATEGORIES, json={"name": "Child", "children_ids": []}).json()
+    assert client.put(f"{CATEGORIES}/{parent['id']}", json={"children_ids": [child["id"]]}).status_code == 200
+    response = client.put(f"{CATEGORIES}/{child['id']}", json={"children_ids": [parent["id"]]})
+    assert response.status_code == 409
+
+    assert client.delete(f"{CATEGORIES}/{child['id']}").status_code == 204
+    assert client.get(f"{CATEGORIES}/{parent['id']}").json()["children"] == []
+
+
+def test_basket_totals_tax_and_stock():
+    food = client.post(CATEGORIES, json={"name": "Food"}).json()
+    client.post("/api/tax/v1/rules", json={"country": "BE", "category_id": food["id"], "rate": 600})
+    bread = create_product(name="Bread", price=212, stock=5, category_id=food["id"])
+    chair = create_product(name="Chair", price=12100, stock=1)
+
+    basket = client.post(BASKETS, json={"items": [{"product_id": bread["id"], "amount": 2}]}).json()
+    totals = client.post(f"{BASKETS}/{basket['id']}/items", json={"items": [{"product_id": chair["id"]}]}).json()
+    assert totals["quantity"] == 3
+    assert totals["total_price_inclusive"] == 2 * 212 + 12100
+    # 6% on the bread, the default 21% on the chair
+    assert totals["tax"] == 24 + 2100
+
+    out_of_stock = client.patch(f"{BASKETS}/{basket['id']}/items/{chair['id']}", json={"delta": 1})
+    assert out_of_stock.status_code == 409
+    assert out_of_stock.json()["product_id"] == chair["id"]
+    assert client.get(f"{PRODUCTS}/{chair['id']}").json()["stock"] == 0
+
+    items = client.get(f"{BASKETS}/{basket['id']}").json()["items"]
+    chair_line = next(item for item in items if item["product_id"] == chair["id"])
+    assert chair_line["name"] == "Chair"
+    assert client.delete(f"{BASKETS}/items/{chair_line['id']}").status_code == 204
+    # the chair's stock came back with its line
+    assert client.patch(f"{BASKETS}/{basket['id']}/items/{chair['id']}", json={"delta": 1}).status_code == 200
+    assert client.put(f"{BASKETS}/{basket['id']}/items/{chair['id']}", json={"amount": 0}).status_code == 200
+    assert client.get(f"{BASKETS}/{basket['id']}/summary").json()["item_count"] == 1
+    assert client.get(f"{BASKETS}/{uuid.uuid4()}/summary").status_code == 404
+
+
+def test_request_metrics_are_labelled_with_route_templates():
+    assert client.get(f"{BASKETS}/{uuid.uuid4()}").status_code == 404
+    metrics = client.get("/api/ops/v1/metrics").text
+    assert f'route="{BASKETS}/{{basket_id}}",status="404"' in metrics
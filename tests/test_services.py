@@ -0,0 +1,508 @@
+import asyncio
+import csv
+import io
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from app.bulk import ImportReport, _acyclic_edges, iter_lines, iter_records
+from app import admission, basket_store, changes, http_cache, loaders, models, orders, product_view, read_models, schemas, serializers
+from app.basket_store import BasketConflictError, BasketStore, MemoryBasketBackend, StoredBasket
+from app.crud import _category_tree, requested_amounts
+from app.http_cache import CachedResponse, MemoryBackend, ResponseCache, _adapter
+from app.instrumentation import fingerprint, normalize, route_template
+from app.metrics import PoolMetrics, RouteMetrics, _histogram, _labels
+from app.pagination import encode_cursor, decode_product_cursor
+from app.reservations import OutOfStockError
+from app.search import text_search_config, tsquery_text
+from app.tax import line_tax
+from app.translations import (
+    DEFAULT_LANGUAGES, FALLBACK_LANGUAGES, MISSING, TranslationCache, language_chain, normalize_language,
+    parse_accept_language,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_translation_cache_evicts_least_recently_used():
+    cache = TranslationCache(maxsize=2, ttl=60)
+    cache.put("a", "nl_BE", "A")
+    cache.put("b", "nl_BE", "B")
+    assert cache.get("a", "nl_BE") == "A"
+    cache.put("c", "nl_BE", "C")
+    assert cache.get("b", "nl_BE") is MISSING
+    assert cache.get("a", "nl_BE") == "A"
+    assert cache.get("c", "nl_BE") == "C"
+
+
+def test_translation_cache_expires_entries():
+    clock = FakeClock()
+    cache = TranslationCache(maxsize=10, ttl=5, clock=clock)
+    cache.put("a", "nl_BE", None)
+    assert cache.get("a", "nl_BE") is None
+    clock.now = 6
+    assert cache.get("a", "nl_BE") is MISSING
+    assert len(cache) == 0
+
+
+def test_translation_cache_invalidation():
+    cache = TranslationCache(maxsize=10, ttl=60)
+    cache.put("a", "nl_BE", "A")
+    cache.put("a", "fr_BE", "A fr")
+    cache.put("b", "nl_BE", "B")
+    cache.invalidate("a", "nl_BE")
+    assert cache.get("a", "nl_BE") is MISSING
+    assert cache.get("a", "fr_BE") == "A fr"
+    cache.invalidate(language="fr_BE")
+    assert cache.get("a", "fr_BE") is MISSING
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_product_cursor_round_trip():
+    created_at, product_id = datetime(2024, 5, 1, 12, 30, 15, 123456), uuid.uuid4()
+    cursor = encode_cursor(created_at, product_id)
+    assert "=" not in cursor
+    assert decode_product_cursor(cursor) == (created_at, product_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor("2024-01-01"), encode_cursor("x", "y")])
+def test_product_cursor_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_product_cursor(cursor)
+
+
+def test_change_cursor_keeps_its_position_until_the_retention_passes():
+    issued_at = datetime(2024, 5, 1, 12, 0)
+    cursor = changes.encode((7305, 42), issued_at)
+    assert changes.decode(cursor, now=issued_at + timedelta(seconds=changes.CHANGES_RETENTION)) == (
+        (7305, 42), issued_at)
+    with pytest.raises(changes.CursorExpiredError):
+        changes.decode(cursor, now=issued_at + timedelta(seconds=changes.CHANGES_RETENTION + 1))
+    for garbage in ("not a cursor", encode_cursor("1", 2, issued_at), encode_cursor(1, 2)):
+        with pytest.raises(ValueError):
+            changes.decode(garbage)
+
+
+def test_change_cursor_only_gets_younger_when_the_reader_catches_up():
+    issued_at = datetime(2024, 5, 1, 12, 0)
+    older = models.Change(txid=1, id=1, created_at=issued_at - timedelta(hours=1))
+    newer = models.Change(txid=2, id=2, created_at=issued_at + timedelta(hours=1))
+    # reading on through a backlog keeps the cursor as old as what it has not read yet
+    assert changes.read_through(issued_at, older) == issued_at
+    assert changes.read_through(issued_at, newer) == newer.created_at
+    assert changes.read_through(issued_at) > issued_at
+
+
+def test_category_tree_links_every_parent():
+    now = datetime(2024, 1, 1)
+    root, left, right, leaf = (uuid.uuid4() for _ in range(4))
+    rows = [
+        (root, "root", now, now, None),
+        (left, "left", now, now, root),
+        (right, "right", now, now, root),
+        (leaf, "leaf", now, now, left),
+        (leaf, "leaf", now, now, right),
+    ]
+    nodes = _category_tree(rows)
+    assert [c.name for c in nodes[root].children] == ["left", "right"]
+    assert nodes[left].children[0] is nodes[right].children[0] is nodes[leaf]
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_bulk_csv_records_keep_line_numbers():
+    lines = iter_lines(_chunks(b"code,name,price\nA,\"a, b\",1\n\nB,b", b",\nC,c\n"))
+    records = asyncio.run(_collect(iter_records(lines, "csv")))
+    assert records[0] == (2, {"code": "A", "name": "a, b", "price": "1"})
+    assert records[1] == (4, {"code": "B", "name": "b", "price": None})
+    assert records[2][0] == 5 and isinstance(records[2][1], ValueError)
+
+
+def test_bulk_csv_records_span_quoted_newlines_and_round_trip_the_export():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([["code", "description"], ["p1", "multi\nline"], ["p2", 'say "hi",\r\n\nbye']])
+    body = buffer.getvalue() + 'p3,"never closed\n'
+    lines = iter_lines(_chunks(body[:12], body[12:]))
+    records = asyncio.run(_collect(iter_records(lines, "csv")))
+    assert records[0] == (2, {"code": "p1", "description": "multi\nline"})
+    assert records[1] == (4, {"code": "p2", "description": 'say "hi",\r\n\nbye'})
+    assert records[2][0] == 7 and isinstance(records[2][1], ValueError)
+
+
+def test_bulk_lines_decode_characters_split_across_chunks():
+    lines = asyncio.run(_collect(iter_lines(_chunks(b"caf\xc3", b"\xa9\nna\xc3", b"\xafve"))))
+    assert lines == ["caf\u00e9", "na\u00efve"]
+
+
+def test_bulk_ndjson_records_report_bad_lines():
+    lines = iter_lines(_chunks('{"code": "A"}\n[1]\n{"co', 'de": "B"}\nnope'))
+    records = asyncio.run(_collect(iter_records(lines, "ndjson")))
+    assert [line for line, _ in records] == [1, 2, 3, 4]
+    assert records[0][1] == {"code": "A"} and records[2][1] == {"code": "B"}
+    assert isinstance(records[1][1], ValueError) and isinstance(records[3][1], ValueError)
+
+
+def test_imported_category_edges_closing_a_loop_are_dropped_by_line():
+    a, b, c, d = (uuid.uuid4() for _ in range(4))
+    report = ImportReport()
+    # b sits under a already; c under b, then a under c closes a loop, d itself is one
+    edges = [(4, c, a), (2, b, c), (5, d, d), (3, a, d)]
+    accepted = _acyclic_edges([(a, b)], edges, report)
+    assert accepted == [(2, b, c), (3, a, d)]
+    assert [error.line for error in report.errors] == [4, 5]
+
+
+def test_requested_basket_amounts_are_merged_per_product():
+    a, b = uuid.uuid4(), uuid.uuid4()
+    items = [schemas.ShoppingBasketItemCreate(product_id=a), schemas.ShoppingBasketItemCreate(product_id=b, amount=3),
+             schemas.ShoppingBasketItemCreate(product_id=a, amount=2), schemas.ShoppingBasketItemCreate(product_id=None)]
+    assert requested_amounts(items) == {a: 3, b: 3}
+
+
+def test_line_tax_is_included_in_price_and_rounded_half_up():
+    assert line_tax(1210, 1, 2100) == 210
+    assert line_tax(1060, 1, 2100) == 184
+    assert line_tax(1060, 2, 600) == 120
+    assert line_tax(999, 3, 0) == 0
+
+
+def test_pool_metrics_histogram_is_cumulative():
+    pool = PoolMetrics(buckets=(0.01, 0.1, float("inf")))
+    for seconds in (0.002, 0.05, 0.5):
+        pool.observe(seconds)
+    snapshot = pool.snapshot()
+    assert snapshot["checkouts"] == 3
+    assert snapshot["wait_buckets"] == {"0.01": 1, "0.1": 2, "+Inf": 3}
+    assert snapshot["wait_max_ms"] == 500.0
+
+
+def test_memory_backend_evicts_least_recently_used_by_size():
+    backend = MemoryBackend(maxsize=10, max_bytes=10)
+    for key in "abc":
+        asyncio.run(backend.set(key, CachedResponse(b"1234")))
+    assert asyncio.run(backend.get("a")) is None
+    assert len(backend) == 2 and backend.size == 8
+    asyncio.run(backend.set("big", CachedResponse(b"x" * 11)))
+    assert asyncio.run(backend.get("big")) is None
+
+
+def test_response_etag_follows_group_versions():
+    cache = ResponseCache(MemoryBackend(), max_age=5)
+    tag = cache.etag("/api/product/v1/products", ("products", "cms"))
+    assert cache.etag("/api/product/v1/products", ("cms", "products")) == tag
+    cache.set_versions({"categories": 3})
+    assert cache.etag("/api/product/v1/products", ("products", "cms")) == tag
+    cache.set_versions({"products": 2})
+    bumped = cache.etag("/api/product/v1/products", ("products", "cms"))
+    assert bumped != tag
+    cache.set_versions({"products": 1})
+    assert cache.etag("/api/product/v1/products", ("products", "cms")) == bumped
+    assert cache.etag("/api/product/v1/products", ("products", "cms", "stock")) != bumped
+
+
+def test_stock_changes_bump_the_stock_version_on_the_next_two_ticks(monkeypatch):
+    ticks, bumps = [], []
+
+    async def sleep(interval):
+        ticks.append(interval)
+        if len(ticks) == 2:
+            http_cache.stock_changed()
+        if len(ticks) == 6:
+            raise asyncio.CancelledError
+
+    async def bump(db, *groups):
+        bumps.append((len(ticks), groups))
+        return {"stock": len(bumps)}
+
+    @asynccontextmanager
+    async def session():
+        yield None
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    monkeypatch.setattr(http_cache, "bump", bump)
+    monkeypatch.setattr(http_cache, "responses", ResponseCache(MemoryBackend()))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(http_cache.bump_stock_forever(session, interval=5))
+    assert bumps == [(2, ("stock",)), (3, ("stock",))]
+    assert http_cache.responses.versions == {"stock": 2}
+
+
+def test_search_query_matches_every_word_and_the_last_as_prefix():
+    assert tsquery_text("Hue  lamp-set") == "hue & lamp & set:*"
+    assert tsquery_text("100%_speed", prefix=False) == "100 & speed"
+    assert tsquery_text("'&!") is None
+    assert text_search_config("nl_BE") == "dutch"
+    assert text_search_config("pt_BR") == "simple"
+
+
+def test_accept_language_is_ordered_by_quality():
+    assert parse_accept_language("fr-be;q=0.8, en-GB, nl;q=0.9, de;q=0, *") == ["en_GB", "nl", "fr_BE"]
+    assert parse_accept_language(None) == []
+    assert normalize_language("zh-Hant-TW") == "zh_TW"
+    assert normalize_language("<script>") is None
+
+
+def test_language_chain_adds_base_languages_and_fallbacks():
+    chain = language_chain(["fr_BE", "en_GB"])
+    assert chain[:4] == ("fr_BE", "fr", "en_GB", "en")
+    assert chain[4:] == tuple(lang for lang in FALLBACK_LANGUAGES if lang not in chain[:4])
+    assert language_chain() == FALLBACK_LANGUAGES
+
+
+def test_translation_cache_resolves_along_the_language_chain():
+    cache = TranslationCache(maxsize=10, ttl=60)
+    cache.put("a", "fr_BE", None)
+    cache.put("a", "fr", "A fr")
+    cache.put("b", "fr_BE", None)
+    cache.put("b", "fr", None)
+    # everything is cached, so no database is needed
+    assert asyncio.run(cache.resolve(None, ["a", "b", None], ("fr_BE", "fr"))) == {"a": "A fr", "b": None}
+
+
+def _validated_json(schema, value):
+    adapter = _adapter(schema)
+    return json.loads(adapter.dump_json(adapter.validate_python(value, from_attributes=True)))
+
+
+def test_fast_serializers_match_the_response_schemas():
+    now = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    leaf = read_models.CategoryNode(uuid.uuid4(), "Leaf", now, now)
+    root = read_models.CategoryNode(uuid.uuid4(), "Root", now, now, children=[leaf])
+    product = read_models.ProductView(uuid.uuid4(), "Fiets", None, "Gazelle", "F1", 3, None, 49900,
+                                      read_models.CategoryView(leaf.id, leaf.name), now)
+    bare = read_models.ProductView(uuid.uuid4(), "Bel", "Ring", None, None, 0, "https://img/1", 500)
+    basket = read_models.ShoppingBasketView(uuid.uuid4(), "BE", 2, 3, 100400, 82975, 17425, items=[
+        read_models.ShoppingBasketItemView(uuid.uuid4(), product.id, 49900, 2, 2100, product),
+        read_models.ShoppingBasketItemView(uuid.uuid4(), uuid.uuid4(), 600, 1, 600),
+    ])
+    cases = [
+        (List[schemas.ProductRead], [product, bare]),
+        (List[schemas.CategoryRead], [root]),
+        (List[schemas.CategoryReadSimple], [leaf, root]),
+        (schemas.ShoppingBasketRead, basket),
+    ]
+    for schema, value in cases:
+        assert json.loads(serializers.dumps(serializers.ENCODERS[schema](value))) == _validated_json(schema, value)
+
+
+def test_statement_fingerprints_ignore_parameters_and_list_lengths():
+    one = "SELECT p.id FROM products p WHERE p.id IN ($1::UUID, $2::UUID) AND p.stock > 5 AND p.brand = 'Acme'"
+    other = "SELECT p.id FROM products p\n  WHERE p.id IN ($1::UUID) AND p.stock > 12 AND p.brand = 'it''s'"
+    assert normalize(one) == "SELECT p.id FROM products p WHERE p.id IN (...) AND p.stock > ? AND p.brand = ?"
+    assert fingerprint(one) == fingerprint(other)
+    assert normalize("INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4)") == "INSERT INTO t (a, b) VALUES (...)"
+    assert normalize("SELECT * FROM t WHERE created_at < $1::TIMESTAMP WITHOUT TIME ZONE") == \
+        "SELECT * FROM t WHERE created_at < ?"
+    assert fingerprint("SELECT 1 FROM products") != fingerprint("SELECT 1 FROM categories")
+
+
+def test_route_template_is_the_path_of_the_matched_route():
+    path = f"/api/shopping-basket/v1/shopping-baskets/{uuid.uuid4()}/items/7"
+    template = "/api/shopping-basket/v1/shopping-baskets/{basket_id}/items/{item}"
+    assert route_template({"path": path, "route": SimpleNamespace(path=template)}) == template
+    # the route of a router included under /api, as nested routers hand it over
+    nested = SimpleNamespace(path="/shopping-basket/v1/shopping-baskets/{basket_id}/items/{item}")
+    assert route_template({"path": path, "route": nested}) == template
+    assert route_template({"path": "/api/nope", "path_params": {}}) == "unmatched"
+
+
+def test_histograms_render_cumulative_prometheus_buckets():
+    route = RouteMetrics(buckets=(0.1, 1.0, float("inf")))
+    for seconds in (0.05, 0.5, 2.0):
+        route.observe(seconds, 200, 3, 0.01)
+    lines = []
+    _histogram(lines, "latency", route.latency, route='/say "hi"')
+    assert lines == [
+        'latency_bucket{route="/say \\"hi\\"",le="0.1"} 1',
+        'latency_bucket{route="/say \\"hi\\"",le="1.0"} 2',
+        'latency_bucket{route="/say \\"hi\\"",le="+Inf"} 3',
+        'latency_sum{route="/say \\"hi\\""} 2.55',
+        'latency_count{route="/say \\"hi\\""} 3',
+    ]
+    assert route.queries == 9 and route.statuses == {200: 3}
+    assert _labels(a="x\ny") == '{a="x\\ny"}'
+
+
+def test_checkout_replays_only_the_same_key_and_basket():
+    basket_id = uuid.uuid4()
+    order = models.Order(id=uuid.uuid4(), shopping_basket_id=basket_id, idempotency_key="key-1")
+    assert orders._replay(order, basket_id, "key-1") is order
+    with pytest.raises(orders.IdempotencyKeyReusedError):
+        orders._replay(order, uuid.uuid4(), "key-1")
+    with pytest.raises(orders.AlreadyCheckedOutError) as e:
+        orders._replay(order, basket_id, "key-2")
+    assert e.value.order is order
+
+
+def test_stored_basket_totals_and_mutations_survive_a_round_trip():
+    bike, bell = uuid.uuid4(), uuid.uuid4()
+    basket = StoredBasket(uuid.uuid4(), "BE")
+    basket.add(bike, 2, 1000, 2100)
+    basket.add(bell, 1, 250, 600)
+    basket.add(bike, 1, 1200, 600)
+    assert basket.lines[bike].amount == 3 and basket.lines[bike].price == 1000
+    basket = StoredBasket.loads(basket.dumps())
+    totals = basket.totals()
+    assert (totals.item_count, totals.quantity, totals.total_price_inclusive) == (2, 4, 3250)
+    assert totals.tax == line_tax(1000, 3, 2100) + line_tax(250, 1, 600)
+    assert totals.total_price_exclusive == 3250 - totals.tax
+    basket.set_amount(bell, 0)
+    assert list(basket.lines) == [bike] and basket.line_by_id(basket.lines[bike].id).product_id == bike
+
+
+def test_memory_basket_backend_compares_versions_and_expires():
+    clock = FakeClock()
+    backend = MemoryBasketBackend(ttl=10, clock=clock)
+    basket_id, item_id = uuid.uuid4(), uuid.uuid4()
+    assert asyncio.run(backend.put(basket_id, b"v1", 0, [item_id]))
+    assert not asyncio.run(backend.put(basket_id, b"stale", 0, []))
+    assert asyncio.run(backend.put(basket_id, b"v2", 1, [item_id]))
+    assert asyncio.run(backend.get(basket_id)) == (2, b"v2")
+    assert asyncio.run(backend.find_item(item_id)) == basket_id
+    assert asyncio.run(backend.take_dirty(10)) == [basket_id] and asyncio.run(backend.take_dirty(10)) == []
+    clock.now = 9
+    assert asyncio.run(backend.get(basket_id)) is not None
+    clock.now = 10
+    assert asyncio.run(backend.expire()) == 1
+    assert asyncio.run(backend.get(basket_id)) is None and asyncio.run(backend.find_item(item_id)) is None
+
+
+def test_setting_the_amount_of_a_product_not_in_a_stored_basket_adds_it(monkeypatch):
+    lamp = uuid.uuid4()
+
+    async def prices(db, country, product_ids):
+        # (price, tax rate, stock) as read from products
+        return {lamp: (1500, 2100, 5)} if lamp in set(product_ids) else {}
+
+    monkeypatch.setattr(basket_store, "_prices", prices)
+    store = BasketStore(MemoryBasketBackend())
+    basket = StoredBasket(uuid.uuid4(), "BE")
+    asyncio.run(store.backend.put(basket.id, basket.dumps(), 0, []))
+    basket = asyncio.run(store.set_amount(None, basket.id, lamp, 3))
+    assert basket.lines[lamp].amount == 3 and basket.totals().total_price_inclusive == 4500
+    with pytest.raises(OutOfStockError):
+        asyncio.run(store.set_amount(None, basket.id, lamp, 6))
+    assert asyncio.run(store.set_amount(None, basket.id, lamp, 1)).lines[lamp].amount == 1
+
+
+def test_a_basket_locked_for_checkout_rejects_mutations_until_the_lock_runs_out():
+    store = BasketStore(MemoryBasketBackend())
+    basket = StoredBasket(uuid.uuid4(), "BE", locked_until=time.time() + 60)
+    assert asyncio.run(store.backend.put(basket.id, basket.dumps(), 0, []))
+    with pytest.raises(BasketConflictError, match="checked out"):
+        asyncio.run(store.mutate(basket.id, lambda b: b.add(uuid.uuid4(), 1, 100, 2100)))
+    assert not asyncio.run(store.backend.delete(basket.id, expected=2))
+
+    basket.locked_until = time.time() - 1
+    assert asyncio.run(store.backend.put(basket.id, basket.dumps(), 1, []))
+    assert asyncio.run(store.mutate(basket.id, lambda b: b.add(uuid.uuid4(), 1, 100, 2100))).totals().quantity == 1
+    assert asyncio.run(store.backend.delete(basket.id, expected=3))
+    assert asyncio.run(store.get(basket.id)) is None
+
+
+def test_loader_coalesces_lookups_of_one_tick_into_one_batch():
+    class Session:
+        info = {}
+
+    batches = []
+
+    async def batch(db, keys):
+        batches.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    async def main():
+        db = Session()
+        loader = loaders.loader(db, "numbers", batch)
+        assert loaders.loader(db, "numbers", batch) is loader
+        values = await asyncio.gather(loader.load(1), loader.load(2), loader.load(1), loader.load(3))
+        assert values == [10, 20, 10, None]
+        assert await loader.load_many([4, 3, 2]) == {4: 40, 2: 20}
+        return loader.batches
+
+    assert asyncio.run(main()) == 2
+    assert batches == [[1, 2, 3], [2, 3, 4]]
+
+
+def test_product_view_answers_only_the_chain_of_its_languages():
+    assert product_view.view_language(DEFAULT_LANGUAGES) == product_view.PRODUCT_VIEW_LANGUAGES[0]
+    assert product_view.view_language(language_chain(["nl_BE"])) == "nl_BE"
+    assert product_view.view_language(language_chain(["nl_BE", "fr_BE"])) is None
+    assert product_view.view_language(language_chain(["xx"])) is None
+
+
+def test_adaptive_limit_backs_off_once_per_round_trip_and_grows_back():
+    limit = admission.AdaptiveLimit(10, tolerance=2, recent_weight=1.0, baseline_weight=0.0)
+    limit.observe(0.0, 0.01, inflight=10)
+    assert limit.current == 10
+    limit.observe(0.0, 0.05, inflight=10)
+    limit.observe(0.01, 0.05, inflight=10)
+    assert limit.current == 9
+    limit.observe(0.1, 0.05, inflight=10)
+    assert limit.current == 8
+    for _ in range(20):
+        limit.observe(1.0, 0.01, inflight=10)
+    assert limit.current == 10
+    limit.observe(2.0, 0.01, inflight=0, overloaded=True)
+    assert limit.current == 9
+
+
+def test_admission_sheds_past_the_queue_and_serves_priority_groups_first():
+    def group(name, limit, priority=False):
+        return admission.Group(name, admission.AdaptiveLimit(limit), queue_size=1, priority=priority)
+
+    async def main():
+        control = admission.AdmissionControl(
+            [group("basket", 4, priority=True), group("catalog", 4)], capacity=3, reserved=1, queue_timeout=1)
+        await control.acquire("catalog")
+        await control.acquire("catalog")
+        # the last slot is kept for baskets
+        catalog = asyncio.ensure_future(control.acquire("catalog"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(admission.OverloadedError):
+            await control.acquire("catalog")
+        await control.acquire("basket")
+        basket = asyncio.ensure_future(control.acquire("basket"))
+        await asyncio.sleep(0.01)
+        control.release("catalog", 0.0, 0.01)
+        await asyncio.sleep(0.01)
+        assert basket.done() and not catalog.done()
+        control.release("basket", 0.0, 0.01)
+        control.release("basket", 0.0, 0.01)
+        await asyncio.sleep(0.01)
+        assert catalog.done()
+        return control.status()
+
+    status = asyncio.run(main())
+    assert status["catalog"]["shed"] == {"queue_full": 1} and status["catalog"]["inflight"] == 2
+    assert status["basket"]["admitted"] == 2
+
+
+def test_requests_are_grouped_by_route():
+    assert admission.classify("POST", "/api/order/v1/orders") == admission.CHECKOUT
+    assert admission.classify("PATCH", "/api/shopping-basket/v1/shopping-baskets/1") == admission.BASKET
+    assert admission.classify("GET", "/api/product/v1/products") == admission.CATALOG
+    assert admission.classify("PUT", "/api/product/v1/1") == admission.ADMIN
+    assert admission.classify("GET", "/api/bulk/v1/products") == admission.BULK
+    assert admission.classify("GET", "/api/changes/v1/stream") is None
+    assert admission.classify("GET", "/docs") is None